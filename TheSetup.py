@@ -6,12 +6,25 @@ from CAENpy.CAENDesktopHighVoltagePowerSupply import CAENDesktopHighVoltagePower
 from keithley.Keithley2470 import Keithley2470SafeForLGADs # https://github.com/SengerM/keithley
 import time
 import warnings
-from processfriendlylock.CrossProcessLock import CrossProcessNamedLock # https://github.com/SengerM/processfriendlylock
+import numpy
+from named_locks import FairNamedLock
 import EasySensirion # https://github.com/SengerM/EasySensirion
 # ~ import ElectroAutomatikGmbHPy # https://github.com/SengerM/ElectroAutomatikGmbHPy
 # ~ from ElectroAutomatikGmbHPy.ElectroAutomatikGmbHPowerSupply import ElectroAutomatikGmbHPowerSupply # https://github.com/SengerM/ElectroAutomatikGmbHPy
 from threading import RLock
-from multiprocessing.managers import BaseManager
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import concurrent.futures
+import functools
+import inspect
+import itertools
+import pickle
+import struct
+import socket
+import hmac
+import os
+from contextlib import contextmanager
 from pathlib import Path
 import logging
 
@@ -67,6 +80,13 @@ class TheTCTSetup:
 		self._keithley_Lock = RLock()
 		self._sensirion_Lock = RLock()
 		self._peltier_DC_power_supply_Lock = RLock()
+	
+	# Nominal conversion from ADC counts to volts for the CAEN DT5742, which
+	# is a 12 bit digitizer with 1 V peak to peak of dynamic range. Change
+	# the values for a specific channel here if a better calibration is known.
+	# Use `check_digitizer_calibration` to compare it with the conversion
+	# done by CAENpy.
+	CAEN_DIGITIZER_CALIBRATION = {n_channel: {'Gain (V/ADCu)': 1/2**12, 'Offset (V)': -.5} for n_channel in range(16)}
 		
 	# Motorized xyz stages ---------------------------------------------
 	
@@ -318,7 +338,7 @@ class TheTCTSetup:
 				raise RuntimeError('No oscilloscope found in the setup!')
 			self._last_trigger_time = time.time()
 	
-	def get_waveform(self, n_channel:int)->list:
+	def get_waveform(self, n_channel:int, in_ADCu:bool=False)->list:
 		"""Gets the waveform from the acquisition system for the specified 
 		channel.
 		
@@ -326,6 +346,15 @@ class TheTCTSetup:
 		---------
 		n_channel: int
 			Number of channel from which to bring the waveform.
+		in_ADCu: bool, default False
+			If `True` the samples are returned as raw ADC counts in a
+			`numpy.int16` array under the key `'Amplitude (ADCu)'` instead
+			of `'Amplitude (V)'`, which is 4 times lighter. Use `get_digitizer_calibration`
+			to convert them into volts. Only available for the CAEN digitizer.
+			The CAEN digitizer is read once per trigger, in volts converted
+			by CAENpy or in ADC units according to `in_ADCu`. If it is asked
+			the other way for the same trigger, the event that was read is
+			converted with `get_digitizer_calibration` instead of reading again.
 		
 		Returns
 		-------
@@ -344,15 +373,26 @@ class TheTCTSetup:
 			will be a list with only one element.
 		"""
 		with self._oscilloscope_Lock:
+			if in_ADCu and not hasattr(self, '_CAEN_digitizer'):
+				raise RuntimeError('Waveforms in ADC units are only available for the CAEN digitizer.')
 			if hasattr(self, '_LeCroy'):
 				waveform_data = self._LeCroy.get_waveform(n_channel=n_channel)['waveforms']
 			elif hasattr(self, '_drs4_evaluation_board'):
 				waveform_data = self._drs4_evaluation_board.get_waveform(n_channel)
 			elif hasattr(self, '_CAEN_digitizer'):
 				if not hasattr(self,'_last_waveforms_readout_time') or self._last_waveforms_readout_time<self._last_trigger_time:
-					self._latest_waveforms = self._CAEN_digitizer.get_waveforms(get_time=True, get_ADCu_instead_of_volts=False)
+					self._latest_waveforms = self._CAEN_digitizer.get_waveforms(get_time=True, get_ADCu_instead_of_volts=in_ADCu)
+					self._latest_waveforms_are_in_ADCu = in_ADCu
 					self._last_waveforms_readout_time = time.time()
-				waveform_data = [event_data[f'CH{n_channel}'] for event_data in self._latest_waveforms]
+				waveform_data = [dict(event_data[f'CH{n_channel}']) for event_data in self._latest_waveforms]
+				calibration = self.CAEN_DIGITIZER_CALIBRATION[n_channel]
+				for event_data in waveform_data:
+					if in_ADCu and self._latest_waveforms_are_in_ADCu:
+						event_data['Amplitude (ADCu)'] = numpy.asarray(event_data['Amplitude (ADCu)']).astype(numpy.int16) # The DT5742 is 12 bits, so this is lossless.
+					elif in_ADCu: # This event was read in volts.
+						event_data['Amplitude (ADCu)'] = numpy.round((numpy.asarray(event_data.pop('Amplitude (V)')) - calibration['Offset (V)'])/calibration['Gain (V/ADCu)']).astype(numpy.int16)
+					elif self._latest_waveforms_are_in_ADCu: # This event was read in ADC units.
+						event_data['Amplitude (V)'] = numpy.asarray(event_data.pop('Amplitude (ADCu)'))*calibration['Gain (V/ADCu)'] + calibration['Offset (V)']
 				# The following is because of bugs in the CAEN digitizers, it is better to drop data close to the edges of the time window.
 				drop_these_data = (waveform_data[0]['Time (s)']>140e-9)
 				for i,event_data in enumerate(waveform_data):
@@ -364,6 +404,41 @@ class TheTCTSetup:
 			waveform_data = [waveform_data]
 		return waveform_data
 	
+	def check_digitizer_calibration(self, tolerance_V:float=5e-3)->dict:
+		"""Compare `CAEN_DIGITIZER_CALIBRATION` with the conversion into
+		volts done by CAENpy and log a warning for the channels where they
+		differ by more than `tolerance_V`. The same event cannot be read
+		twice, so two triggers are acquired, one read in ADC units and the
+		other in volts, and the median of all the samples of each channel,
+		which is the baseline, is compared. Returns `{n_channel: difference in volts}`."""
+		if not hasattr(self, '_CAEN_digitizer'):
+			raise RuntimeError('The calibration from ADC units to volts is only available for the CAEN digitizer.')
+		with self._oscilloscope_Lock:
+			waveforms = {}
+			for in_ADCu in [True, False]:
+				self.wait_for_trigger()
+				waveforms[in_ADCu] = self._CAEN_digitizer.get_waveforms(get_time=True, get_ADCu_instead_of_volts=in_ADCu)
+		differences = {}
+		for channel in waveforms[True][0]:
+			n_channel = int(channel.replace('CH',''))
+			calibration = self.CAEN_DIGITIZER_CALIBRATION[n_channel]
+			converted = numpy.median(numpy.concatenate([event_data[channel]['Amplitude (ADCu)'] for event_data in waveforms[True]]))*calibration['Gain (V/ADCu)'] + calibration['Offset (V)']
+			by_CAENpy = numpy.median(numpy.concatenate([event_data[channel]['Amplitude (V)'] for event_data in waveforms[False]]))
+			differences[n_channel] = float(converted - by_CAENpy)
+		wrong = {n_channel: difference for n_channel,difference in differences.items() if abs(difference) > tolerance_V}
+		if len(wrong) > 0:
+			logging.warning(f'`CAEN_DIGITIZER_CALIBRATION` does not agree with CAENpy, the baseline differs by {wrong} volts for each of these channels, so the waveforms stored in ADC units will be off by this much once converted into volts. ')
+		return differences
+	
+	def get_digitizer_calibration(self)->dict:
+		"""Returns the calibration to convert the samples obtained with 
+		`get_waveform(in_ADCu=True)` into volts, as a dictionary of the
+		form `{n_channel: {'Gain (V/ADCu)': float, 'Offset (V)': float}}`
+		such that `volts = ADCu*gain + offset`."""
+		if not hasattr(self, '_CAEN_digitizer'):
+			raise RuntimeError('The calibration from ADC units to volts is only available for the CAEN digitizer.')
+		return {n_channel: dict(calibration) for n_channel,calibration in self.CAEN_DIGITIZER_CALIBRATION.items()}
+	
 	def set_oscilloscope_vdiv(self, n_channel:int, vdiv:float)->None:
 		"""Sets the oscilloscope's vertical scale.
 		
@@ -474,17 +549,29 @@ class TheTCTSetup:
 
 class TheTCTSetupWithNamedLocks(TheTCTSetup):
 	"""This class wraps the `TheTCTSetup` such that it can be used with
-	named locks in a multiprocess environment."""
+	named locks in a multiprocess environment. The locks are given in
+	order of priority and then of arrival, see `FairNamedLock`, and who
+	holds and waits for each can be seen with `get_named_locks_status`."""
 	def __init__(self):
 		super().__init__()
 		
 		# User named locks ---
-		self._bias_voltage_holding_Lock = CrossProcessNamedLock(Path.home())
-		self._signal_acquisition_holding_Lock = CrossProcessNamedLock(Path.home())
-		self._tct_holding_Lock = CrossProcessNamedLock(Path.home())
-		self._temperature_system_holding_Lock = CrossProcessNamedLock(Path.home())
+		self._bias_voltage_holding_Lock = FairNamedLock('bias')
+		self._signal_acquisition_holding_Lock = FairNamedLock('signal_acquisition')
+		self._tct_holding_Lock = FairNamedLock('tct')
+		self._temperature_system_holding_Lock = FairNamedLock('temperature')
+		self._named_locks = {lock.name: lock for lock in [self._bias_voltage_holding_Lock, self._signal_acquisition_holding_Lock, self._tct_holding_Lock, self._temperature_system_holding_Lock]}
 	
-	def hold_signal_acquisition(self, who:str):
+	def get_named_locks_status(self)->dict:
+		"""Return `{name: status}` for each of the named locks, see `FairNamedLock.status`."""
+		return {name: lock.status() for name,lock in self._named_locks.items()}
+	
+	def get_named_locks_contention(self)->dict:
+		"""Return `{name: contention}` for each of the named locks, i.e.
+		how long each `who` waited for them, see `FairNamedLock.contention`."""
+		return {name: lock.contention() for name,lock in self._named_locks.items()}
+	
+	def hold_signal_acquisition(self, who:str, priority:float=0):
 		"""When this is called in a `with` statement, it will guarantee
 		the exclusive control of the signal acquisition system, i.e. the
 		oscilloscope.
@@ -497,6 +584,9 @@ class TheTCTSetupWithNamedLocks(TheTCTSetup):
 			because it will give all your imported modules the same name.
 			This is a workaround because, surprisingly,  the Locks in python
 			are not multiprocess friendly.
+		priority: float, default 0
+			If others are waiting for it too, the highest priority gets
+			it first, e.g. for a quick check while a long scan is running.
 		
 		Example
 		-------
@@ -505,9 +595,9 @@ class TheTCTSetupWithNamedLocks(TheTCTSetup):
 			# Nobody else from other thread can change anything from the oscilloscope, only read it.
 		```
 		"""
-		return self._signal_acquisition_holding_Lock(who)
+		return self._signal_acquisition_holding_Lock(who, priority=priority)
 	
-	def hold_control_of_bias(self, who:str):
+	def hold_control_of_bias(self, who:str, priority:float=0):
 		"""When this is called in a `with` statement, it will guarantee
 		the exclusive control of the bias power supply. No one else will
 		be able to act on the power supply, only read from it.
@@ -520,6 +610,9 @@ class TheTCTSetupWithNamedLocks(TheTCTSetup):
 			because it will give all your imported modules the same name.
 			This is a workaround because, surprisingly,  the Locks in python
 			are not multiprocess friendly.
+		priority: float, default 0
+			If others are waiting for it too, the highest priority gets
+			it first, e.g. for a quick check while a long scan is running.
 		
 		Example
 		-------
@@ -529,9 +622,9 @@ class TheTCTSetupWithNamedLocks(TheTCTSetup):
 			the_setup.set_bias_voltage(volts, my_name) # This will not change unless you change it here.
 		```
 		"""
-		return self._bias_voltage_holding_Lock(who)
+		return self._bias_voltage_holding_Lock(who, priority=priority)
 	
-	def hold_tct_control(self, who:str):
+	def hold_tct_control(self, who:str, priority:float=0):
 		"""When this is called in a `with` statement, it will guarantee
 		the exclusive control of the TCT setup, this is the laser and the
 		movable stages.
@@ -544,10 +637,13 @@ class TheTCTSetupWithNamedLocks(TheTCTSetup):
 			because it will give all your imported modules the same name.
 			This is a workaround because, surprisingly,  the Locks in python
 			are not multiprocess friendly.
+		priority: float, default 0
+			If others are waiting for it too, the highest priority gets
+			it first, e.g. for a quick check while a long scan is running.
 		"""
-		return self._tct_holding_Lock(who)
+		return self._tct_holding_Lock(who, priority=priority)
 	
-	def hold_temperature_control(self, who:str):
+	def hold_temperature_control(self, who:str, priority:float=0):
 		"""When this is called in a `with` statement, it will guarantee
 		the exclusive control of the temperature system, i.e. the Peltier
 		cells.
@@ -560,8 +656,11 @@ class TheTCTSetupWithNamedLocks(TheTCTSetup):
 			because it will give all your imported modules the same name.
 			This is a workaround because, surprisingly,  the Locks in python
 			are not multiprocess friendly.
+		priority: float, default 0
+			If others are waiting for it too, the highest priority gets
+			it first, e.g. for a quick check while a long scan is running.
 		"""
-		return self._temperature_system_holding_Lock(who)
+		return self._temperature_system_holding_Lock(who, priority=priority)
 	
 	def move_to(self, who:str, x:float=None, y:float=None, z:float=None)->None:
 		"""Move the TCT stages to the specified position.
@@ -804,15 +903,892 @@ class WhoWrapper:
 					raise e
 		return wrapped
 	
-def connect_me_with_the_setup(who:str):
-	class TheSetup(BaseManager):
-		pass
+# Server and client ----------------------------------------------------
+
+SETUP_ADDRESS = ('localhost', 50000)
+if 'TCT_SETUP_ADDRESS' in os.environ: # E.g. `export TCT_SETUP_ADDRESS=192.168.1.10:50000` to use the setup from another computer.
+	SETUP_ADDRESS = (os.environ['TCT_SETUP_ADDRESS'].rsplit(':',1)[0], int(os.environ['TCT_SETUP_ADDRESS'].rsplit(':',1)[1]))
+SETUP_AUTHKEY = b'abracadabra'
+TIMEOUT_SECONDS = 120 # Default for each request, enough to ramp the bias voltage.
+HEARTBEAT_SECONDS = 5 # The clients ping the server this often, and the server drops the clients it does not hear from in a few of these.
+RECONNECT_TIMEOUT_SECONDS = 300 # How long the clients keep trying to reconnect after losing the connection, e.g. if the server is restarted.
+NAMED_LOCK_LEASE_SECONDS = 6*HEARTBEAT_SECONDS # A named lock held by a client that stops sending heartbeats is released after this, if someone else is waiting for it.
+
+# Each instrument has its own queue of commands, so e.g. reading the
+# temperature never waits for the digitizer. The stages and the laser
+# are different devices even though they share `_tct_Lock`.
+METHODS_OF_DEVICE = {
+	'stages': ['move_to','get_stages_position'],
+	'laser': ['get_laser_status','set_laser_status','get_laser_DAC','set_laser_DAC','get_laser_frequency','set_laser_frequency'],
+	'digitizer': ['configure_oscilloscope_for_two_pulses','configure_oscilloscope_sequence_acquisition','wait_for_trigger','get_waveform','get_digitizer_calibration','check_digitizer_calibration','set_oscilloscope_vdiv'],
+	'bias': ['measure_bias_voltage','set_bias_voltage','measure_bias_current','get_current_compliance','set_current_compliance','get_bias_output_status','set_bias_output_status'],
+	'sensirion': ['measure_temperature','measure_humidity'],
+	'peltier': ['get_peltier_set_voltage','set_peltier_voltage','get_peltier_set_current','set_peltier_current','measure_peltier_voltage','measure_peltier_current','get_peltier_status','set_peltier_status'],
+	'named_locks': ['get_named_locks_status','get_named_locks_contention'],
+}
+# Slow control quantities that the server samples on its own and publishes
+# to the subscribers, see `SetupClient.get_telemetry`, and the seconds
+# between samples. They are named as the method used to read them.
+TELEMETRY_PERIODS_SECONDS = {
+	'measure_temperature': 1,
+	'measure_humidity': 1,
+	'measure_bias_voltage': 1,
+	'measure_bias_current': 1,
+	'get_current_compliance': 1,
+	'get_bias_output_status': 1,
+	'get_laser_status': 1,
+	'get_laser_DAC': 1,
+	'get_laser_frequency': 1,
+	'get_peltier_status': 1,
+	'measure_peltier_voltage': 1,
+	'measure_peltier_current': 1,
+	'get_named_locks_status': 1,
+	'get_named_locks_contention': 10,
+}
+TELEMETRY_MAX_BUFFERED_BYTES = 2**20 # Values for a subscriber that does not keep up are dropped beyond this.
+
+# The name of the `FairNamedLock` of `TheTCTSetupWithNamedLocks` that the methods with a `who` argument of each device use.
+NAMED_LOCK_OF_DEVICE = {
+	'stages': 'tct',
+	'laser': 'tct',
+	'digitizer': 'signal_acquisition',
+	'bias': 'bias',
+	'peltier': 'temperature',
+}
+# The name of the `FairNamedLock` that each `hold_*` method of `TheTCTSetupWithNamedLocks` holds.
+NAMED_LOCK_OF_HOLD_METHOD = {
+	'hold_signal_acquisition': 'signal_acquisition',
+	'hold_control_of_bias': 'bias',
+	'hold_tct_control': 'tct',
+	'hold_temperature_control': 'temperature',
+}
+
+def _pack(obj)->bytes:
+	data = pickle.dumps(obj)
+	return struct.pack('!Q', len(data)) + data
+
+async def _receive(reader:asyncio.StreamReader):
+	size, = struct.unpack('!Q', await reader.readexactly(8))
+	return pickle.loads(await reader.readexactly(size))
+
+def _receive_blocking(file):
+	header = file.read(8)
+	if len(header) < 8:
+		raise ConnectionError('Connection closed by the other end.')
+	size, = struct.unpack('!Q', header)
+	data = file.read(size)
+	if len(data) < size:
+		raise ConnectionError('Connection closed by the other end.')
+	return pickle.loads(data)
+
+def _portable_signature(function)->inspect.Signature:
+	"""Signature of a method without `self` and without the annotations,
+	so it can be unpickled where the annotations are not importable."""
+	signature = inspect.signature(function)
+	return signature.replace(
+		parameters = [p.replace(annotation=inspect.Parameter.empty) for p in list(signature.parameters.values())[1:]],
+		return_annotation = inspect.Signature.empty,
+	)
+
+class DeviceWorker:
+	"""Executes the commands for one instrument one after the other, in
+	the order they arrive, in a thread of its own so the event loop of
+	the server is never blocked by the hardware."""
+	def __init__(self, name:str):
+		self.name = name
+		self._queue = asyncio.Queue()
+		self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+		self.current_command = None
+
+	def qsize(self)->int:
+		return self._queue.qsize()
+
+	async def submit(self, function, *args, **kwargs):
+		"""Put `function(*args, **kwargs)` in the queue and wait for its
+		result. If this is cancelled, e.g. because of a timeout, before it
+		is its turn, it is not executed at all."""
+		future = asyncio.get_running_loop().create_future()
+		await self._queue.put((future, function, args, kwargs))
+		return await future
+
+	async def run_forever(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			future, function, args, kwargs = await self._queue.get()
+			if future.cancelled():
+				continue
+			try:
+				self.current_command = function.__name__
+				result = await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+			except Exception as e:
+				if not future.cancelled():
+					future.set_exception(e)
+			else:
+				if not future.cancelled():
+					future.set_result(result)
+			finally:
+				self.current_command = None
+
+class TheSetupServer:
+	"""Serves a `TheTCTSetupWithNamedLocks` to other processes, see `SetupClient`.
+	
+	Each request is executed by the `DeviceWorker` of the instrument it
+	acts on, see `METHODS_OF_DEVICE`, so requests to different instruments
+	run at the same time and requests to the same instrument run one after
+	the other. The methods that need a named lock, i.e. those with a `who`
+	argument, wait for it before entering the queue of the instrument,
+	so a request waiting for a lock held by someone else never blocks
+	the instrument for the owner of the lock.
+	
+	Every request has a timeout. If it expires while the request is still
+	in the queue it is never executed, but if the instrument is already
+	executing it then it finishes anyway since the hardware calls cannot
+	be interrupted, only its result is discarded.
+	
+	The slow control quantities in `telemetry_periods_seconds` are sampled
+	by the server itself and the timestamped values are published to
+	all the clients that subscribed to them, so the load on the instruments
+	does not depend on how many monitors are open. The last value of
+	each is kept and sent right away to new subscribers.
+	
+	Besides the methods of the setup, the server has some of its own:
+	`get_signatures`, so the clients know the arguments of each method,
+	`call_many`, to execute several independent calls in a single
+	request, see `SetupClient.call_many`, `acquire_named_lock` and
+	`release_named_lock`, for the `hold_*` methods, and `ping`, for the
+	heartbeats, which also renew the leases of the named locks held by
+	the client, see `named_lock_lease_seconds`.
+	Connections that send nothing, not even heartbeats, for more than
+	`seconds_without_messages_to_disconnect` are closed.
+	
+	`the_setup` can be any object with the methods in `METHODS_OF_DEVICE`
+	that are going to be called and the `FairNamedLock`s in `_named_locks`,
+	e.g. `StandInSetup` from `stand_in_setup.py`, without hardware, to
+	test the clients. `stop` closes the server and all its connections.
+	"""
+	def __init__(self, the_setup:TheTCTSetupWithNamedLocks, address:tuple=('',SETUP_ADDRESS[1]), authkey:bytes=SETUP_AUTHKEY, timeout_seconds:float=TIMEOUT_SECONDS, telemetry_periods_seconds:dict=TELEMETRY_PERIODS_SECONDS, seconds_without_messages_to_disconnect:float=4*HEARTBEAT_SECONDS, named_lock_lease_seconds:float=NAMED_LOCK_LEASE_SECONDS):
+		self.the_setup = the_setup
+		self.named_lock_lease_seconds = named_lock_lease_seconds
+		self.telemetry_periods_seconds = telemetry_periods_seconds
+		self.seconds_without_messages_to_disconnect = seconds_without_messages_to_disconnect
+		self.address = address
+		self.authkey = authkey
+		self.timeout_seconds = timeout_seconds
+		self._device_of_method = {method: device for device,methods in METHODS_OF_DEVICE.items() for method in methods}
+		for method in dir(TheTCTSetupWithNamedLocks):
+			if not method.startswith('_') and callable(getattr(TheTCTSetupWithNamedLocks, method)) and not method.startswith('hold_') and method not in self._device_of_method:
+				raise RuntimeError(f'Method {repr(method)} is not assigned to any device in `METHODS_OF_DEVICE`. ')
+		self._named_lock_of_method = {
+			method: NAMED_LOCK_OF_DEVICE[device]
+			for method,device in self._device_of_method.items()
+			if 'who' in inspect.signature(getattr(TheTCTSetupWithNamedLocks, method)).parameters
+		}
+		self._signatures = {
+			method: _portable_signature(getattr(TheTCTSetupWithNamedLocks, method))
+			for method in dir(TheTCTSetupWithNamedLocks)
+			if not method.startswith('_') and callable(getattr(TheTCTSetupWithNamedLocks, method))
+		}
+		for quantity in telemetry_periods_seconds:
+			if quantity not in self._device_of_method or quantity in self._named_lock_of_method:
+				raise ValueError(f'Telemetry quantity {repr(quantity)} must be a method of the setup that does not need a named lock. ')
+		self._incarnation = os.urandom(8).hex() # So the clients can tell whether the server was restarted, see `_renew_named_locks`.
+		self._last_values = {} # `{quantity: (timestamp, value)}`
+		self._subscribers = {} # `{writer: set of quantities}`
+
+	async def _run_holding_named_lock(self, named_lock:FairNamedLock, who:str, worker:DeviceWorker, function, args, kwargs):
+		await named_lock.acquire_async(who)
+		try:
+			return await worker.submit(function, *args, **kwargs)
+		finally:
+			named_lock.release(who)
+
+	async def _acquire_named_lock(self, name:str, who:str, priority:float=0)->str:
+		"""Acquire the named lock `name` on behalf of a client, with a
+		lease that the client renews with its heartbeats, see `_renew_named_locks`.
+		Returns the incarnation of the server, for the heartbeats."""
+		await self.the_setup._named_locks[name].acquire_async(who, priority=priority, lease_seconds=self.named_lock_lease_seconds)
+		return self._incarnation
+
+	def _renew_named_locks(self, held_named_locks:dict=None)->dict:
+		"""Renew the leases of `held_named_locks`, `{(name, who): (count, incarnation)}`
+		with the incarnation of the server in which each was acquired.
+		Those acquired in a previous incarnation are taken back if they
+		are free, since this one has no record of them, but those acquired
+		in this one are not, since if they are free they were released or
+		expired. Returns the current incarnation and the list of `(name, who)`
+		that were lost."""
+		lost = []
+		for (name, who),(count, incarnation) in (held_named_locks or {}).items():
+			if not self.the_setup._named_locks[name].renew(who, lease_seconds=self.named_lock_lease_seconds, count=count, take_back_if_free=incarnation!=self._incarnation):
+				lost.append((name, who))
+		return {'incarnation': self._incarnation, 'lost': lost}
+
+	async def _execute_many(self, calls:list)->list:
+		"""Execute `calls`, a list of `(method, args, kwargs)`, and return a
+		list of `('result', value)` or `('exception', exception)`. The calls
+		to different instruments run at the same time and those to the same
+		instrument one after the other in the given order."""
+		outcomes = [None]*len(calls)
+		async def execute_one_after_the_other(indices:list):
+			for i in indices:
+				method, args, kwargs = calls[i]
+				try:
+					outcomes[i] = ('result', await self._execute(method, args, kwargs))
+				except Exception as e:
+					outcomes[i] = ('exception', e)
+		indices_of_device = {}
+		for i,(method,_,_) in enumerate(calls):
+			indices_of_device.setdefault(self._device_of_method.get(method, method), []).append(i)
+		await asyncio.gather(*[execute_one_after_the_other(indices) for indices in indices_of_device.values()])
+		return outcomes
+
+	async def _execute(self, method:str, args:tuple, kwargs:dict):
+		# Methods of the server itself:
+		if method == 'ping':
+			return self._renew_named_locks(*args, **kwargs)
+		if method == 'get_signatures':
+			return self._signatures
+		if method == 'call_many':
+			return await self._execute_many(*args, **kwargs)
+		if method == 'acquire_named_lock':
+			return await self._acquire_named_lock(*args, **kwargs)
+		if method == 'release_named_lock':
+			return self.the_setup._named_locks[args[0]].release(*args[1:], **kwargs)
+		# Methods of the setup:
+		kwargs = dict(kwargs)
+		if method in NAMED_LOCK_OF_HOLD_METHOD:
+			raise RuntimeError(f'`{method}` has to be used through a `SetupProxy`, see `connect_me_with_the_setup`. ')
+		if method not in self._device_of_method:
+			raise AttributeError(f'`TheTCTSetupWithNamedLocks` has no method {repr(method)}. ')
+		worker = self._workers[self._device_of_method[method]]
+		if method in self._named_lock_of_method:
+			if 'who' not in kwargs:
+				raise TypeError(f'{method}() missing required argument: \'who\'')
+			return await self._run_holding_named_lock(
+				named_lock = self.the_setup._named_locks[self._named_lock_of_method[method]],
+				who = kwargs['who'],
+				worker = worker,
+				function = getattr(self.the_setup, method), # It enters the named lock again, which `who` already holds.
+				args = args,
+				kwargs = kwargs,
+			)
+		kwargs.pop('who', None) # Not needed by this method, `WhoWrapper` sends it anyway.
+		return await worker.submit(getattr(self.the_setup, method), *args, **kwargs)
+
+	async def _respond(self, request:dict, writer:asyncio.StreamWriter, write_lock:asyncio.Lock):
+		timeout = request.get('timeout', self.timeout_seconds)
+		task = asyncio.create_task(self._execute(request['method'], request.get('args',()), request.get('kwargs',{})))
+		try:
+			done, _ = await asyncio.wait({task}, timeout=timeout)
+		except asyncio.CancelledError: # The client cancelled it or disconnected.
+			task.cancel()
+			raise
+		if task in done:
+			try:
+				response = {'id': request['id'], 'result': task.result()}
+			except Exception as e:
+				logging.warning(f'{request["method"]} from {request.get("kwargs",{}).get("who")} raised {repr(e)}')
+				response = {'id': request['id'], 'exception': e}
+		else:
+			task.cancel()
+			message = f'`{request["method"]}` did not finish within {timeout} s'
+			if request['method'] in self._named_lock_of_method:
+				message += f', maybe someone else is holding the named lock {repr(self._named_lock_of_method[request["method"]])}'
+			if request['method'] in self._device_of_method:
+				worker = self._workers[self._device_of_method[request['method']]]
+				message += f', the {worker.name} was busy with `{worker.current_command}` and {worker.qsize()} more commands in the queue'
+			response = {'id': request['id'], 'exception': TimeoutError(message + '. ')}
+		try:
+			data = _pack(response)
+		except Exception as e:
+			data = _pack({'id': request['id'], 'exception': RuntimeError(f'Cannot send the result of `{request["method"]}` because of {repr(e)}. ')})
+		async with write_lock:
+			writer.write(data)
+			await writer.drain()
+
+	def _publish(self, quantity:str, timestamp:float, value):
+		self._last_values[quantity] = (timestamp, value)
+		try:
+			data = _pack({'telemetry': quantity, 'time': timestamp, 'value': value})
+		except Exception as e:
+			data = _pack({'telemetry': quantity, 'time': timestamp, 'value': RuntimeError(f'Cannot send the value of {quantity} because of {repr(e)}. ')})
+		for writer,quantities in list(self._subscribers.items()):
+			if quantity in quantities and writer.transport.get_write_buffer_size() < TELEMETRY_MAX_BUFFERED_BYTES:
+				writer.write(data)
 
-	TheSetup.register('get_the_setup')
-	m = TheSetup(address=('', 50000), authkey=b'abracadabra')
-	m.connect()
-	the_setup = m.get_the_setup()
-	return WhoWrapper(object_to_wrap=the_setup, who=who)
+	async def _sample_forever(self, quantity:str, period_seconds:float):
+		"""Sample `quantity` every `period_seconds` and publish it. If it
+		cannot be read the exception is published instead of the value."""
+		worker = self._workers[self._device_of_method[quantity]]
+		last_error = None
+		while True:
+			started = time.time()
+			try:
+				value = await asyncio.wait_for(worker.submit(getattr(self.the_setup, quantity)), timeout=self.timeout_seconds)
+			except Exception as e:
+				value = e
+				if repr(e) != last_error: # Log it only once, not every `period_seconds`.
+					logging.warning(f'Cannot sample {quantity} because of {repr(e)}.')
+				last_error = repr(e)
+			else:
+				last_error = None
+			self._publish(quantity, time.time(), value)
+			await asyncio.sleep(max(0, period_seconds - (time.time()-started)))
+
+	def _subscribe(self, request:dict, writer:asyncio.StreamWriter)->dict:
+		unknown = set(request['subscribe']) - set(self.telemetry_periods_seconds)
+		if len(unknown) > 0:
+			return {'id': request['id'], 'exception': ValueError(f'{sorted(unknown)} are not published, the available quantities are {sorted(self.telemetry_periods_seconds)}. ')}
+		self._subscribers.setdefault(writer, set()).update(request['subscribe'])
+		return {'id': request['id'], 'result': {quantity: self._last_values[quantity] for quantity in request['subscribe'] if quantity in self._last_values}}
+
+	async def _authenticate(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter)->bool:
+		challenge = os.urandom(32)
+		writer.write(_pack(challenge))
+		await writer.drain()
+		answer = await asyncio.wait_for(_receive(reader), timeout=10)
+		if not isinstance(answer, bytes) or not hmac.compare_digest(answer, hmac.new(self.authkey, challenge, 'sha256').digest()):
+			writer.write(_pack('Authentication failed'))
+			await writer.drain()
+			return False
+		writer.write(_pack('OK'))
+		await writer.drain()
+		return True
+
+	async def _handle_connection(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+		peer = writer.get_extra_info('peername')
+		tasks = {}
+		write_lock = asyncio.Lock()
+		self._connections[writer] = asyncio.current_task()
+		try:
+			if not await self._authenticate(reader, writer):
+				logging.warning(f'Rejected connection from {peer}, wrong authentication key.')
+				return
+			logging.info(f'New connection from {peer}.')
+			while True:
+				request = await asyncio.wait_for(_receive(reader), timeout=self.seconds_without_messages_to_disconnect)
+				if 'cancel' in request:
+					if request['cancel'] in tasks:
+						tasks[request['cancel']].cancel()
+					continue
+				if 'subscribe' in request:
+					writer.write(_pack(self._subscribe(request, writer)))
+					continue
+				task = asyncio.create_task(self._respond(request, writer, write_lock))
+				tasks[request['id']] = task
+				task.add_done_callback(lambda _, n=request['id']: tasks.pop(n, None))
+		except asyncio.TimeoutError:
+			logging.warning(f'Nothing received from {peer} in {self.seconds_without_messages_to_disconnect} s, closing the connection.')
+		except (asyncio.IncompleteReadError, ConnectionError):
+			pass
+		except asyncio.CancelledError: # The server is stopping.
+			pass
+		finally:
+			for task in list(tasks.values()):
+				task.cancel()
+			self._subscribers.pop(writer, None)
+			self._connections.pop(writer, None)
+			writer.close()
+			logging.info(f'Connection from {peer} closed.')
+
+	async def _serve(self):
+		self._workers = {device: DeviceWorker(device) for device in METHODS_OF_DEVICE}
+		workers_tasks = [asyncio.create_task(worker.run_forever()) for worker in self._workers.values()]
+		sampling_tasks = [asyncio.create_task(self._sample_forever(quantity, period)) for quantity,period in self.telemetry_periods_seconds.items()]
+		self._loop = asyncio.get_running_loop()
+		self._stop = asyncio.Event()
+		self._connections = {} # `{writer: task handling it}`
+		server = await asyncio.start_server(self._handle_connection, host=self.address[0], port=self.address[1])
+		logging.info(f'Serving the setup in {self.address}.')
+		try:
+			await self._stop.wait()
+		finally:
+			server.close() # First, so the clients do not reconnect while it stops.
+			for writer in self._connections:
+				writer.transport.abort() # Unlike `close`, it does not wait to send what is buffered.
+			tasks = set(self._connections.values()) | set(workers_tasks) | set(sampling_tasks)
+			while len(tasks) > 0: # More than once if needed, `wait_for` can swallow a cancellation before Python 3.12.
+				for task in tasks:
+					task.cancel()
+				_, tasks = await asyncio.wait(tasks, timeout=1)
+			await server.wait_closed()
+			for worker in self._workers.values():
+				worker._executor.shutdown(wait=False, cancel_futures=True)
+		logging.info('Server stopped.')
+
+	def stop(self):
+		"""Stop `serve_forever`, can be called from any thread."""
+		self._loop.call_soon_threadsafe(self._stop.set)
+
+	def serve_forever(self):
+		asyncio.run(self._serve())
+
+# Methods that can be sent again after reconnecting, when it is not known
+# whether the server executed them or not. `get_waveform` is not, because
+# after a restart of the server the digitizer would not have it anymore.
+IDEMPOTENT_METHODS = {method for methods in METHODS_OF_DEVICE.values() for method in methods if method.startswith(('get_','measure_'))} - {'get_waveform'} | {'get_signatures'}
+
+class SetupClient:
+	"""Connects to a `TheSetupServer` and calls the methods of the setup,
+	e.g. `client.get_stages_position()`. It can be used from many threads
+	at the same time, each call waits only for its own response.
+	
+	Each call has a timeout, `timeout_seconds` unless another one is given
+	with `client.call(method, *args, timeout=seconds, **kwargs)`, after
+	which `TimeoutError` is raised. If `timeout_seconds` is `None` the
+	calls wait forever.
+	
+	For the slow control quantities use `get_telemetry` instead of calling
+	the methods, it returns the last value sampled by the server without
+	accessing the instruments.
+	
+	The client sends a heartbeat every `heartbeat_seconds` and, if the
+	connection is lost or the server stops answering the heartbeats, it
+	reconnects on its own for up to `reconnect_timeout_seconds`, e.g. while
+	the server is restarted. Meanwhile new calls wait for the connection.
+	Calls that were already sent are sent again if they are in
+	`IDEMPOTENT_METHODS`, otherwise they raise `ConnectionError` since it
+	is not known whether they were executed. The named locks belong to
+	`who`, not to the connection, and their leases are renewed with the
+	heartbeats, so whoever was holding one still has it after reconnecting,
+	unless it took longer than `NAMED_LOCK_LEASE_SECONDS` and someone
+	else was waiting for it. In that case `NamedLockLostError` is raised
+	by the next call that needs that lock and when the `with` ends.
+	"""
+	def __init__(self, address:tuple=SETUP_ADDRESS, authkey:bytes=SETUP_AUTHKEY, timeout_seconds:float=TIMEOUT_SECONDS, heartbeat_seconds:float=HEARTBEAT_SECONDS, reconnect_timeout_seconds:float=RECONNECT_TIMEOUT_SECONDS):
+		self.address = address
+		self.timeout_seconds = timeout_seconds
+		self.heartbeat_seconds = heartbeat_seconds
+		self.reconnect_timeout_seconds = reconnect_timeout_seconds
+		self._authkey = authkey
+		self._pending = {} # `{id: (future, message)}`
+		self._send_lock = threading.Lock()
+		self._ids = itertools.count()
+		self._connected = threading.Event()
+		self._connection_lost_because = None
+		self._closed = False
+		self._pid = os.getpid()
+		self._signatures = None
+		self._subscribed = set()
+		self._held_named_locks = {} # `{(name, who): {'count','incarnation','lost'}}`, their leases are renewed with the heartbeats.
+		self._held_named_locks_lock = threading.Lock()
+		self.telemetry = {} # `{quantity: (timestamp, value)}` with the last value received of each quantity.
+		self._telemetry_updated = threading.Condition()
+		self._telemetry_callbacks = []
+		self._connect() # If the server is not there to begin with, fail right away.
+		self._connected.set()
+		threading.Thread(target=self._receive_forever, daemon=True).start()
+		if heartbeat_seconds is not None:
+			threading.Thread(target=self._heartbeat_forever, daemon=True).start()
+
+	def _connect(self):
+		sock = socket.create_connection(self.address, timeout=self.timeout_seconds)
+		sock.settimeout(None)
+		file = sock.makefile('rb')
+		challenge = _receive_blocking(file)
+		sock.sendall(_pack(hmac.new(self._authkey, challenge, 'sha256').digest()))
+		if _receive_blocking(file) != 'OK':
+			sock.close()
+			raise ConnectionRefusedError(f'Authentication with the setup server in {self.address} failed.')
+		self._socket = sock
+		self._file = file
+
+	def _send(self, message:dict):
+		with self._send_lock:
+			self._socket.sendall(_pack(message))
+
+	def _receive_forever(self):
+		while not self._closed:
+			try:
+				while True:
+					response = _receive_blocking(self._file)
+					if 'telemetry' in response:
+						self._update_telemetry({response['telemetry']: (response['time'], response['value'])})
+						continue
+					future, _ = self._pending.get(response['id'], (None,None))
+					if future is None or future.done():
+						continue
+					if 'exception' in response:
+						future.set_exception(response['exception'])
+					else:
+						future.set_result(response['result'])
+			except Exception as e:
+				if self._closed:
+					break
+				self._connection_lost(e)
+				self._reconnect()
+		for future,_ in list(self._pending.values()):
+			if not future.done():
+				future.set_exception(ConnectionError(f'The connection with the setup server was closed because of {repr(self._connection_lost_because)}. '))
+
+	def _connection_lost(self, reason:Exception):
+		logging.warning(f'Lost connection with the setup server in {self.address} because of {repr(reason)}, reconnecting...')
+		with self._send_lock: # So every request is either sent before this or waits for the new connection.
+			self._connected.clear()
+			self._connection_lost_because = reason
+			self._socket.close()
+			for future,message in list(self._pending.values()):
+				if not future.done() and message.get('method') not in IDEMPOTENT_METHODS and 'subscribe' not in message:
+					future.set_exception(ConnectionError(f'Lost connection with the setup server while waiting for `{message.get("method")}`, it may or may not have been executed. Reason: {repr(reason)}. '))
+
+	def _reconnect(self):
+		started = time.time()
+		seconds_before_next_attempt = .1
+		while not self._closed:
+			try:
+				self._connect()
+			except OSError as e:
+				if self.reconnect_timeout_seconds is not None and time.time() - started > self.reconnect_timeout_seconds:
+					logging.error(f'Could not reconnect with the setup server in {self.address} within {self.reconnect_timeout_seconds} s, giving up.')
+					self._closed = True
+					return
+				time.sleep(seconds_before_next_attempt)
+				seconds_before_next_attempt = min(seconds_before_next_attempt*2, 5)
+				continue
+			break
+		logging.info(f'Reconnected with the setup server in {self.address} after {time.time()-started:.1f} s.')
+		with self._send_lock:
+			if len(self._subscribed) > 0:
+				n = next(self._ids)
+				future = concurrent.futures.Future()
+				future.add_done_callback(lambda future, n=n: (self._pending.pop(n, None), future.exception() is None and self._update_telemetry(future.result())))
+				self._pending[n] = (future, {'subscribe': sorted(self._subscribed)})
+			for n,(future,message) in list(self._pending.items()): # Send again whatever is still waiting, i.e. the idempotent calls and the subscriptions.
+				if not future.done():
+					try:
+						self._socket.sendall(_pack({'id': n, **message}))
+					except OSError:
+						break # The next iteration of `_receive_forever` will find out.
+			self._connection_lost_because = None
+			self._connected.set()
+
+	def _heartbeat_forever(self):
+		while not self._closed:
+			time.sleep(self.heartbeat_seconds)
+			if not self._connected.is_set():
+				continue
+			sock = self._socket
+			with self._held_named_locks_lock:
+				held_named_locks = {key: held for key,held in self._held_named_locks.items() if not held['lost']}
+				to_renew = {key: (held['count'], held['incarnation']) for key,held in held_named_locks.items()}
+			try:
+				renewal = self._request({'method': 'ping', 'kwargs': {'held_named_locks': to_renew}, 'timeout': self.heartbeat_seconds}, timeout=self.heartbeat_seconds, seconds_to_wait_for_connection=0, extra_seconds_to_wait=self.heartbeat_seconds)
+				with self._held_named_locks_lock:
+					for key,held in held_named_locks.items():
+						if self._held_named_locks.get(key) is not held: # Released while the heartbeat was on its way.
+							continue
+						if key in renewal['lost']:
+							logging.error(f'{repr(key[1])} lost named lock {repr(key[0])}, someone else took it while the connection with the setup server was down.')
+							held['lost'] = True
+						else:
+							held['incarnation'] = renewal['incarnation'] # In case the server was restarted and gave it back.
+			except ConnectionError: # It is already reconnecting.
+				pass
+			except TimeoutError:
+				logging.warning(f'No answer to the heartbeat from the setup server in {self.address}.')
+				try:
+					sock.shutdown(socket.SHUT_RDWR) # `_receive_forever` will reconnect.
+				except OSError:
+					pass
+
+	def _raise_if_named_lock_lost(self, name:str, who:str):
+		with self._held_named_locks_lock:
+			held = self._held_named_locks.get((name, who))
+			if held is not None and held['lost']:
+				raise NamedLockLostError(f'{repr(who)} lost named lock {repr(name)}, someone else took it while the connection with the setup server was down. ')
+
+	def _update_telemetry(self, values:dict):
+		with self._telemetry_updated:
+			for quantity,(timestamp,value) in values.items():
+				if quantity not in self.telemetry or self.telemetry[quantity][0] < timestamp:
+					self.telemetry[quantity] = (timestamp, value)
+			self._telemetry_updated.notify_all()
+		for callback in self._telemetry_callbacks:
+			for quantity,(timestamp,value) in values.items():
+				try:
+					callback(quantity, timestamp, value)
+				except Exception as e:
+					logging.error(f'Telemetry callback {callback} raised {repr(e)}.')
+
+	def _request(self, message:dict, timeout:float, seconds_to_wait_for_connection:float=None, extra_seconds_to_wait:float=5):
+		seconds_to_wait_for_connection = self.reconnect_timeout_seconds if seconds_to_wait_for_connection is None else seconds_to_wait_for_connection
+		n = next(self._ids)
+		future = concurrent.futures.Future()
+		while True:
+			if self._closed:
+				raise ConnectionError(f'The connection with the setup server in {self.address} is closed. ')
+			if not self._connected.wait(timeout=seconds_to_wait_for_connection):
+				raise ConnectionError(f'Not connected with the setup server in {self.address} because of {repr(self._connection_lost_because)}. ')
+			with self._send_lock:
+				if self._connected.is_set():
+					self._pending[n] = (future, message)
+					try:
+						self._socket.sendall(_pack({'id': n, **message}))
+					except OSError:
+						pass # `_receive_forever` will find out, and either send it again or raise.
+					break
+		try:
+			try:
+				return future.result(timeout=timeout+extra_seconds_to_wait if timeout is not None else None) # The server enforces the timeout, this is in case it does not answer at all.
+			except concurrent.futures.TimeoutError:
+				if future.done():
+					raise
+				try:
+					self._send({'cancel': n})
+				except OSError:
+					pass
+				raise TimeoutError(f'No answer from the setup server to `{message.get("method", message)}` within {timeout} s. ')
+		finally:
+			self._pending.pop(n, None)
+
+	def subscribe(self, quantities:list, callback=None):
+		"""Subscribe to the slow control `quantities` published by the
+		server, see `TELEMETRY_PERIODS_SECONDS`. Their last values are
+		kept in `self.telemetry` and, if `callback` is given, it is called
+		as `callback(quantity, timestamp, value)` with each new value from
+		the thread that receives them, so it should return quickly."""
+		if callback is not None:
+			self._telemetry_callbacks.append(callback)
+		self._update_telemetry(self._request({'subscribe': list(quantities)}, timeout=self.timeout_seconds))
+		self._subscribed.update(quantities) # To subscribe again after reconnecting.
+
+	def get_telemetry(self, quantity:str, max_age_seconds:float=None):
+		"""Return the last value of `quantity` published by the server,
+		subscribing to it the first time. If the server could not read
+		it, the exception it got is raised.
+		
+		Arguments
+		---------
+		quantity: str
+			One of `TELEMETRY_PERIODS_SECONDS`, e.g. `'measure_temperature'`.
+		max_age_seconds: float, optional
+			If given, wait up to `timeout_seconds` for a value that is
+			not older than this, otherwise raise `TimeoutError`.
+		"""
+		if quantity not in self.telemetry:
+			self.subscribe([quantity])
+		is_fresh = lambda: quantity in self.telemetry and (max_age_seconds is None or time.time()-self.telemetry[quantity][0] <= max_age_seconds)
+		with self._telemetry_updated:
+			if not self._telemetry_updated.wait_for(is_fresh, timeout=self.timeout_seconds):
+				raise TimeoutError(f'No value of {quantity} ' + (f'newer than {max_age_seconds} s ' if max_age_seconds is not None else '') + f'was received within {self.timeout_seconds} s. ')
+			timestamp, value = self.telemetry[quantity]
+		if isinstance(value, Exception):
+			raise value
+		return value
+
+	def call(self, method:str, *args, timeout:float=None, **kwargs):
+		"""Call `method` of the setup with `args` and `kwargs` and return its result."""
+		timeout = self.timeout_seconds if timeout is None else timeout
+		return self._request({'method': method, 'args': args, 'kwargs': kwargs, 'timeout': timeout}, timeout)
+
+	def call_many(self, calls:list, timeout:float=None, return_exceptions:bool=False)->list:
+		"""Execute several independent calls in a single request and
+		return their results, in the same order. The calls to different
+		instruments run at the same time, and those to the same instrument
+		one after the other in the given order, so e.g. a readback after
+		a setpoint change gets the new value.
+		
+		Arguments
+		---------
+		calls: list
+			Each element is `(method, args, kwargs)`, `args` and `kwargs`
+			can be omitted, e.g. `[('set_laser_DAC', (600,)), ('get_laser_DAC',), ('measure_temperature',)]`.
+		timeout: float, optional
+			For the whole request, default is `timeout_seconds`.
+		return_exceptions: bool, default False
+			If `False`, the first exception raised by any of the calls is
+			raised once all of them finished. If `True`, the exceptions are
+			returned in place of the results.
+		"""
+		calls = [(call[0], tuple(call[1]) if len(call)>1 else (), dict(call[2]) if len(call)>2 else {}) for call in calls]
+		outcomes = self.call('call_many', calls, timeout=timeout)
+		if not return_exceptions:
+			for kind,value in outcomes:
+				if kind == 'exception':
+					raise value
+		return [value for kind,value in outcomes]
+
+	def get_signatures(self)->dict:
+		"""Return `{method: inspect.Signature}` with all the methods of the setup."""
+		if self._signatures is None: # They do not change, so ask only once.
+			self._signatures = self.call('get_signatures')
+		return self._signatures
+
+	def __getattr__(self, method:str):
+		if method.startswith('_'):
+			raise AttributeError(method)
+		def remote_method(*args, **kwargs):
+			return self.call(method, *args, **kwargs)
+		remote_method.__name__ = method
+		return remote_method
+
+	def close(self):
+		self._closed = True
+		try:
+			self._socket.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+		self._socket.close()
+
+	@property
+	def closed(self)->bool:
+		return self._closed
+
+class NamedLockLostError(RuntimeError):
+	"""Raised within the `with` of a `hold_*` method of a `SetupProxy`
+	when the lock was lost, see `SetupClient`."""
+	pass
+
+class SetupProxy:
+	"""Like `WhoWrapper` but for a `SetupClient`. It fetches the signatures
+	of the methods from the server once, so `who` is only sent to the
+	methods that have it and the arguments are checked before sending
+	anything, each call is a single round trip.
+	
+	Several independent calls can be sent together with `pipeline`:
+	```
+	with the_setup.pipeline() as pipeline:
+		pipeline.set_bias_voltage(volts=100)
+		voltage = pipeline.measure_bias_voltage()
+		temperature = pipeline.measure_temperature()
+	print(voltage.result(), temperature.result())
+	```
+	"""
+	def __init__(self, client:SetupClient, who:str):
+		self._client = client
+		self._who = who
+		self._signatures = client.get_signatures()
+		self._methods = {}
+		self._named_lock_of_method = {
+			method: NAMED_LOCK_OF_DEVICE[device]
+			for device,methods in METHODS_OF_DEVICE.items() if device in NAMED_LOCK_OF_DEVICE
+			for method in methods if method in self._signatures and 'who' in self._signatures[method].parameters
+		}
+
+	def _hold(self, method:str, args:tuple, kwargs:dict):
+		_, args, kwargs = self._prepare_call(method, args, kwargs)
+		arguments = self._signatures[method].bind(*args, **kwargs)
+		arguments.apply_defaults()
+		return _RemoteNamedLock(self._client, name=NAMED_LOCK_OF_HOLD_METHOD[method], who=arguments.arguments['who'], priority=arguments.arguments['priority'])
+
+	def _prepare_call(self, method:str, args:tuple, kwargs:dict)->tuple:
+		if method not in self._signatures:
+			raise AttributeError(f'`TheTCTSetupWithNamedLocks` has no method {repr(method)}. ')
+		kwargs = dict(kwargs)
+		if 'who' in self._signatures[method].parameters:
+			kwargs.setdefault('who', self._who)
+		arguments = self._signatures[method].bind(*args, **kwargs) # Raises `TypeError` here rather than in the server.
+		if method in self._named_lock_of_method:
+			self._client._raise_if_named_lock_lost(self._named_lock_of_method[method], arguments.arguments['who'])
+		return method, args, kwargs
+
+	def __getattr__(self, method:str):
+		if method.startswith('_'):
+			raise AttributeError(method)
+		if method not in self._signatures:
+			if hasattr(SetupClient, method): # E.g. `get_telemetry`, `close`, ...
+				return getattr(self._client, method)
+			raise AttributeError(f'`TheTCTSetupWithNamedLocks` has no method {repr(method)}. ')
+		if method not in self._methods:
+			def remote_method(*args, timeout:float=None, **kwargs):
+				if method in NAMED_LOCK_OF_HOLD_METHOD:
+					return self._hold(method, args, kwargs)
+				method_, args, kwargs = self._prepare_call(method, args, kwargs)
+				return self._client.call(method_, *args, timeout=timeout, **kwargs)
+			remote_method.__name__ = method
+			remote_method.__signature__ = self._signatures[method].replace(parameters=[p for p in self._signatures[method].parameters.values() if p.name != 'who'])
+			self._methods[method] = remote_method
+		return self._methods[method]
+
+	def call_many(self, calls:list, timeout:float=None, return_exceptions:bool=False)->list:
+		"""Same as `SetupClient.call_many` but adding `who` where needed."""
+		calls = [self._prepare_call(call[0], tuple(call[1]) if len(call)>1 else (), call[2] if len(call)>2 else {}) for call in calls]
+		return self._client.call_many(calls, timeout=timeout, return_exceptions=return_exceptions)
+
+	@contextmanager
+	def pipeline(self, timeout:float=None):
+		"""Collect the calls made within the `with` block and send them
+		together with `call_many` when it ends. Each call returns a
+		`concurrent.futures.Future` that has the result after the block."""
+		pipeline = _Pipeline(self)
+		yield pipeline
+		outcomes = self.call_many(pipeline._calls, timeout=timeout, return_exceptions=True)
+		for future,outcome in zip(pipeline._futures, outcomes):
+			if isinstance(outcome, Exception):
+				future.set_exception(outcome)
+			else:
+				future.set_result(outcome)
+
+class _RemoteNamedLock:
+	"""What the `hold_*` methods of a `SetupProxy` return, to hold one
+	of the named locks of the server in a `with` statement."""
+	def __init__(self, client:SetupClient, name:str, who:str, priority:float):
+		self.client = client
+		self.name = name
+		self.who = who
+		self.priority = priority
+
+	def __enter__(self):
+		self.client._raise_if_named_lock_lost(self.name, self.who)
+		incarnation = self.client._request( # Without timeout, the lock may be busy for hours.
+			{'method': 'acquire_named_lock', 'args': (self.name, self.who), 'kwargs': {'priority': self.priority}, 'timeout': None},
+			timeout = None,
+		)
+		with self.client._held_named_locks_lock:
+			held = self.client._held_named_locks.setdefault((self.name, self.who), {'count': 0, 'incarnation': incarnation, 'lost': False})
+			held['count'] += 1
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		with self.client._held_named_locks_lock:
+			held = self.client._held_named_locks[(self.name, self.who)]
+			held['count'] -= 1
+			if held['count'] == 0:
+				del self.client._held_named_locks[(self.name, self.who)]
+		if not held['lost']:
+			self.client.call('release_named_lock', self.name, self.who)
+		elif exc_type is None:
+			raise NamedLockLostError(f'{repr(self.who)} lost named lock {repr(self.name)} while holding it, someone else took it while the connection with the setup server was down. ')
+
+class _Pipeline:
+	def __init__(self, proxy:SetupProxy):
+		self._proxy = proxy
+		self._calls = []
+		self._futures = []
+
+	def __getattr__(self, method:str):
+		if method.startswith('_'):
+			raise AttributeError(method)
+		def add_call(*args, **kwargs):
+			self._calls.append(self._proxy._prepare_call(method, args, kwargs))
+			self._futures.append(concurrent.futures.Future())
+			return self._futures[-1]
+		return add_call
+
+_clients_of_this_process = {} # `{address: SetupClient}`, see `connect_me_with_the_setup`.
+_clients_of_this_process_lock = threading.Lock()
+
+def connect_me_with_the_setup(who:str, address:tuple=None):
+	"""Return a `SetupProxy` to use the setup as `who`. All the calls to
+	this function within a process share the same `SetupClient`, so the
+	connection is made only once per process and address. A process
+	created with `fork` makes its own connection the first time, since it
+	cannot use the one of its parent.
+	
+	Arguments
+	---------
+	who: str
+		See `TheTCTSetupWithNamedLocks`.
+	address: tuple, optional
+		`(host, port)` of the server, default is `SETUP_ADDRESS`, which
+		can be set with the environment variable `TCT_SETUP_ADDRESS`.
+	"""
+	address = SETUP_ADDRESS if address is None else tuple(address)
+	with _clients_of_this_process_lock:
+		client = _clients_of_this_process.get(address)
+		if client is None or client.closed or client._pid != os.getpid():
+			client = _clients_of_this_process[address] = SetupClient(address=address)
+	return SetupProxy(client=client, who=who)
 
 if __name__=='__main__':
 	from progressreporting.TelegramProgressReporter import SafeTelegramReporter4Loops # https://github.com/SengerM/progressreporting
@@ -826,9 +1802,6 @@ if __name__=='__main__':
 		datefmt = '%Y-%m-%d %H:%M:%S',
 	)
 	
-	class TheSetupManager(BaseManager):
-		pass
-	
 	reporter = SafeTelegramReporter4Loops(
 		bot_token = my_telegram_bots.robobot.token,
 		chat_id = my_telegram_bots.chat_ids['Robobot TCT setup'],
@@ -837,11 +1810,9 @@ if __name__=='__main__':
 	logging.info('Opening the setup...')
 	the_setup = TheTCTSetupWithNamedLocks()
 	
-	TheSetupManager.register('get_the_setup', callable=lambda:the_setup)
-	m = TheSetupManager(address=('', 50000), authkey=b'abracadabra')
-	s = m.get_server()
+	server = TheSetupServer(the_setup)
 	logging.info('Ready!')
 	try:
-		s.serve_forever()
+		server.serve_forever()
 	except Exception as e:
 		reporter.send_message(f'🔥 `TheTCTSetup` crashed! Reason: `{repr(e)}`.')
@@ -0,0 +1,101 @@
+from pathlib import Path
+import pandas
+import json
+import logging
+import utils
+from utils import PARSER_VERSION
+
+CACHE_VERSION = 1 # Increase this whenever the content of the cache changes.
+
+SOURCE_FILES = ['parsed_from_waveforms.sqlite', 'aggregated_per_position.sqlite', 'parsed_from_waveforms.parquet']
+
+def path_to_cache_of(path_to_TCT_1D_scan:Path)->Path:
+	"""Where the cache of a `TCT_1D_scan` is, a hidden directory in its
+	run, so the task directory is only written by the scan itself and the
+	cache survives the tasks that use it being run again."""
+	return Path(path_to_TCT_1D_scan).parent/'.aggregates_cache'
+
+def _cache_key(path_to_TCT_1D_scan:Path)->dict:
+	"""The cache is valid as long as none of the source files changed and
+	neither did the parser nor the cache format."""
+	key = {'CACHE_VERSION': CACHE_VERSION, 'PARSER_VERSION': PARSER_VERSION}
+	for name in SOURCE_FILES:
+		path = path_to_TCT_1D_scan/name
+		if path.is_dir():
+			files = [p for p in path.rglob('*') if p.is_file()]
+			key[name] = [sum(p.stat().st_size for p in files), max([p.stat().st_mtime_ns for p in files], default=0)]
+		elif path.is_file():
+			key[name] = [path.stat().st_size, path.stat().st_mtime_ns]
+	return key
+
+def _path_to_cached_column(path_to_cache:Path, column:str, filters:dict=None)->Path:
+	name = column.replace('/','÷')
+	for col,value in sorted((filters or {}).items()):
+		name += f' {col}={value}'
+	return path_to_cache/(name + '.pickle')
+
+def _select(data:pandas.DataFrame, filters:dict=None)->pandas.DataFrame:
+	"""Select the rows of `data` matching `filters`, see `load_aggregated_columns`."""
+	for col,value in (filters or {}).items():
+		data = data[data.index.get_level_values(col).isin(value if isinstance(value, (list,tuple,set)) else [value])]
+	return data
+
+def _compute_aggregated_columns(path_to_TCT_1D_scan:Path, columns:list, filters:dict=None)->pandas.DataFrame:
+	aggregated_per_position = utils.load_aggregated_per_position(path_to_TCT_1D_scan)
+	if aggregated_per_position is not None:
+		return _select(aggregated_per_position[[c for c in aggregated_per_position.columns if c.rsplit(' ',1)[0] in columns]], filters)
+	if (path_to_TCT_1D_scan/'parsed_from_waveforms.parquet').is_dir():
+		from columnar_export import read_parquet_data # Only needed here, so `pyarrow` is not required otherwise.
+		return utils.aggregate_parsed_data(read_parquet_data(path_to_TCT_1D_scan/'parsed_from_waveforms.parquet', columns=columns, filters=filters))
+	return _select(utils.aggregate_parsed_data_in_chunks(path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite', columns=columns), filters)
+
+def load_aggregated_columns(path_to_TCT_1D_scan:Path, columns:list, filters:dict=None)->pandas.DataFrame:
+	"""Get the per position aggregates, see `utils.aggregate_parsed_data`,
+	for some columns of the parsed data of a `TCT_1D_scan`. The results
+	are cached in the directory given by `path_to_cache_of`, so
+	next time only the columns that were never requested before are computed.
+	The cache is discarded if any of the source files, `PARSER_VERSION`
+	or `CACHE_VERSION` changed.
+
+	Arguments
+	---------
+	path_to_TCT_1D_scan: Path
+		Path to the directory of the `TCT_1D_scan` task.
+	columns: list of str
+		Columns of the parsed data, e.g. `['Amplitude (V)','t_50 (s)']`.
+	filters: dict, optional
+		A dictionary of the form `{column: value}` or `{column: [value1, value2, ...]}`
+		to get only the rows matching all of them, e.g. `{'n_pulse': 1}`.
+		When the parsed data is read from Parquet they are applied while
+		reading, see `columnar_export.read_parquet_data`.
+
+	Returns
+	-------
+	aggregated: pandas.DataFrame
+		Indexed by `n_position`, `n_channel` and `n_pulse`, with columns
+		`'{column} {statistic}'`.
+	"""
+	path_to_TCT_1D_scan = Path(path_to_TCT_1D_scan)
+	path_to_cache = path_to_cache_of(path_to_TCT_1D_scan)
+	path_to_key = path_to_cache/'cache_key.json'
+
+	current_key = _cache_key(path_to_TCT_1D_scan)
+	if path_to_key.is_file():
+		with open(path_to_key, 'r') as ifile:
+			cached_key = json.load(ifile)
+		if cached_key != current_key:
+			logging.info(f'Aggregates cache in {path_to_cache} is outdated, discarding it...')
+			for p in path_to_cache.iterdir():
+				p.unlink()
+	path_to_cache.mkdir(exist_ok=True)
+	with open(path_to_key, 'w') as ofile:
+		json.dump(current_key, ofile)
+
+	missing_columns = [col for col in columns if not _path_to_cached_column(path_to_cache, col, filters).is_file()]
+	if len(missing_columns) > 0:
+		logging.info(f'Computing aggregates for {missing_columns}...')
+		computed = _compute_aggregated_columns(path_to_TCT_1D_scan, missing_columns, filters)
+		for col in missing_columns:
+			computed[[c for c in computed.columns if c.rsplit(' ',1)[0] == col]].to_pickle(_path_to_cached_column(path_to_cache, col, filters))
+
+	return pandas.concat([pandas.read_pickle(_path_to_cached_column(path_to_cache, col, filters)) for col in columns], axis=1)
@@ -0,0 +1,228 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import logging
+import traceback
+from runs_catalog import walk_runs, task_was_successful
+from utils import PARSER_VERSION, load_parser_version, is_being_compressed
+
+SOURCE_FILES_FOR_PLOTS = ['measured_data.sqlite','parsed_from_waveforms.sqlite','aggregated_per_position.sqlite'] # Not the waveforms, so compressing them does not make the plots stale.
+LOG_FORMAT = '%(asctime)s|%(levelname)s|%(funcName)s|%(message)s'
+
+def _newest_mtime(path_to_directory:Path, names:list=None)->float:
+	"""Newest modification time among the files in `path_to_directory`
+	and its subdirectories, or among `names` if given. 0 if there are none."""
+	files = [path_to_directory/name for name in names] if names is not None else path_to_directory.rglob('*')
+	return max([p.stat().st_mtime for p in files if p.is_file()], default=0)
+
+def _is_stale(bureaucrat:RunBureaucrat, task_name:str, path_to_sources:Path)->bool:
+	"""`True` if `task_name` was never run successfully or any of the
+	source files in `path_to_sources` changed after it was run."""
+	if not task_was_successful(bureaucrat, task_name):
+		return True
+	return _newest_mtime(bureaucrat.path_to_directory_of_task(task_name)) < _newest_mtime(path_to_sources, SOURCE_FILES_FOR_PLOTS)
+
+def steps_needed_by_run(path_to_run:Path, parent_task:str=None)->list:
+	"""Find which of the post processing steps a run needs, in the order
+	they should be done. Runs whose measurement is not finished successfully
+	yet are left alone. The waveforms are parsed again whenever they were
+	parsed with another `utils.PARSER_VERSION`, except if they were zero
+	suppressed, because then only some of them were saved.
+
+	Arguments
+	---------
+	path_to_run: Path
+		Path to the run.
+	parent_task: str, optional
+		The task this run is a subrun of, if any.
+
+	Returns
+	-------
+	steps: list of str
+		A list with some of `'parse_waveforms'`, `'plot_parsed_data_from_TCT_1D_scan'`,
+		`'plot_2D_scan'` and `'compress_2D_scan'`.
+	"""
+	bureaucrat = RunBureaucrat(path_to_run)
+	steps = []
+	path_to_TCT_1D_scan = bureaucrat.path_to_directory_of_task('TCT_1D_scan')
+	if path_to_TCT_1D_scan.is_dir() and task_was_successful(bureaucrat, 'TCT_1D_scan'):
+		if (path_to_TCT_1D_scan/'waveforms.sqlite').is_file():
+			if task_was_successful(bureaucrat, 'parse_waveforms'):
+				parsed_with = load_parser_version(bureaucrat.path_to_directory_of_task('parse_waveforms'))
+			elif (path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite').is_file(): # Parsed while measuring.
+				parsed_with = load_parser_version(path_to_TCT_1D_scan)
+			else:
+				parsed_with = None
+			if parsed_with != PARSER_VERSION:
+				if (path_to_TCT_1D_scan/'zero_suppression_rules.pickle').is_file():
+					logging.warning(f'The waveforms of {path_to_run} are not parsed with PARSER_VERSION={PARSER_VERSION}, but they were zero suppressed so they will not be parsed again. ')
+				else:
+					steps.append('parse_waveforms')
+		if parent_task != 'TCT_2D_scan' and (path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite').is_file() and _is_stale(bureaucrat, 'plot_parsed_data_from_TCT_1D_scan', path_to_TCT_1D_scan):
+			steps.append('plot_parsed_data_from_TCT_1D_scan')
+	if bureaucrat.path_to_directory_of_task('TCT_2D_scan').is_dir() and task_was_successful(bureaucrat, 'TCT_2D_scan'):
+		subruns = bureaucrat.list_subruns_of_task('TCT_2D_scan')
+		if len(subruns) == 1:
+			path_to_flattened_TCT_1D_scan = subruns[0].path_to_directory_of_task('TCT_1D_scan')
+			if _is_stale(bureaucrat, 'plot_everything_from_TCT_2D_scan', path_to_flattened_TCT_1D_scan):
+				steps.append('plot_2D_scan')
+			path_to_waveforms_file = path_to_flattened_TCT_1D_scan/'waveforms.sqlite'
+			if path_to_waveforms_file.is_file() and not path_to_waveforms_file.with_suffix('.zip').is_file() and not is_being_compressed(path_to_waveforms_file): # E.g. by `TCT_2D_scans_sweeping_bias_voltage`.
+				steps.append('compress_2D_scan')
+	return steps
+
+def find_work(path_to_root:Path)->dict:
+	"""Find all the runs within `path_to_root` that need post processing.
+	Returns a dictionary of the form `{path_to_run: [steps]}`, see `steps_needed_by_run`."""
+	work = {}
+	for path_to_run, parent_path, parent_task in walk_runs(Path(path_to_root)):
+		steps = steps_needed_by_run(path_to_run, parent_task)
+		if len(steps) > 0:
+			work[path_to_run] = steps
+	return work
+
+def _do_step(bureaucrat:RunBureaucrat, step:str):
+	# The imports are here so each worker only loads what it needs.
+	if step == 'parse_waveforms':
+		from parse_waveforms import parse_waveforms
+		parse_waveforms(bureaucrat, name_of_task_that_produced_the_waveforms_to_parse='TCT_1D_scan', continue_from_where_we_left_last_time=True, silent=True)
+	elif step == 'plot_parsed_data_from_TCT_1D_scan':
+		from scan_1D import plot_parsed_data_from_TCT_1D_scan
+		plot_parsed_data_from_TCT_1D_scan(bureaucrat, strict_task_checking=False)
+	elif step == 'plot_2D_scan':
+		from scan_2D import plot_everything_from_TCT_2D_scan
+		plot_everything_from_TCT_2D_scan(bureaucrat, n_workers=1) # This is already running in parallel with other runs.
+	elif step == 'compress_2D_scan':
+		from scan_2D import compress_waveforms_file_in_2D_scan
+		compress_waveforms_file_in_2D_scan(bureaucrat)
+	else:
+		raise ValueError(f'Unknown step {repr(step)}. ')
+
+def process_run(path_to_run:Path, steps:list, path_to_log_file:Path)->dict:
+	"""Do the `steps` on a run, one after the other, logging everything
+	into `path_to_log_file`. If a step fails the next ones are not done.
+	Returns a dictionary `{step: 'done' or 'failed: ...' or 'not done'}`."""
+	handler = logging.FileHandler(path_to_log_file)
+	handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt='%Y-%m-%d %H:%M:%S'))
+	root_logger = logging.getLogger()
+	previous_handlers = root_logger.handlers[:]
+	root_logger.handlers = [handler]
+	root_logger.setLevel(logging.INFO)
+	results = {step: 'not done' for step in steps}
+	try:
+		bureaucrat = RunBureaucrat(Path(path_to_run))
+		for step in steps:
+			logging.info(f'Starting {step} on {path_to_run}...')
+			try:
+				_do_step(bureaucrat, step)
+			except Exception as e:
+				logging.error(f'{step} failed:\n{traceback.format_exc()}')
+				results[step] = f'failed: {repr(e)}'
+				break
+			logging.info(f'Finished {step} on {path_to_run}.')
+			results[step] = 'done'
+	finally:
+		handler.close()
+		root_logger.handlers = previous_handlers
+	return results
+
+def batch_post_processing(path_to_root:Path, n_workers:int=None, path_to_logs:Path=None, dry_run:bool=False)->dict:
+	"""Find every run within `path_to_root` that needs post processing,
+	see `steps_needed_by_run`, and process them in parallel, one run per
+	worker. Whatever was already done is detected and skipped, so running
+	this again only does what is missing, e.g. after new scans or after
+	a failure.
+
+	Arguments
+	---------
+	path_to_root: Path
+		Path to the base measurement directory, or any run containing the
+		runs to process as subruns.
+	n_workers: int, optional
+		Number of runs processed simultaneously, default is one per core.
+	path_to_logs: Path, optional
+		Directory where to put one log file per run. Default is a directory
+		`batch_post_processing_logs` next to `path_to_root`.
+	dry_run: bool, default False
+		If `True` only find what has to be done, but do not do it.
+
+	Returns
+	-------
+	results: dict
+		A dictionary of the form `{path_to_run: {step: result}}`.
+	"""
+	path_to_root = Path(path_to_root).resolve()
+	path_to_logs = Path(path_to_logs) if path_to_logs is not None else path_to_root.parent/'batch_post_processing_logs'
+
+	logging.info(f'Looking for runs that need post processing within {path_to_root}...')
+	work = find_work(path_to_root)
+	for path_to_run, steps in work.items():
+		logging.info(f'{path_to_run.relative_to(path_to_root.parent)}: {", ".join(steps)}')
+	logging.info(f'{len(work)} runs need post processing.')
+	if dry_run or len(work) == 0:
+		return {path_to_run: {step: 'not done' for step in steps} for path_to_run,steps in work.items()}
+
+	path_to_logs.mkdir(parents=True, exist_ok=True)
+	results = {}
+	with ProcessPoolExecutor(max_workers=n_workers) as executor:
+		futures = {}
+		for path_to_run, steps in work.items():
+			path_to_log_file = path_to_logs/(str(path_to_run.relative_to(path_to_root.parent)).replace('/','__') + '.log')
+			futures[executor.submit(process_run, path_to_run, steps, path_to_log_file)] = path_to_run
+		for future in as_completed(futures):
+			path_to_run = futures[future]
+			try:
+				results[path_to_run] = future.result()
+			except Exception as e: # E.g. the worker died.
+				results[path_to_run] = {step: f'failed: {repr(e)}' for step in work[path_to_run]}
+			logging.info(f'{path_to_run.relative_to(path_to_root.parent)}: {results[path_to_run]}')
+	n_failed = sum(any(result != 'done' for result in r.values()) for r in results.values())
+	logging.info(f'Finished, {len(results)-n_failed} runs completed and {n_failed} with failures, see the logs in {path_to_logs}.')
+	return results
+
+if __name__ == '__main__':
+	import argparse
+	import sys
+
+	logging.basicConfig(
+		stream = sys.stderr,
+		level = logging.INFO,
+		format = LOG_FORMAT,
+		datefmt = '%Y-%m-%d %H:%M:%S',
+	)
+
+	parser = argparse.ArgumentParser(description='Parse, plot and compress all the runs that need it.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory, all the runs within it are processed.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument('--workers',
+		metavar = 'N',
+		help = 'Number of runs to process in parallel. Default is one per core.',
+		default = None,
+		dest = 'n_workers',
+		type = int,
+	)
+	parser.add_argument('--logs',
+		metavar = 'path',
+		help = 'Directory for the log files, one per run.',
+		default = None,
+		dest = 'path_to_logs',
+		type = str,
+	)
+	parser.add_argument('--dry-run',
+		help = 'Only show what would be done.',
+		action = 'store_true',
+		dest = 'dry_run',
+	)
+
+	args = parser.parse_args()
+	batch_post_processing(
+		path_to_root = Path(args.directory),
+		n_workers = args.n_workers,
+		path_to_logs = args.path_to_logs,
+		dry_run = args.dry_run,
+	)
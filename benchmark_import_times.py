@@ -0,0 +1,72 @@
+"""Measure how long it takes to import each entry point and check that
+they do not import heavy modules they do not need. Each module is
+imported in a fresh Python process, as it happens when a script is run
+or when a worker process is started. The exit code is 1 if any check
+fails, so it can be run after changing imports."""
+
+from pathlib import Path
+import subprocess
+import json
+import sys
+
+# For each module, the modules it must not import when it is imported.
+MUST_NOT_IMPORT = {
+	'compress_2D_scan': ['scan_1D','progressreporting','dominate','plotly.express','aggregates_cache','tile_pyramid','dashboard_2D_scan','scipy'],
+	'plot_2D_scan': ['scan_1D','progressreporting','dominate','plotly.express','scipy'],
+	'batch_post_processing': ['scan_1D','scan_2D','parse_waveforms','progressreporting','dominate','plotly','signals','scipy'],
+	'runs_catalog': ['plotly','dominate','signals','scipy'],
+	'utils': ['plotly','dominate','signals','scipy'],
+	'quantile_sketches': ['pandas','plotly','scipy'],
+	'tile_pyramid': ['plotly'],
+	'dashboard_2D_scan': ['plotly'],
+	'live_monitor': ['plotly'],
+	'columnar_export': ['plotly','dominate','scipy'],
+}
+
+MEASURE_IMPORT = '''
+import time, sys, json
+t_start = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter()-t_start, 'modules': sorted(sys.modules)}}))
+'''
+
+def measure_import(module:str)->dict:
+	"""Import `module` in a new Python process and return the time it took
+	and the names of all the modules that ended up imported."""
+	result = subprocess.run(
+		[sys.executable, '-c', MEASURE_IMPORT.format(module=module)],
+		cwd = Path(__file__).parent,
+		capture_output = True,
+		text = True,
+	)
+	if result.returncode != 0:
+		raise RuntimeError(f'Cannot import {repr(module)}: {result.stderr.strip().splitlines()[-1]}')
+	return json.loads(result.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Measure the import time of the entry points and check they do not import heavy modules they do not need.')
+	parser.add_argument('--repetitions',
+		metavar = 'N',
+		help = 'Number of times to import each module, the fastest is reported.',
+		default = 3,
+		dest = 'repetitions',
+		type = int,
+	)
+	args = parser.parse_args()
+
+	everything_fine = True
+	for module, forbidden in MUST_NOT_IMPORT.items():
+		try:
+			measurements = [measure_import(module) for _ in range(args.repetitions)]
+		except RuntimeError as e:
+			print(f'{module:<25} could not be measured, {e}')
+			everything_fine = False
+			continue
+		imported = set(measurements[0]['modules'])
+		wrongly_imported = [m for m in forbidden if m in imported]
+		print(f'{module:<25} {min(m["seconds"] for m in measurements)*1e3:8.0f} ms  {"OK" if len(wrongly_imported) == 0 else "imports " + ", ".join(wrongly_imported)}')
+		if len(wrongly_imported) > 0:
+			everything_fine = False
+	sys.exit(0 if everything_fine else 1)
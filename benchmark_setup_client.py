@@ -0,0 +1,99 @@
+"""Measure how many calls per second a client can do to the setup server
+with `SetupProxy` and with `SetupProxy.call_many`.
+By default it uses the setup server that is running, only calling methods
+that read. With `--fake` it starts its own server with a `StandInSetup`
+that answers immediately, to measure only the overhead of the communication,
+and also a `BaseManager` server like the one we had before `TheSetupServer`,
+to compare with the old way of calling: `WhoWrapper` around its proxy."""
+
+from TheSetup import TheSetupServer, SetupClient, SetupProxy, WhoWrapper, SETUP_ADDRESS
+from stand_in_setup import StandInSetup
+from multiprocessing.managers import BaseManager
+import threading
+import time
+
+METHODS_TO_CALL = ['get_stages_position','get_laser_DAC','measure_temperature'] # Read only, so it can be run while measuring.
+
+def calls_per_second(function, n_calls:int)->float:
+	"""Call `function()` `n_calls` times and return the calls per second."""
+	start = time.perf_counter()
+	for _ in range(n_calls):
+		function()
+	return n_calls/(time.perf_counter()-start)
+
+class TheOldSetupManager(BaseManager):
+	pass
+
+class TheOldSetupClientManager(BaseManager): # A different class, since `register` here would replace the callable of the server.
+	pass
+
+def start_old_server(the_setup, address:tuple)->None:
+	"""Serve `the_setup` in a thread the way it was done before `TheSetupServer`."""
+	TheOldSetupManager.register('get_the_setup', callable=lambda:the_setup)
+	server = TheOldSetupManager(address=address, authkey=b'abracadabra').get_server()
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+def benchmark_old(address:tuple, n_calls:int)->dict:
+	"""Return `{way_of_calling: calls per second}` for `WhoWrapper` with
+	the old `BaseManager` server. None of `METHODS_TO_CALL` takes `who`,
+	so each call is two round trips, the second after the `TypeError`."""
+	TheOldSetupClientManager.register('get_the_setup')
+	manager = TheOldSetupClientManager(address=address, authkey=b'abracadabra')
+	manager.connect()
+	wrapper = WhoWrapper(object_to_wrap=manager.get_the_setup(), who='benchmark_setup_client.py')
+	method = iter(METHODS_TO_CALL*n_calls)
+	return {
+		'WhoWrapper, old BaseManager server': calls_per_second(lambda: getattr(wrapper, next(method))(), n_calls),
+	}
+
+def benchmark(address:tuple, n_calls:int, batch_size:int)->dict:
+	"""Return `{way_of_calling: calls per second}`."""
+	client = SetupClient(address=address)
+	proxy = SetupProxy(client=client, who='benchmark_setup_client.py')
+	method = iter(METHODS_TO_CALL*n_calls)
+	results = {
+		'SetupProxy': calls_per_second(lambda: getattr(proxy, next(method))(), n_calls),
+		f'SetupProxy.call_many, {batch_size} per request': calls_per_second(lambda: proxy.call_many([(next(method),) for _ in range(batch_size)]), n_calls//batch_size)*batch_size,
+	}
+	client.close()
+	return results
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Measure the calls per second to the setup server with the different clients.')
+	parser.add_argument('--fake',
+		help = 'Start a server with a stand-in of the setup instead of using the one running.',
+		action = 'store_true',
+		dest = 'fake',
+	)
+	parser.add_argument('--calls',
+		metavar = 'N',
+		help = 'Number of calls for each way of calling.',
+		default = 1000,
+		dest = 'n_calls',
+		type = int,
+	)
+	parser.add_argument('--batch',
+		metavar = 'N',
+		help = 'Number of calls per request with `call_many`.',
+		default = 10,
+		dest = 'batch_size',
+		type = int,
+	)
+	args = parser.parse_args()
+
+	address = SETUP_ADDRESS
+	results = {}
+	if args.fake:
+		address = ('localhost', SETUP_ADDRESS[1]+1)
+		server = TheSetupServer(StandInSetup(), address=address, telemetry_periods_seconds={})
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		old_address = ('localhost', SETUP_ADDRESS[1]+2)
+		start_old_server(StandInSetup(), address=old_address)
+		time.sleep(1) # Let them start.
+		results |= benchmark_old(old_address, n_calls=args.n_calls)
+
+	results |= benchmark(address, n_calls=args.n_calls, batch_size=args.batch_size)
+	for way_of_calling, result in results.items():
+		print(f'{way_of_calling:<40} {result:8.0f} calls/s')
@@ -0,0 +1,123 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from pathlib import Path
+import pandas
+import sqlite3
+import pyarrow # https://arrow.apache.org/docs/python/
+import pyarrow.parquet
+import pyarrow.dataset
+import logging
+from utils import compact_parsed_data, PARSED_DATA_INDEX_COLUMNS
+
+PARTITION_COLUMNS = ['n_channel','n_pulse']
+
+def export_sqlite_to_parquet(path_to_sqlite_file:Path, path_to_parquet:Path, partition_columns:list=None, chunksize:int=100000, compact:bool=True):
+	"""Export a table produced by a `SQLiteDataFrameDumper` into Parquet
+	format, reading it in chunks so it works for files of any size.
+
+	Arguments
+	---------
+	path_to_sqlite_file: Path
+		Path to the `.sqlite` file.
+	path_to_parquet: Path
+		Path to the directory where to write the Parquet dataset. If it
+		already exists it is replaced.
+	partition_columns: list of str, optional
+		Columns to partition the dataset by, e.g. `['n_channel','n_pulse']`.
+		Each combination of values goes into its own subdirectory, so
+		readers can skip the others completely.
+	chunksize: int, default 100000
+		Number of rows to read each time.
+	compact: bool, default True
+		If `True` the data is stored with the compact schema of `utils.compact_parsed_data`.
+	"""
+	path_to_parquet = Path(path_to_parquet)
+	if path_to_parquet.exists():
+		for p in sorted(path_to_parquet.rglob('*'), reverse=True):
+			p.unlink() if p.is_file() else p.rmdir()
+		path_to_parquet.rmdir()
+	with sqlite3.connect(path_to_sqlite_file) as connection:
+		for n_chunk,chunk in enumerate(pandas.read_sql('SELECT * FROM dataframe_table', con=connection, chunksize=chunksize)):
+			if compact:
+				chunk = compact_parsed_data(chunk)
+			for col in partition_columns or []:
+				chunk[col] = chunk[col].astype(int) # Partition values are stored in the directory names.
+			pyarrow.parquet.write_to_dataset(
+				pyarrow.Table.from_pandas(chunk, preserve_index=False),
+				root_path = path_to_parquet,
+				partition_cols = partition_columns,
+				basename_template = f'chunk_{n_chunk}_{{i}}.parquet',
+			)
+
+def export_TCT_1D_scan_to_parquet(bureaucrat:RunBureaucrat):
+	"""Export the parsed and measured data of a `TCT_1D_scan` into Parquet,
+	next to the `.sqlite` files. The parsed data is partitioned by `n_channel`
+	and `n_pulse` and stored with the compact schema. The measured data is
+	stored as it is, it is one row per position and the positions need
+	the precision of `float64`. Use `read_parquet_data` to read it back."""
+	path_to_TCT_1D_scan = bureaucrat.path_to_directory_of_task('TCT_1D_scan')
+	for name,partition_columns,compact in [('parsed_from_waveforms',PARTITION_COLUMNS,True), ('measured_data',None,False)]:
+		logging.info(f'Exporting {name} into Parquet...')
+		export_sqlite_to_parquet(
+			path_to_sqlite_file = path_to_TCT_1D_scan/f'{name}.sqlite',
+			path_to_parquet = path_to_TCT_1D_scan/f'{name}.parquet',
+			partition_columns = partition_columns,
+			compact = compact,
+		)
+	logging.info(f'Parquet files are ready in {path_to_TCT_1D_scan}')
+
+def read_parquet_data(path_to_parquet:Path, columns:list=None, filters:dict=None)->pandas.DataFrame:
+	"""Read data written by `export_sqlite_to_parquet`, loading only the
+	requested columns and partitions.
+
+	Arguments
+	---------
+	path_to_parquet: Path
+		Path to the Parquet dataset.
+	columns: list of str, optional
+		Columns to load, besides the index columns. Default is all of them.
+	filters: dict, optional
+		A dictionary of the form `{column: value}` or `{column: [value1, value2, ...]}`
+		to load only the rows matching all of them, e.g. `{'n_pulse': 1, 'n_channel': [0,1]}`.
+		Filters on partition columns skip whole files and the others are
+		pushed down to the Parquet row groups.
+
+	Returns
+	-------
+	data: pandas.DataFrame
+		The data, indexed by the index columns present in it.
+	"""
+	dataset = pyarrow.dataset.dataset(path_to_parquet, format='parquet', partitioning='hive')
+	index_columns = [col for col in PARSED_DATA_INDEX_COLUMNS if col in dataset.schema.names]
+	if columns is not None:
+		columns = index_columns + [col for col in columns if col not in index_columns]
+	expression = None
+	for col,value in (filters or {}).items():
+		this_expression = pyarrow.dataset.field(col).isin(value) if isinstance(value, (list,tuple,set)) else pyarrow.dataset.field(col) == value
+		expression = this_expression if expression is None else expression & this_expression
+	data = dataset.to_table(columns=columns, filter=expression).to_pandas()
+	if len(index_columns) > 0:
+		data = data.set_index(index_columns)
+	return data
+
+if __name__ == '__main__':
+	import argparse
+	import sys
+
+	logging.basicConfig(
+		stream = sys.stderr,
+		level = logging.INFO,
+		format = '%(asctime)s|%(levelname)s|%(funcName)s|%(message)s',
+		datefmt = '%Y-%m-%d %H:%M:%S',
+	)
+
+	parser = argparse.ArgumentParser(description='Export the data of a TCT 1D scan into Parquet format.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+
+	args = parser.parse_args()
+	export_TCT_1D_scan_to_parquet(RunBureaucrat(Path(args.directory)))
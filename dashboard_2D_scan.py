@@ -0,0 +1,184 @@
+from pathlib import Path
+import pandas
+import numpy
+import base64
+import json
+
+ADDITIVE_COLUMNS = ['Amplitude (V)','Collected charge (V s)'] # Their sum over the channels makes sense, e.g. the total charge when the laser is between pads.
+
+def _encode_float32(values)->str:
+	return base64.b64encode(numpy.ascontiguousarray(values, dtype='<f4').tobytes()).decode('ascii')
+
+def _encode_int32(values)->str:
+	return base64.b64encode(numpy.ascontiguousarray(values, dtype='<i4').tobytes()).decode('ascii')
+
+def dashboard_data(aggregated_data:pandas.DataFrame, columns:list, statistics:list=['nanmedian','kMAD'])->dict:
+	"""Pack the aggregated data of a 2D scan into a dictionary ready to be
+	dumped as JSON, with the numbers stored as base64 encoded little endian
+	float32 arrays, one per variable, statistic and channel, so the browser
+	decodes only what is being displayed.
+
+	Arguments
+	---------
+	aggregated_data: pandas.DataFrame
+		Indexed by `n_position` and `n_channel`, with the columns `n_x`,
+		`n_y`, `x (m)`, `y (m)` and `'{column} {statistic}'` for each
+		of the `columns` and `statistics`.
+	columns: list of str
+		The variables to include, e.g. `['Amplitude (V)','t_50 (s)']`.
+	statistics: list of str, default `['nanmedian','kMAD']`
+		The statistics to include, see `utils.aggregate_parsed_data`.
+	
+	The sum of all the channels is offered only for the `nanmedian` of
+	the `ADDITIVE_COLUMNS`, for the others it has no meaning.
+	"""
+	positions = aggregated_data[['n_x','n_y','x (m)','y (m)']].groupby('n_position').first().sort_index()
+	channels = sorted(aggregated_data.index.get_level_values('n_channel').unique())
+	values = {}
+	for col in columns:
+		values[col] = {}
+		for stat in statistics:
+			table = aggregated_data[f'{col} {stat}'].unstack('n_channel').reindex(index=positions.index, columns=channels)
+			values[col][stat] = {str(n_channel): _encode_float32(table[n_channel]) for n_channel in channels}
+	return {
+		'n_positions': len(positions),
+		'channels': [str(_) for _ in channels],
+		'n_x': _encode_int32(positions['n_x']),
+		'n_y': _encode_int32(positions['n_y']),
+		'n_position': _encode_int32(positions.index),
+		'x (m)': _encode_float32(positions['x (m)']),
+		'y (m)': _encode_float32(positions['y (m)']),
+		'values': values,
+		'summable': [col for col in columns if col in ADDITIVE_COLUMNS and 'nanmedian' in statistics],
+	}
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<script src="https://cdn.plot.ly/plotly-__PLOTLYJS_VERSION__.min.js"></script>
+<style>
+body {font-family: sans-serif; margin: 0;}
+#controls {padding: 8px;}
+#controls label {margin-right: 16px;}
+#plot {width: 100%; height: 90vh;}
+</style>
+</head>
+<body>
+<div id="controls">
+<label>Variable <select id="variable"></select></label>
+<label>Statistic <select id="statistic"></select></label>
+<label>Channel <select id="channel"></select></label>
+<label>Plot <select id="kind"><option value="nx_ny">vs n_x,n_y</option><option value="xy">vs x,y</option></select></label>
+</div>
+<div id="plot"></div>
+<script>
+const DATA = __DATA__;
+const TITLE = __TITLE_JSON__;
+
+function decode(b64, ArrayType) {
+	const binary = atob(b64);
+	const bytes = new Uint8Array(binary.length);
+	for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+	return new ArrayType(bytes.buffer);
+}
+
+const n_x = decode(DATA['n_x'], Int32Array);
+const n_y = decode(DATA['n_y'], Int32Array);
+const n_position = decode(DATA['n_position'], Int32Array);
+const x = decode(DATA['x (m)'], Float32Array);
+const y = decode(DATA['y (m)'], Float32Array);
+const nx_max = n_x.reduce((a, b) => Math.max(a, b), 0);
+const ny_max = n_y.reduce((a, b) => Math.max(a, b), 0);
+const hover_text = Array.from(n_position, (n, i) => `n_position=${n}<br>n_x=${n_x[i]}<br>n_y=${n_y[i]}`);
+
+const decoded = {};
+function get_values(variable, statistic, channel) {
+	const key = [variable, statistic, channel].join('|');
+	if (!(key in decoded)) {
+		if (channel === 'sum') {
+			const sum = new Float32Array(DATA.n_positions).fill(NaN); // NaN where no channel has data, like pandas `sum(min_count=1)`.
+			for (const ch of DATA.channels) {
+				const v = get_values(variable, statistic, ch);
+				for (let i = 0; i < v.length; i++) if (!isNaN(v[i])) sum[i] = isNaN(sum[i]) ? v[i] : sum[i] + v[i];
+			}
+			decoded[key] = sum;
+		} else {
+			decoded[key] = decode(DATA.values[variable][statistic][channel], Float32Array);
+		}
+	}
+	return decoded[key];
+}
+
+function fill_select(id, options) {
+	const select = document.getElementById(id);
+	const selected = select.value;
+	select.innerHTML = '';
+	for (const [value, text] of options) {
+		const option = document.createElement('option');
+		option.value = value;
+		option.text = text;
+		select.appendChild(option);
+	}
+	if (options.some(([value, text]) => value === selected)) select.value = selected;
+}
+
+function update_plot() {
+	const variable = document.getElementById('variable').value;
+	const statistic = document.getElementById('statistic').value;
+	const sum_makes_sense = DATA.summable.includes(variable) && statistic === 'nanmedian';
+	fill_select('channel', (sum_makes_sense ? [['sum', 'sum of all channels']] : []).concat(DATA.channels.map(c => [c, c])));
+	const channel = document.getElementById('channel').value;
+	const kind = document.getElementById('kind').value;
+	const values = get_values(variable, statistic, channel);
+	const name = `${statistic}(${variable})` + (channel === 'sum' ? ', sum of all channels' : `, n_channel=${channel}`);
+	let trace, layout;
+	if (kind === 'nx_ny') {
+		const z = Array.from({length: ny_max+1}, () => new Array(nx_max+1).fill(null));
+		for (let i = 0; i < values.length; i++) z[n_y[i]][n_x[i]] = isNaN(values[i]) ? null : values[i];
+		trace = {type: 'heatmap', z: z, colorscale: 'Viridis', colorbar: {title: {text: variable, side: 'right'}}};
+		layout = {xaxis: {title: 'n_x', constrain: 'domain'}, yaxis: {title: 'n_y', scaleanchor: 'x', scaleratio: 1}};
+	} else {
+		trace = {
+			type: 'scattergl',
+			mode: 'markers',
+			x: x,
+			y: y,
+			text: hover_text,
+			marker: {color: values, colorscale: 'Viridis', showscale: true, colorbar: {title: {text: variable, side: 'right'}}},
+		};
+		layout = {xaxis: {title: 'x (m)'}, yaxis: {title: 'y (m)', scaleanchor: 'x', scaleratio: 1}};
+	}
+	layout.title = {text: `${name}<br><sup>${TITLE}</sup>`};
+	Plotly.react('plot', [trace], layout);
+}
+
+fill_select('variable', Object.keys(DATA.values).map(v => [v, v]));
+fill_select('statistic', Object.keys(Object.values(DATA.values)[0]).map(s => [s, s]));
+for (const id of ['variable', 'statistic', 'channel', 'kind']) document.getElementById(id).addEventListener('change', update_plot);
+update_plot();
+</script>
+</body>
+</html>
+'''
+
+def write_dashboard(aggregated_data:pandas.DataFrame, columns:list, path_to_file:Path, title:str, statistics:list=['nanmedian','kMAD']):
+	"""Write a single self contained HTML page to explore the aggregated
+	data of a 2D scan. The data is embedded once in compact binary form,
+	the plots use WebGL (`scattergl`) or a single `heatmap`, and the variable,
+	statistic, channel and kind of plot are switched in the browser without
+	reloading anything. For the arguments see `dashboard_data`."""
+	from plotly.offline import get_plotlyjs_version
+	
+	data = json.dumps(dashboard_data(aggregated_data, columns=columns, statistics=statistics))
+	html = HTML_TEMPLATE
+	for placeholder,value in {
+		'__PLOTLYJS_VERSION__': get_plotlyjs_version(),
+		'__TITLE_JSON__': json.dumps(title).replace('</','<\\/'),
+		'__TITLE__': title.replace('&','&amp;').replace('<','&lt;'),
+		'__DATA__': data.replace('</','<\\/'),
+	}.items():
+		html = html.replace(placeholder, value)
+	with open(path_to_file, 'w') as ofile:
+		ofile.write(html)
@@ -0,0 +1,170 @@
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import shutil
+import logging
+import time
+
+# Default thresholds of free space, in bytes, for each of the actions of `DiskSpaceGuard`.
+COMPRESS_BELOW_BYTES = 50e9
+PARSED_ONLY_BELOW_BYTES = 20e9
+PAUSE_BELOW_BYTES = 5e9
+
+LEVELS = ['ok','compress','parsed_only','pause'] # From less to more severe.
+
+def _compress_and_delete(path_to_waveforms_file:Path):
+	from utils import compress_waveforms_sqlite
+
+	compress_waveforms_sqlite(path_to_waveforms_file)
+	path_to_waveforms_file.unlink()
+
+class DiskSpaceGuard:
+	"""Watches the free space in the disk where a scan is written, so the
+	scan degrades gracefully instead of crashing when the disk is full.
+	According to the free space there are four levels:
+
+	- `'ok'`: Nothing to do.
+	- `'compress'`: The waveforms files of the scans that are finished
+	are compressed, see `add_finished_waveforms_file`. This is done by
+	a background process, so the scan goes on meanwhile.
+	- `'parsed_only'`: Besides, the waveforms are not saved anymore, only
+	the parsed data.
+	- `'pause'`: Besides, the scan waits until there is free space again.
+
+	Each time the level changes it is logged and sent to the reporter.
+	The free space is checked at most every `seconds_between_checks`, so
+	calling `protect` before each position costs nothing.
+
+	Usage:
+	```
+	disk_space_guard = DiskSpaceGuard(path_to_directory, reporter=reporter)
+	for n_position ...:
+		if not disk_space_guard.protect():
+			save_waveforms = False
+		...
+	disk_space_guard.wait_for_compressions()
+	```
+	"""
+	def __init__(self, path:Path, compress_below_bytes:float=COMPRESS_BELOW_BYTES, parsed_only_below_bytes:float=PARSED_ONLY_BELOW_BYTES, pause_below_bytes:float=PAUSE_BELOW_BYTES, reporter=None, seconds_between_checks:float=10, seconds_between_checks_while_paused:float=60):
+		"""
+		Arguments
+		---------
+		path: Path
+			Any path in the disk to watch, e.g. the directory of the run.
+		compress_below_bytes, parsed_only_below_bytes, pause_below_bytes: float
+			Free space below which each action is taken.
+		reporter: optional
+			An object with a `send_message` method, e.g. a `SafeTelegramReporter4Loops`.
+		seconds_between_checks: float, default 10
+			Minimum time between two checks of the free space.
+		seconds_between_checks_while_paused: float, default 60
+			How often to check the free space while paused.
+		"""
+		if not compress_below_bytes >= parsed_only_below_bytes >= pause_below_bytes:
+			raise ValueError(f'The thresholds must be `compress_below_bytes >= parsed_only_below_bytes >= pause_below_bytes`, received {compress_below_bytes}, {parsed_only_below_bytes} and {pause_below_bytes}. ')
+		self.path = Path(path)
+		self.thresholds = {
+			'compress': compress_below_bytes,
+			'parsed_only': parsed_only_below_bytes,
+			'pause': pause_below_bytes,
+		}
+		self.reporter = reporter
+		self.seconds_between_checks = seconds_between_checks
+		self.seconds_between_checks_while_paused = seconds_between_checks_while_paused
+		self.level = 'ok'
+		self._last_check = None
+		self._finished_waveforms_files = []
+		self._compressor = None # Started the first time something has to be compressed.
+		self._compressions = {} # `{future: path_to_waveforms_file}`
+
+	def free_bytes(self)->int:
+		return shutil.disk_usage(self.path).free
+
+	def _notify(self, message:str):
+		logging.warning(message)
+		if self.reporter is not None:
+			try:
+				self.reporter.send_message(message)
+			except Exception as e: # Reporting must never stop the scan.
+				logging.error(f'Cannot send message to the reporter because of {repr(e)}.')
+
+	def check(self, force:bool=False)->str:
+		"""Check the free space and return the current level, one of
+		`'ok'`, `'compress'`, `'parsed_only'` or `'pause'`. Unless `force`,
+		the level of the last check is returned if it was less than
+		`seconds_between_checks` ago."""
+		if not force and self._last_check is not None and time.time() - self._last_check < self.seconds_between_checks:
+			return self.level
+		self._last_check = time.time()
+		free_bytes = self.free_bytes()
+		level = 'ok'
+		for candidate in LEVELS[1:]:
+			if free_bytes < self.thresholds[candidate]:
+				level = candidate
+		if level != self.level:
+			message = {
+				'ok': 'back to normal',
+				'compress': 'compressing the waveforms of the finished scans',
+				'parsed_only': 'the waveforms are not saved anymore, only the parsed data',
+				'pause': 'pausing the scan until there is free space again',
+			}[level]
+			self._notify(f'💾 {free_bytes/1e9:.1f} GB free in "{self.path}", {message}.')
+			self.level = level
+		return level
+
+	def add_finished_waveforms_file(self, path_to_waveforms_file:Path):
+		"""Add a `waveforms.sqlite` of a finished scan to the files that
+		will be compressed if the disk is getting full."""
+		self._finished_waveforms_files.append(Path(path_to_waveforms_file))
+
+	def compress_finished_waveforms_files(self):
+		"""Start compressing all the files from `add_finished_waveforms_file`
+		that were not compressed yet, see `utils.compress_waveforms_sqlite`,
+		one after the other in a background process. Each file is deleted
+		once compressed."""
+		from utils import is_being_compressed
+		
+		while len(self._finished_waveforms_files) > 0:
+			path_to_waveforms_file = self._finished_waveforms_files.pop(0)
+			if not path_to_waveforms_file.is_file() or path_to_waveforms_file in self._compressions.values() or is_being_compressed(path_to_waveforms_file): # Already compressed, or being compressed right now.
+				continue
+			if self._compressor is None:
+				self._compressor = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) # Not forked, the scan has threads, e.g. those of the connection with the setup.
+			self._notify(f'💾 Compressing "{path_to_waveforms_file}" in the background to free disk space...')
+			self._compressions[self._compressor.submit(_compress_and_delete, path_to_waveforms_file)] = path_to_waveforms_file
+
+	def _report_finished_compressions(self):
+		for future in [future for future in self._compressions if future.done()]:
+			path_to_waveforms_file = self._compressions.pop(future)
+			if future.exception() is not None:
+				self._notify(f'💾 Cannot compress "{path_to_waveforms_file}" because of {repr(future.exception())}.')
+
+	def wait_for_compressions(self):
+		"""Wait until the background compressions finish, e.g. at the end
+		of a scan."""
+		if self._compressor is not None:
+			self._compressor.shutdown(wait=True)
+			self._compressor = None
+		self._report_finished_compressions()
+
+	def wait_while_disk_is_full(self):
+		"""Block while the level is `'pause'`."""
+		time_paused = time.time()
+		while self.check(force=True) == 'pause':
+			self._report_finished_compressions()
+			time.sleep(self.seconds_between_checks_while_paused)
+		if time.time() - time_paused > self.seconds_between_checks_while_paused:
+			self._notify(f'💾 Resuming the scan after {(time.time()-time_paused)/60:.0f} minutes paused.')
+
+	def protect(self)->bool:
+		"""Do what corresponds to the free space: start compressing the
+		finished waveforms files and pause if needed. Meant to be called before
+		each position of a scan. Returns `False` if the waveforms should
+		not be saved anymore, `True` otherwise."""
+		self._report_finished_compressions()
+		if self.check() == 'ok':
+			return True
+		self.compress_finished_waveforms_files()
+		if self.level == 'pause':
+			self.wait_while_disk_is_full()
+		return self.level in {'ok','compress'}
@@ -240,9 +240,9 @@ class graphical_ParticularsLaserStatusDisplay(tk.Frame):
 		threading.Thread(target=thread_function, daemon=True).start()
 		
 	def update_display(self):
-		self.status_label.config(text=f'{repr(self.the_setup.get_laser_status())}')
-		self.DAC_label.config(text=f'{self.the_setup.get_laser_DAC()}')
-		self.frequency_label.config(text=f'{self.the_setup.get_laser_frequency():.0f} Hz')
+		self.status_label.config(text=f'{repr(self.the_setup.get_telemetry("get_laser_status"))}')
+		self.DAC_label.config(text=f'{self.the_setup.get_telemetry("get_laser_DAC")}')
+		self.frequency_label.config(text=f'{self.the_setup.get_telemetry("get_laser_frequency"):.0f} Hz')
 	
 class graphical_ParticularsLaserControlInput(tk.Frame):
 	def __init__(self, parent, the_setup, *args, **kwargs):
@@ -370,9 +370,9 @@ class TemperatureMonitor(tk.Frame):
 		threading.Thread(target=thread_function, daemon=True).start()
 	
 	def update_display(self):
-		self.temperature_label.config(text=f'{self.the_setup.measure_temperature():.2f} °C')
-		self.humidity_label.config(text=f'{self.the_setup.measure_humidity():.2f} %RH')
-		self.peltier_IV_label.config(text=f'{self.the_setup.get_peltier_status()}, {self.the_setup.measure_peltier_voltage()*self.the_setup.measure_peltier_current():.2f} W')
+		self.temperature_label.config(text=f'{self.the_setup.get_telemetry("measure_temperature"):.2f} °C')
+		self.humidity_label.config(text=f'{self.the_setup.get_telemetry("measure_humidity"):.2f} %RH')
+		self.peltier_IV_label.config(text=f'{self.the_setup.get_telemetry("get_peltier_status")}, {self.the_setup.get_telemetry("measure_peltier_voltage")*self.the_setup.get_telemetry("measure_peltier_current"):.2f} W')
 
 class BiasVoltageGraphicalControl(tk.Frame):
 	def __init__(self, parent, the_setup, *args, **kwargs):
@@ -481,10 +481,10 @@ class BiasVoltageGraphicalDisplay(tk.Frame):
 		threading.Thread(target=thread_function, daemon=True).start()
 		
 	def update_display(self):
-		self.measured_voltage_label.config(text=f'{self.the_setup.measure_bias_voltage():.2f} V')
-		self.current_compliance_label.config(text=f'{self.the_setup.get_current_compliance()*1e6:.3f} µA')
-		self.measured_current_label.config(text=f'{self.the_setup.measure_bias_current()*1e6:.6f} µA')
-		self.status_label.config(text=f'{self.the_setup.get_bias_output_status()}')
+		self.measured_voltage_label.config(text=f'{self.the_setup.get_telemetry("measure_bias_voltage"):.2f} V')
+		self.current_compliance_label.config(text=f'{self.the_setup.get_telemetry("get_current_compliance")*1e6:.3f} µA')
+		self.measured_current_label.config(text=f'{self.the_setup.get_telemetry("measure_bias_current")*1e6:.6f} µA')
+		self.status_label.config(text=f'{self.the_setup.get_telemetry("get_bias_output_status")}')
 	
 if __name__ == '__main__':
 	from TheSetup import connect_me_with_the_setup
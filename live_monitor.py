@@ -0,0 +1,255 @@
+from pathlib import Path
+import pandas
+import numpy
+import json
+import threading
+import queue
+import logging
+import time
+import datetime
+from utils import integrate_distance_given_path
+
+LIVE_STREAM_FILE_NAME = 'live_stream.jsonl'
+MONITORED_COLUMNS = ['Amplitude (V)','Collected charge (V s)','t_50 (s)']
+MONITORED_STATISTICS = ['nanmedian','kMAD']
+
+def _jsonable(value):
+	if isinstance(value, (numpy.integer,)):
+		return int(value)
+	if isinstance(value, (numpy.floating,float)):
+		return None if numpy.isnan(value) else float(value)
+	if isinstance(value, (datetime.datetime,pandas.Timestamp)):
+		return value.isoformat()
+	return value
+
+class LiveStreamPublisher:
+	"""Publishes the per position aggregates of a scan into a JSON lines
+	file while the scan is running, so they can be followed with `monitor`.
+
+	`publish` only puts the data into a bounded queue and returns
+	immediately. A background thread serializes it and writes it. If the
+	queue is full the data is dropped, and if writing fails the thread
+	logs the error and stops, so the acquisition is never slowed down
+	nor interrupted by the live stream.
+
+	Usage:
+	```
+	with LiveStreamPublisher(path_to_file) as live_stream:
+		for n_position ...:
+			...
+			live_stream.publish(measured_data, aggregated_data)
+	```
+	"""
+	def __init__(self, path_to_file:Path, max_queue_size:int=1000):
+		self.path_to_file = Path(path_to_file)
+		self._queue = queue.Queue(maxsize=max_queue_size)
+		self.n_dropped = 0
+		self._thread = threading.Thread(target=self._write_forever, daemon=True)
+
+	def __enter__(self):
+		self._thread.start()
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		self._put({'finished': True, 'When': datetime.datetime.now().isoformat(), 'n_dropped': self.n_dropped})
+		if self._thread.is_alive():
+			try:
+				self._queue.put(None, timeout=5)
+			except queue.Full:
+				pass
+			self._thread.join(timeout=5)
+		if self.n_dropped > 0:
+			logging.warning(f'{self.n_dropped} records were dropped from the live stream into {self.path_to_file} because it could not keep up.')
+
+	def _put(self, item):
+		try:
+			self._queue.put_nowait(item)
+		except queue.Full:
+			self.n_dropped += 1
+
+	def publish(self, measured_data:pandas.DataFrame, aggregated_data:pandas.DataFrame):
+		"""Publish the data of one position. Never blocks.
+
+		Arguments
+		---------
+		measured_data: pandas.DataFrame
+			The data appended to `measured_data.sqlite` for this position,
+			indexed by `n_position`.
+		aggregated_data: pandas.DataFrame
+			The output of `utils.aggregate_parsed_data` for this position.
+		"""
+		self._put((measured_data, aggregated_data))
+
+	def _write_forever(self):
+		try:
+			with open(self.path_to_file, 'a') as ofile:
+				while True:
+					item = self._queue.get()
+					if item is None:
+						break
+					if isinstance(item, dict):
+						record = item
+					else:
+						record = _position_record(*item)
+					print(json.dumps(record), file=ofile, flush=True)
+		except Exception as e:
+			logging.error(f'Live stream into {self.path_to_file} stopped because of {repr(e)}, the scan continues without it.')
+
+def _position_record(measured_data:pandas.DataFrame, aggregated_data:pandas.DataFrame)->dict:
+	measured_data = measured_data.reset_index(drop=False).iloc[0]
+	columns = [f'{col} {stat}' for col in MONITORED_COLUMNS for stat in MONITORED_STATISTICS if f'{col} {stat}' in aggregated_data.columns]
+	return {
+		**{key: _jsonable(measured_data[key]) for key in ['n_position','x (m)','y (m)','z (m)','When'] if key in measured_data},
+		'aggregated': [
+			{key: _jsonable(value) for key,value in row.items()}
+			for row in aggregated_data[columns].reset_index(drop=False).to_dict(orient='records')
+		],
+	}
+
+def read_live_stream(path_to_file:Path, offset:int=0):
+	"""Read the records from a live stream written by `LiveStreamPublisher`,
+	starting at byte `offset`. Only complete lines are read, so it can be
+	called repeatedly while the file is being written.
+
+	Returns
+	-------
+	records: list of dict
+		The records.
+	offset: int
+		Where to continue reading next time.
+	"""
+	records = []
+	with open(path_to_file, 'rb') as ifile:
+		ifile.seek(offset)
+		for line in ifile:
+			if not line.endswith(b'\n'):
+				break
+			offset += len(line)
+			records.append(json.loads(line))
+	return records, offset
+
+def _records_to_dataframe(records:list)->pandas.DataFrame:
+	rows = []
+	for record in records:
+		if record.get('finished') == True:
+			continue
+		for aggregated in record['aggregated']:
+			rows.append({**{k:v for k,v in record.items() if k != 'aggregated'}, **aggregated})
+	data = pandas.DataFrame.from_records(rows)
+	return data.astype({col: float for col in data.columns if col not in {'When','n_position','n_channel','n_pulse'}})
+
+def _write_html_atomically(fig, path_to_file:Path, refresh_seconds:float):
+	path_to_temporary_file = path_to_file.with_suffix('.tmp')
+	fig.write_html(
+		path_to_temporary_file,
+		include_plotlyjs = 'cdn',
+		post_script = f'setTimeout(function(){{location.reload();}}, {int(refresh_seconds*1000)});',
+	)
+	path_to_temporary_file.replace(path_to_file)
+
+def plot_live_data(data:pandas.DataFrame, path_to_directory:Path, title:str, refresh_seconds:float=5):
+	"""Produce the plots of `monitor` from the data read so far, into
+	HTML files that reload themselves every `refresh_seconds`."""
+	import plotly.express as px # Only the monitor needs it, not the publisher.
+	
+	data = data.sort_values(['n_position','n_channel','n_pulse'])
+	positions = data.groupby('n_position')[['x (m)','y (m)','z (m)']].first()
+	positions['Distance (m)'] = integrate_distance_given_path(list(positions.to_numpy()))
+	data = data.merge(positions[['Distance (m)']], left_on='n_position', right_index=True)
+	data['n_channel'] = data['n_channel'].astype(str)
+	for col in MONITORED_COLUMNS:
+		if f'{col} nanmedian' not in data.columns:
+			continue
+		fig = px.line(
+			data_frame = data,
+			title = f'{col} vs distance (live)<br><sup>{title}, last update {datetime.datetime.now():%H:%M:%S}</sup>',
+			x = 'Distance (m)',
+			y = f'{col} nanmedian',
+			error_y = f'{col} kMAD' if f'{col} kMAD' in data.columns else None,
+			color = 'n_channel',
+			facet_row = 'n_pulse',
+			markers = True,
+			labels = {f'{col} nanmedian': col},
+		)
+		_write_html_atomically(fig, path_to_directory/f'{col} vs distance.html', refresh_seconds)
+
+		if positions[['x (m)','y (m)']].nunique().min() > 1: # It is a 2D scan.
+			fig = px.scatter(
+				data_frame = data.query('n_pulse==1').groupby(['n_position','x (m)','y (m)'])[f'{col} nanmedian'].sum().reset_index(),
+				title = f'sum({col}) vs x,y (live)<br><sup>{title}, last update {datetime.datetime.now():%H:%M:%S}</sup>',
+				x = 'x (m)',
+				y = 'y (m)',
+				color = f'{col} nanmedian',
+				hover_data = ['n_position'],
+				labels = {f'{col} nanmedian': f'sum({col})'},
+			)
+			fig.update_yaxes(
+				scaleanchor = "x",
+				scaleratio = 1,
+			)
+			_write_html_atomically(fig, path_to_directory/f'sum({col}) vs x,y.html', refresh_seconds)
+
+def monitor(path_to_directory:Path, refresh_seconds:float=5):
+	"""Follow the most recent live stream found in `path_to_directory`
+	or any of its subdirectories and keep the plots of `plot_live_data`
+	updated, into a directory `live_monitor` next to the stream. If a
+	newer stream appears, e.g. in a sweep of voltages, it switches to it.
+	Runs until interrupted with Ctrl+C. This only reads the stream, so
+	it can be started, stopped or crash at any time without affecting
+	the scan."""
+	path_to_directory = Path(path_to_directory)
+	path_to_stream = None
+	while True:
+		streams = sorted(path_to_directory.rglob(LIVE_STREAM_FILE_NAME), key=lambda p: p.stat().st_mtime)
+		if len(streams) > 0 and streams[-1] != path_to_stream:
+			path_to_stream = streams[-1]
+			logging.info(f'Following {path_to_stream}...')
+			offset = 0
+			records = []
+			path_to_plots = path_to_stream.parent/'live_monitor'
+			path_to_plots.mkdir(exist_ok=True)
+		if path_to_stream is not None:
+			new_records, offset = read_live_stream(path_to_stream, offset)
+			records += new_records
+			if len(new_records) > 0 and len(_records_to_dataframe(records)) > 0:
+				plot_live_data(
+					data = _records_to_dataframe(records),
+					path_to_directory = path_to_plots,
+					title = str(path_to_stream.parent.relative_to(path_to_directory)),
+					refresh_seconds = refresh_seconds,
+				)
+				logging.info(f'{len(records)} records read so far.')
+		time.sleep(refresh_seconds)
+
+if __name__ == '__main__':
+	import argparse
+	from plotly_utils import set_my_template_as_default
+	import sys
+
+	logging.basicConfig(
+		stream = sys.stderr,
+		level = logging.INFO,
+		format = '%(asctime)s|%(levelname)s|%(funcName)s|%(message)s',
+		datefmt = '%Y-%m-%d %H:%M:%S',
+	)
+
+	set_my_template_as_default()
+
+	parser = argparse.ArgumentParser(description='Follow a running scan and keep some plots updated.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument('--refresh',
+		metavar = 'seconds',
+		help = 'Seconds between updates.',
+		default = 5,
+		dest = 'refresh_seconds',
+		type = float,
+	)
+
+	args = parser.parse_args()
+	monitor(Path(args.directory), refresh_seconds=args.refresh_seconds)
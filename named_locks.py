@@ -0,0 +1,212 @@
+import threading
+import asyncio
+import itertools
+import logging
+import time
+
+class FairNamedLock:
+	"""A lock that is held by a name, `who`, instead of by a thread, so
+	everything done on behalf of the same `who` can enter it again while
+	it holds it, e.g. a scan that holds the stages and then moves them.
+
+	Whoever is waiting gets it in order of `priority`, highest first, and
+	among the same priority in the order they arrived, as soon as it is
+	released. It can be acquired with a lease, then if it is not renewed
+	within `lease_seconds` it is released automatically as soon as someone
+	else is waiting for it, so a client that crashed cannot hold it forever.
+	While nobody is waiting the holder keeps it, and can renew it late.
+
+	Usage:
+	```
+	lock = FairNamedLock('bias')
+	with lock(who='iv_curve.py', priority=1):
+		...
+	```
+	"""
+	def __init__(self, name:str):
+		self.name = name
+		self._lock = threading.Lock()
+		self._holder = None
+		self._count = 0
+		self._held_since = None
+		self._lease_expires = None
+		self._waiters = [] # `[{'who','priority','since','ticket','lease_seconds','wake','granted'}]`
+		self._tickets = itertools.count()
+		self._contention = {} # `{who: {...}}`, see `contention`.
+
+	def __call__(self, who:str, priority:float=0):
+		return _HoldingFairNamedLock(self, who, priority)
+
+	def _expire_lease(self):
+		if self._holder is not None and self._lease_expires is not None and time.time() > self._lease_expires and len(self._waiters) > 0:
+			logging.warning(f'The lease of {repr(self._holder)} on named lock {repr(self.name)} expired, releasing it.')
+			self._release_completely()
+
+	def _release_completely(self):
+		self._contention_of(self._holder)['seconds holding'] += time.time() - self._held_since
+		self._holder = None
+		self._count = 0
+		self._held_since = None
+		self._lease_expires = None
+		self._hand_over()
+
+	def _contention_of(self, who:str)->dict:
+		return self._contention.setdefault(who, {'acquisitions': 0, 'seconds waiting': 0., 'max seconds waiting': 0., 'seconds holding': 0.})
+
+	def _next_waiter(self)->dict:
+		return min(self._waiters, key=lambda waiter: (-waiter['priority'], waiter['ticket']))
+
+	def _hand_over(self):
+		"""If the lock is free give it to the next waiter, and then let in
+		whoever else is waiting on behalf of the holder. Each of them is
+		woken up already holding it, so nobody has to race for it."""
+		now = time.time()
+		if self._holder is None and len(self._waiters) > 0:
+			waiter = self._next_waiter()
+			self._holder = waiter['who']
+			self._held_since = now
+			contention = self._contention_of(waiter['who'])
+			contention['acquisitions'] += 1
+			contention['seconds waiting'] += now - waiter['since']
+			contention['max seconds waiting'] = max(contention['max seconds waiting'], now - waiter['since'])
+		for waiter in [waiter for waiter in self._waiters if waiter['who'] == self._holder]:
+			self._waiters.remove(waiter)
+			self._count += 1
+			if waiter['lease_seconds'] is not None:
+				self._lease_expires = now + waiter['lease_seconds']
+			waiter['granted'] = True
+			waiter['wake']()
+
+	def _enqueue(self, who:str, priority:float, lease_seconds:float, wake)->dict:
+		self._expire_lease()
+		waiter = {'who': who, 'priority': priority, 'since': time.time(), 'ticket': next(self._tickets), 'lease_seconds': lease_seconds, 'wake': wake, 'granted': False}
+		self._waiters.append(waiter)
+		self._hand_over()
+		return waiter
+
+	def _give_up(self, waiter:dict):
+		"""For a waiter that is not going to use the lock anymore, e.g.
+		because it was cancelled, even if it was just given to it."""
+		if waiter['granted']:
+			self._release(waiter['who'])
+		else:
+			self._waiters.remove(waiter)
+			self._hand_over()
+
+	def acquire(self, who:str, priority:float=0, timeout:float=None, lease_seconds:float=None)->bool:
+		"""Wait until `who` holds the lock and return `True`, or return
+		`False` if `timeout` expires before that. If `lease_seconds` is
+		given, `renew` has to be called before it expires, otherwise the
+		lock is released."""
+		granted = threading.Event()
+		with self._lock:
+			waiter = self._enqueue(who, priority, lease_seconds, wake=granted.set)
+		while True:
+			seconds_to_wait = 1 # To notice expired leases.
+			if timeout is not None:
+				seconds_to_wait = max(0, min(seconds_to_wait, waiter['since'] + timeout - time.time()))
+			granted.wait(timeout=seconds_to_wait)
+			with self._lock:
+				self._expire_lease()
+				if waiter['granted']:
+					return True
+				if timeout is not None and time.time() >= waiter['since'] + timeout:
+					self._give_up(waiter)
+					return False
+
+	async def acquire_async(self, who:str, priority:float=0, lease_seconds:float=None)->bool:
+		"""Same as `acquire` but waiting in the event loop instead of in a
+		thread, so any number of requests can wait for it. To stop waiting,
+		cancel it."""
+		loop = asyncio.get_running_loop()
+		granted = loop.create_future()
+		def wake():
+			loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+		with self._lock:
+			waiter = self._enqueue(who, priority, lease_seconds, wake=wake)
+		try:
+			while True:
+				try:
+					await asyncio.wait_for(asyncio.shield(granted), timeout=1) # To notice expired leases.
+				except asyncio.TimeoutError:
+					pass
+				with self._lock:
+					self._expire_lease()
+					if waiter['granted']:
+						return True
+		except asyncio.CancelledError:
+			with self._lock:
+				self._give_up(waiter)
+			raise
+
+	def _release(self, who:str):
+		if self._holder != who: # E.g. its lease expired.
+			logging.warning(f'{repr(who)} released named lock {repr(self.name)} but it was not holding it.')
+			return
+		self._count -= 1
+		if self._count == 0:
+			self._release_completely()
+
+	def release(self, who:str):
+		with self._lock:
+			self._release(who)
+
+	def renew(self, who:str, lease_seconds:float, count:int=1, take_back_if_free:bool=False)->bool:
+		"""Extend the lease of `who` for `lease_seconds` more. Returns `False`
+		if `who` is not holding it. If `take_back_if_free` and the lock is
+		free and nobody is waiting for it, `who` gets it back with `count`
+		as the number of times it entered it, this is meant only for when
+		the lock has no record of `who` ever holding it, e.g. because the
+		server was restarted, never after `who` released it."""
+		with self._lock:
+			self._expire_lease()
+			if take_back_if_free and self._holder is None and len(self._waiters) == 0:
+				logging.warning(f'{repr(who)} got named lock {repr(self.name)} back.')
+				self._holder = who
+				self._count = count
+				self._held_since = time.time()
+				self._contention_of(who)
+			if self._holder != who:
+				return False
+			self._lease_expires = time.time() + lease_seconds
+			return True
+
+	def status(self)->dict:
+		"""Who holds the lock, since when, and who is waiting for it, in
+		the order they will get it."""
+		with self._lock:
+			self._expire_lease()
+			now = time.time()
+			return {
+				'holder': self._holder,
+				'count': self._count,
+				'held for (s)': now - self._held_since if self._holder is not None else None,
+				'lease expires in (s)': self._lease_expires - now if self._lease_expires is not None else None,
+				'waiters': [
+					{'who': waiter['who'], 'priority': waiter['priority'], 'waiting for (s)': now - waiter['since']}
+					for waiter in sorted(self._waiters, key=lambda waiter: (-waiter['priority'], waiter['ticket']))
+				],
+			}
+
+	def contention(self)->dict:
+		"""For each `who` that ever acquired the lock, the number of times,
+		the total and the maximum seconds it waited for it, and the total
+		seconds it held it, including the current holding."""
+		with self._lock:
+			contention = {who: dict(c) for who,c in self._contention.items()}
+			if self._holder is not None:
+				contention[self._holder]['seconds holding'] += time.time() - self._held_since
+			return contention
+
+class _HoldingFairNamedLock:
+	def __init__(self, lock:FairNamedLock, who:str, priority:float):
+		self.lock = lock
+		self.who = who
+		self.priority = priority
+
+	def __enter__(self):
+		self.lock.acquire(self.who, priority=self.priority)
+		return self
+
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		self.lock.release(self.who)
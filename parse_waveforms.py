@@ -4,6 +4,7 @@ import pandas
 from huge_dataframe.SQLiteDataFrame import SQLiteDataFrameDumper, load_whole_dataframe, load_only_index_without_repeated_entries # https://github.com/SengerM/huge_dataframe
 import sqlite3
 from signals.PeakSignal import PeakSignal, draw_in_plotly # https://github.com/SengerM/signals
+from utils import load_digitizer_calibration, convert_waveforms_from_ADCu_to_volts, load_parsed_data, PARSER_VERSION, save_parser_version, load_parser_version
 
 def parse_waveform(signal:PeakSignal):
 	parsed = {
@@ -33,18 +34,24 @@ def parse_waveform(signal:PeakSignal):
 def parse_waveforms(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_waveforms_to_parse:str, continue_from_where_we_left_last_time:bool=True, silent:bool=True):
 	Quique = bureaucrat
 	
+	if (Quique.path_to_directory_of_task(name_of_task_that_produced_the_waveforms_to_parse)/'zero_suppression_rules.pickle').is_file():
+		raise RuntimeError(f'The waveforms in run {repr(Quique.run_name)} were zero suppressed, so only some of them were saved and parsing them again would lose the parsed data of the others. Its parsed data is the one from `{name_of_task_that_produced_the_waveforms_to_parse}`, which was parsed while measuring. ')
+	
+	if load_parser_version(Quique.path_to_directory_of_task('parse_waveforms')) != PARSER_VERSION:
+		continue_from_where_we_left_last_time = False # They were parsed with another version of `parse_waveform`.
+	
 	with Quique.handle_task('parse_waveforms', drop_old_data=not continue_from_where_we_left_last_time) as Quiques_employee:
-		try:
-			index_of_waveforms_already_parsed_in_the_past = set(load_whole_dataframe(Quiques_employee.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite').index)
-		except FileNotFoundError:
+		if (Quiques_employee.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite').is_file():
+			index_of_waveforms_already_parsed_in_the_past = set(load_parsed_data(Quiques_employee.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite', columns=[], compact=False).index)
+		else:
 			index_of_waveforms_already_parsed_in_the_past = set()
 		
 		path_to_waveforms_file = Quiques_employee.path_to_directory_of_task(name_of_task_that_produced_the_waveforms_to_parse)/'waveforms.sqlite'
 		
 		sqlite_connection = sqlite3.connect(path_to_waveforms_file)
+		digitizer_calibration = load_digitizer_calibration(path_to_waveforms_file.parent)
 		
-		number_of_waveforms_to_process = load_only_index_without_repeated_entries(path_to_waveforms_file)['n_waveform'].max()
-		index_of_all_waveforms = set(range(number_of_waveforms_to_process))
+		index_of_all_waveforms = set(load_only_index_without_repeated_entries(path_to_waveforms_file)['n_waveform']) # Not necessarily contiguous, e.g. if zero suppression was used.
 		index_of_waveforms_to_be_parsed = index_of_all_waveforms - index_of_waveforms_already_parsed_in_the_past
 		
 		if not silent:
@@ -58,6 +65,7 @@ def parse_waveforms(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_wav
 					f'SELECT * from dataframe_table where n_waveform=={n_waveform}',
 					sqlite_connection,
 				)
+				waveform_df = convert_waveforms_from_ADCu_to_volts(waveform_df, digitizer_calibration)
 				parsed_from_waveform = parse_waveform(PeakSignal(time=waveform_df['Time (s)'], samples=waveform_df['Amplitude (V)'], peak_polarity='guess'))
 				parsed_from_waveform['n_waveform'] = n_waveform
 				parsed_from_waveform_df = pandas.DataFrame(
@@ -65,6 +73,7 @@ def parse_waveforms(bureaucrat:RunBureaucrat, name_of_task_that_produced_the_wav
 					index = [0],
 				).set_index(['n_waveform'])
 				parsed_data_dumper.append(parsed_from_waveform_df)
+		save_parser_version(Quiques_employee.path_to_directory_of_my_task)
 
 if __name__=='__main__':
 	import argparse
@@ -0,0 +1,250 @@
+import numpy
+
+k_MAD_TO_STD = 1.4826 # https://en.wikipedia.org/wiki/Median_absolute_deviation#Relation_to_standard_deviation
+
+def _sort_by_group(values, group_codes, n_groups:int):
+	"""Drops NaN and sorts `values` by group and then by value. Returns
+	the sorted values, their group codes, the index where each group
+	starts and the number of values in each group."""
+	values = numpy.asarray(values, dtype=float)
+	group_codes = numpy.asarray(group_codes)
+	not_nan = ~numpy.isnan(values)
+	values = values[not_nan]
+	group_codes = group_codes[not_nan]
+	order = numpy.lexsort((values, group_codes))
+	values = values[order]
+	group_codes = group_codes[order]
+	n_per_group = numpy.bincount(group_codes, minlength=n_groups)
+	group_starts = numpy.concatenate([[0], numpy.cumsum(n_per_group)[:-1]])
+	return values, group_codes, group_starts, n_per_group
+
+def _median_of_sorted_groups(values, group_starts, n_per_group):
+	median = numpy.full(len(n_per_group), float('NaN'))
+	has_data = n_per_group > 0
+	lower = group_starts[has_data] + (n_per_group[has_data]-1)//2
+	upper = group_starts[has_data] + n_per_group[has_data]//2
+	median[has_data] = (values[lower] + values[upper])/2
+	return median
+
+def grouped_nanmedian(values, group_codes, n_groups:int):
+	"""Exact median of `values` for each group, ignoring NaN, computed
+	for all the groups at once without a Python loop.
+
+	Arguments
+	---------
+	values: array like of float
+		The values.
+	group_codes: array like of int
+		The group of each value, an integer between 0 and `n_groups`-1,
+		e.g. the output of `pandas.core.groupby.GroupBy.ngroup`.
+	n_groups: int
+		The number of groups.
+
+	Returns
+	-------
+	median: numpy.array
+		An array of length `n_groups` with the median of each group, NaN
+		for groups without values.
+	"""
+	values, _, group_starts, n_per_group = _sort_by_group(values, group_codes, n_groups)
+	return _median_of_sorted_groups(values, group_starts, n_per_group)
+
+def grouped_kMAD(values, group_codes, n_groups:int):
+	"""Exact median absolute deviation multiplied by 1.4826 for each group,
+	ignoring NaN, computed for all the groups at once without a Python
+	loop. Gives the same as `utils.kMAD` applied to each group. For the
+	arguments see `grouped_nanmedian`."""
+	values, group_codes, group_starts, n_per_group = _sort_by_group(values, group_codes, n_groups)
+	median = _median_of_sorted_groups(values, group_starts, n_per_group)
+	absolute_deviations, _, group_starts, n_per_group = _sort_by_group(numpy.abs(values - median[group_codes]), group_codes, n_groups)
+	return k_MAD_TO_STD*_median_of_sorted_groups(absolute_deviations, group_starts, n_per_group)
+
+class KLLSketch:
+	"""A mergeable streaming quantile sketch, following the KLL algorithm
+	(Karnin, Lang, Liberty, "Optimal Quantile Approximation in Streams", 2016).
+
+	It keeps at most about `3*k` values no matter how many are fed, so
+	the median and the kMAD of arbitrarily many values can be estimated
+	with bounded memory, and sketches built in different chunks or processes
+	can be merged with `merge`.
+
+	Error bound: for a quantile `q` the returned value has a rank within
+	`q ± ε` of the true one, with `ε ≈ 3.3/k` with 99 % probability for
+	all the quantiles at once, i.e. about 1.7 % for the default `k=200`,
+	the same as Apache DataSketches' KLL. Running this module checks it
+	against `numpy.quantile`. The kMAD is estimated from
+	the ranks of `|x-median|`, so its rank error is at most about `2ε`.
+	As long as the sketch did not need to compact (fewer than `k` values)
+	all the results are exact.
+	"""
+	def __init__(self, k:int=200, seed:int=None):
+		if not isinstance(k, int) or k < 8:
+			raise ValueError(f'`k` must be an integer >= 8, received {repr(k)}.')
+		self.k = k
+		self._compactors = [numpy.array([], dtype=float)]
+		self._random = numpy.random.default_rng(seed)
+
+	def _capacity(self, level:int)->int:
+		depth = len(self._compactors) - level - 1
+		return max(2, int(numpy.ceil(self.k*(2/3)**depth)))
+
+	def _compress(self):
+		level = 0
+		while level < len(self._compactors):
+			if len(self._compactors[level]) > self._capacity(level):
+				if level+1 == len(self._compactors):
+					self._compactors.append(numpy.array([], dtype=float))
+				items = numpy.sort(self._compactors[level])
+				if len(items)%2 == 1: # Keep one item in this level so the total weight is preserved.
+					self._compactors[level] = items[-1:]
+					items = items[:-1]
+				else:
+					self._compactors[level] = numpy.array([], dtype=float)
+				promoted = items[self._random.integers(2)::2]
+				self._compactors[level+1] = numpy.concatenate([self._compactors[level+1], promoted])
+			level += 1
+
+	def update(self, values):
+		"""Add values to the sketch. NaN values are ignored."""
+		values = numpy.asarray(values, dtype=float).ravel()
+		values = values[~numpy.isnan(values)]
+		self._compactors[0] = numpy.concatenate([self._compactors[0], values])
+		self._compress()
+
+	def copy(self):
+		"""A new `KLLSketch` with the same content, independent of this one."""
+		copy = KLLSketch(k=self.k)
+		copy._compactors = [c.copy() for c in self._compactors]
+		return copy
+	
+	def merge(self, other):
+		"""Merge another `KLLSketch` into this one."""
+		if not isinstance(other, KLLSketch):
+			raise TypeError(f'Can only merge with another {KLLSketch}, received object of type {type(other)}.')
+		for level,items in enumerate(other._compactors):
+			if level == len(self._compactors):
+				self._compactors.append(numpy.array([], dtype=float))
+			self._compactors[level] = numpy.concatenate([self._compactors[level], items])
+		self._compress()
+		return self
+
+	def _weighted_items(self):
+		items = numpy.concatenate(self._compactors)
+		weights = numpy.concatenate([numpy.full(len(c), 2**level) for level,c in enumerate(self._compactors)])
+		order = numpy.argsort(items)
+		return items[order], weights[order]
+
+	@property
+	def count(self)->int:
+		"""Number of values that were fed into the sketch."""
+		return int(sum(len(c)*2**level for level,c in enumerate(self._compactors)))
+
+	def quantile(self, q:float)->float:
+		"""Estimate the quantile `q` (between 0 and 1) of the values."""
+		items, weights = self._weighted_items()
+		if len(items) == 0:
+			return float('NaN')
+		return _weighted_quantile(items, weights, q)
+
+	def median(self)->float:
+		"""Estimate the median of the values."""
+		return self.quantile(.5)
+
+	def kMAD(self)->float:
+		"""Estimate the median absolute deviation multiplied by 1.4826."""
+		items, weights = self._weighted_items()
+		if len(items) == 0:
+			return float('NaN')
+		median = _weighted_quantile(items, weights, .5)
+		absolute_deviations = numpy.abs(items - median)
+		order = numpy.argsort(absolute_deviations)
+		return k_MAD_TO_STD*_weighted_quantile(absolute_deviations[order], weights[order], .5)
+
+def _weighted_quantile(sorted_items, weights, q:float)->float:
+	if (weights == 1).all(): # Nothing was compacted, so this is exact.
+		return float(numpy.quantile(sorted_items, q))
+	cumulative_weights = numpy.cumsum(weights)
+	return float(sorted_items[numpy.searchsorted(cumulative_weights, q*cumulative_weights[-1])])
+
+def sketch_by_group(data, by:list, columns:list, sketches:dict=None, k:int=200)->dict:
+	"""Feed a chunk of data into one `KLLSketch` per group and column,
+	to aggregate data that does not fit in memory, or in parallel: call
+	this once per chunk, and merge the returned dictionaries produced by
+	different processes with `merge_sketches_by_group`.
+
+	Arguments
+	---------
+	data: pandas.DataFrame
+		A chunk of the data.
+	by: list of str
+		Columns or index levels to group by.
+	columns: list of str
+		Columns to sketch.
+	sketches: dict, optional
+		The output of a previous call, to continue feeding it.
+	k: int, default 200
+		See `KLLSketch`.
+
+	Returns
+	-------
+	sketches: dict
+		A dictionary of the form `{(group, column): KLLSketch}` where
+		`group` is the tuple of values of `by` for that group.
+	"""
+	if sketches is None:
+		sketches = {}
+	for group, group_data in data.groupby(by):
+		for col in columns:
+			key = (group, col)
+			if key not in sketches:
+				sketches[key] = KLLSketch(k=k)
+			sketches[key].update(group_data[col].to_numpy())
+	return sketches
+
+def merge_sketches_by_group(*sketches_dicts)->dict:
+	"""Merge several outputs of `sketch_by_group` into a new one, without
+	modifying them."""
+	merged = {}
+	for sketches in sketches_dicts:
+		for key,sketch in sketches.items():
+			if key in merged:
+				merged[key].merge(sketch)
+			else:
+				merged[key] = sketch.copy()
+	return merged
+
+def rank_errors(values, sketch:KLLSketch, quantiles:list)->list:
+	"""The error in rank, between 0 and 1, of the quantiles estimated by
+	`sketch` with respect to the exact ones of `values`, to compare with
+	the error bound of `KLLSketch`."""
+	values = numpy.sort(numpy.asarray(values, dtype=float))
+	return [abs(numpy.searchsorted(values, sketch.quantile(q))/len(values) - q) for q in quantiles]
+
+if __name__ == '__main__':
+	import sys
+	
+	# Check the error bound of `KLLSketch` against `numpy.quantile`, also
+	# when merging sketches built from separate chunks. The exit code is 1
+	# if the bound is not fulfilled.
+	k = 200
+	error_bound = 3.3/k # See `KLLSketch`.
+	quantiles = [.01,.1,.25,.5,.75,.9,.99]
+	rng = numpy.random.default_rng(0)
+	everything_fine = True
+	for name,values in {'normal': rng.normal(size=10**6), 'landau like': rng.gumbel(size=10**6), 'uniform': rng.uniform(size=10**6)}.items():
+		fed = KLLSketch(k=k, seed=1)
+		for chunk in numpy.array_split(values, 100):
+			fed.update(chunk)
+		merged = KLLSketch(k=k, seed=2)
+		for n_chunk,chunk in enumerate(numpy.array_split(values, 10)):
+			sketch = KLLSketch(k=k, seed=3+n_chunk)
+			sketch.update(chunk)
+			merged.merge(sketch)
+		for how,sketch in {'fed in chunks': fed, 'merged': merged}.items():
+			max_rank_error = max(rank_errors(values, sketch, quantiles))
+			exact_median = numpy.quantile(values, .5)
+			exact_kMAD = k_MAD_TO_STD*numpy.quantile(numpy.abs(values - exact_median), .5)
+			passed = max_rank_error <= error_bound
+			everything_fine &= passed
+			print(f'{"OK" if passed else "FAILED":<8}{name}, {how}: max rank error {max_rank_error:.4f} (bound {error_bound:.4f}), median {sketch.median():.4f} vs {exact_median:.4f}, kMAD {sketch.kMAD():.4f} vs {exact_kMAD:.4f}, {sum(len(c) for c in sketch._compactors)} values kept out of {sketch.count}')
+	sys.exit(0 if everything_fine else 1)
@@ -0,0 +1,338 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from pathlib import Path
+import pandas
+import numpy
+import sqlite3
+import json
+import re
+import datetime
+import logging
+import os
+from aggregates_cache import path_to_cache_of
+
+CATALOG_VERSION = 2 # Increase this whenever the content of the catalog changes, so it is rebuilt.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog_info (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS runs (
+	path TEXT PRIMARY KEY,
+	run_name TEXT,
+	parent_path TEXT,
+	parent_task TEXT,
+	root_path TEXT,
+	device TEXT,
+	timestamp TEXT
+);
+CREATE TABLE IF NOT EXISTS tasks (
+	run_path TEXT,
+	task_name TEXT,
+	successful INTEGER,
+	n_files INTEGER,
+	size_bytes INTEGER,
+	n_subruns INTEGER,
+	n_positions INTEGER,
+	n_triggers INTEGER,
+	n_channels INTEGER,
+	bias_voltage_V REAL,
+	step_m REAL,
+	path_to_aggregates TEXT,
+	fingerprint TEXT,
+	directory_mtime_ns INTEGER,
+	PRIMARY KEY (run_path, task_name)
+);
+CREATE INDEX IF NOT EXISTS runs_device ON runs (device);
+CREATE INDEX IF NOT EXISTS runs_root_path ON runs (root_path);
+CREATE INDEX IF NOT EXISTS tasks_task_name ON tasks (task_name);
+CREATE INDEX IF NOT EXISTS tasks_bias_voltage ON tasks (ABS(bias_voltage_V));
+'''
+
+TIMESTAMP_PATTERN = re.compile(r'^(\d{14})_(.+)$')
+SUFFIXES_NOT_IN_DEVICE_NAME = [r'_\d+V', r'_preview', r'_Step\d+um', r'_n_trigs\d+', r'_Flattened1DScan', r'_TCT1DScan', r'_z_scan_to_find_focus']
+
+def _device_from_run_name(run_name:str):
+	"""The runs are named `{timestamp}_{device name}{some suffixes}`, see
+	e.g. the `__main__` of `scan_2D.py`. Returns `None` if `run_name`
+	does not follow this convention."""
+	match = TIMESTAMP_PATTERN.match(run_name)
+	if match is None:
+		return None
+	device = match.group(2)
+	for suffix in SUFFIXES_NOT_IN_DEVICE_NAME:
+		device = re.sub(suffix+r'(?=_|$)', '', device)
+	return device
+
+def _timestamp_from_run_name(run_name:str):
+	match = TIMESTAMP_PATTERN.match(run_name)
+	if match is None:
+		return None
+	return datetime.datetime.strptime(match.group(1), '%Y%m%d%H%M%S').isoformat()
+
+NOT_IN_FINGERPRINT = {'aggregates_cache'} # Written when the data was read, not when it changed, by older versions of `aggregates_cache`.
+
+def _subdirectories(path:Path)->list:
+	"""Sorted subdirectories of `path`, without the hidden ones. Uses
+	`os.scandir`, which knows which entries are directories without
+	calling `stat` on each of them."""
+	with os.scandir(path) as entries:
+		return sorted(Path(entry.path) for entry in entries if entry.is_dir() and not entry.name.startswith('.'))
+
+def walk_runs(path_to_run:Path, parent_path:Path=None, parent_task:str=None):
+	"""Yields `(path_to_run, parent_path, parent_task)` for the run and
+	all its subruns, following the layout `{run}/{task}/subruns/{subrun}`."""
+	yield path_to_run, parent_path, parent_task
+	for path_to_task in _subdirectories(path_to_run):
+		if (path_to_task/'subruns').is_dir():
+			for path_to_subrun in _subdirectories(path_to_task/'subruns'):
+				yield from walk_runs(path_to_subrun, path_to_run, path_to_task.name)
+
+def _directory_mtime_ns(path_to_task:Path)->int:
+	"""Changes whenever something is added to or removed from the task
+	directory or its subruns directory, e.g. a new file, a new subrun or
+	the journal that SQLite creates on each write. If it did not change,
+	the task did not change either and `_task_fingerprint` is not needed."""
+	mtime_ns = path_to_task.stat().st_mtime_ns
+	if (path_to_task/'subruns').is_dir():
+		mtime_ns = max(mtime_ns, (path_to_task/'subruns').stat().st_mtime_ns)
+	return mtime_ns
+
+def _task_fingerprint(path_to_task:Path)->str:
+	"""Changes whenever files are added to or removed from the task directory
+	or any file directly in it is modified. Does not look into subruns, they
+	have their own fingerprints, nor into `NOT_IN_FINGERPRINT`."""
+	files = [_ for _ in path_to_task.iterdir() if _.is_file()]
+	stats = [_.stat() for _ in files]
+	names = sorted(_.name for _ in path_to_task.iterdir() if _.name not in NOT_IN_FINGERPRINT)
+	subruns = sorted(_.name for _ in (path_to_task/'subruns').iterdir()) if (path_to_task/'subruns').is_dir() else []
+	return json.dumps([CATALOG_VERSION, names, sum(_.st_size for _ in stats), max([_.st_mtime_ns for _ in stats], default=0), subruns])
+
+def task_was_successful(bureaucrat:RunBureaucrat, task_name:str)->bool:
+	"""Same as `bureaucrat.check_these_tasks_were_run_successfully(task_name)`
+	but returns `True` or `False` instead of raising."""
+	try:
+		bureaucrat.check_these_tasks_were_run_successfully(task_name)
+	except Exception:
+		return False
+	return True
+
+def _TCT_1D_scan_metadata(path_to_TCT_1D_scan:Path)->dict:
+	metadata = {}
+	if (path_to_TCT_1D_scan/'measured_data.sqlite').is_file():
+		with sqlite3.connect(path_to_TCT_1D_scan/'measured_data.sqlite') as connection:
+			measured_data = pandas.read_sql('SELECT * FROM dataframe_table', connection)
+		metadata['n_positions'] = int(measured_data['n_position'].nunique())
+		if 'Bias voltage (V)' in measured_data.columns:
+			metadata['bias_voltage_V'] = float(measured_data['Bias voltage (V)'].median())
+		if len(measured_data) > 1:
+			steps = numpy.linalg.norm(numpy.diff(measured_data[['x (m)','y (m)','z (m)']].to_numpy(), axis=0), axis=1)
+			steps = steps[steps > 0]
+			metadata['step_m'] = float(numpy.median(steps)) if len(steps) > 0 else None
+	for path in [path_to_TCT_1D_scan/'aggregated_per_position.sqlite', path_to_TCT_1D_scan/'parsed_from_waveforms.parquet', path_to_cache_of(path_to_TCT_1D_scan)]:
+		if path.exists():
+			metadata['path_to_aggregates'] = str(path)
+			break
+	if (path_to_TCT_1D_scan/'aggregated_per_position.sqlite').is_file():
+		with sqlite3.connect(path_to_TCT_1D_scan/'aggregated_per_position.sqlite') as connection:
+			columns = pandas.read_sql('SELECT * FROM dataframe_table LIMIT 1', connection).columns
+			count_column = [_ for _ in columns if _.endswith(' count')][0]
+			n_triggers, n_channels = connection.execute(f'SELECT MAX(`{count_column}`), COUNT(DISTINCT n_channel) FROM dataframe_table').fetchone()
+	elif (path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite').is_file():
+		with sqlite3.connect(path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite') as connection:
+			n_triggers, n_channels = connection.execute('SELECT MAX(n_trigger)+1, COUNT(DISTINCT n_channel) FROM dataframe_table').fetchone()
+	else:
+		n_triggers, n_channels = None, None
+	metadata['n_triggers'] = int(n_triggers) if n_triggers is not None else None
+	metadata['n_channels'] = int(n_channels) if n_channels is not None else None
+	return metadata
+
+def _task_metadata(path_to_task:Path)->dict:
+	"""Metadata of a task. For a `TCT_1D_scan` it is read from its files,
+	for tasks with a single subrun with a `TCT_1D_scan`, e.g. `TCT_2D_scan`,
+	it is read from there."""
+	files = [_ for _ in path_to_task.iterdir() if _.is_file()]
+	subruns = [_ for _ in (path_to_task/'subruns').iterdir() if _.is_dir()] if (path_to_task/'subruns').is_dir() else []
+	metadata = {
+		'n_files': len(files),
+		'size_bytes': sum(_.stat().st_size for _ in files),
+		'n_subruns': len(subruns),
+	}
+	if (path_to_task/'measured_data.sqlite').is_file():
+		metadata.update(_TCT_1D_scan_metadata(path_to_task))
+	elif len(subruns) == 1 and (subruns[0]/'TCT_1D_scan').is_dir():
+		metadata.update(_TCT_1D_scan_metadata(subruns[0]/'TCT_1D_scan'))
+	return metadata
+
+def update_catalog(path_to_catalog:Path, path_to_run:Path):
+	"""Index a run and all its subruns and tasks into the catalog, creating
+	it if it does not exist. Only the tasks that changed since the last
+	update are read again, see `_task_fingerprint`, and the runs and tasks
+	that no longer exist are removed from the catalog. The files of a task
+	are looked at only if its directory changed, see `_directory_mtime_ns`,
+	so for the tasks that did not change only their directories are stat'ed.
+
+	Arguments
+	---------
+	path_to_catalog: Path
+		Path to the `.sqlite` file with the catalog.
+	path_to_run: Path
+		Path to the run, i.e. the directory given to `RunBureaucrat`.
+	"""
+	path_to_run = Path(path_to_run).resolve()
+	with sqlite3.connect(path_to_catalog) as connection:
+		version = connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='catalog_info'").fetchone()
+		if version is not None:
+			version = connection.execute("SELECT value FROM catalog_info WHERE key='CATALOG_VERSION'").fetchone()
+		if version is None or int(version[0]) != CATALOG_VERSION:
+			logging.info(f'Creating catalog in {path_to_catalog}...')
+			for table in ['catalog_info','runs','tasks']:
+				connection.execute(f'DROP TABLE IF EXISTS {table}')
+		connection.executescript(SCHEMA)
+		connection.execute("INSERT OR REPLACE INTO catalog_info VALUES ('CATALOG_VERSION', ?)", (str(CATALOG_VERSION),))
+
+		fingerprints = {}
+		directory_mtimes = {}
+		for key, fingerprint, directory_mtime_ns in connection.execute("SELECT run_path || '/' || task_name, fingerprint, directory_mtime_ns FROM tasks WHERE run_path IN (SELECT path FROM runs WHERE root_path = ?)", (str(path_to_run),)).fetchall():
+			fingerprints[key] = fingerprint
+			directory_mtimes[key] = directory_mtime_ns
+		devices = {}
+		existing_runs = set()
+		existing_tasks = set()
+		n_updated = 0
+		for path, parent_path, parent_task in walk_runs(path_to_run):
+			existing_runs.add(str(path))
+			device = _device_from_run_name(path.name) or devices.get(parent_path)
+			devices[path] = device
+			connection.execute(
+				'INSERT OR REPLACE INTO runs VALUES (?,?,?,?,?,?,?)',
+				(str(path), path.name, str(parent_path) if parent_path is not None else None, parent_task, str(path_to_run), device, _timestamp_from_run_name(path.name)),
+			)
+			bureaucrat = None
+			for path_to_task in _subdirectories(path):
+				key = f'{path}/{path_to_task.name}'
+				existing_tasks.add(key)
+				directory_mtime_ns = _directory_mtime_ns(path_to_task)
+				if directory_mtimes.get(key) == directory_mtime_ns:
+					continue
+				fingerprint = _task_fingerprint(path_to_task)
+				if fingerprints.get(key) == fingerprint: # E.g. only `NOT_IN_FINGERPRINT` was added.
+					connection.execute('UPDATE tasks SET directory_mtime_ns = ? WHERE run_path = ? AND task_name = ?', (directory_mtime_ns, str(path), path_to_task.name))
+					continue
+				bureaucrat = bureaucrat or RunBureaucrat(path)
+				metadata = _task_metadata(path_to_task)
+				connection.execute(
+					'INSERT OR REPLACE INTO tasks VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?)',
+					(
+						str(path),
+						path_to_task.name,
+						task_was_successful(bureaucrat, path_to_task.name),
+						metadata['n_files'],
+						metadata['size_bytes'],
+						metadata['n_subruns'],
+						metadata.get('n_positions'),
+						metadata.get('n_triggers'),
+						metadata.get('n_channels'),
+						metadata.get('bias_voltage_V'),
+						metadata.get('step_m'),
+						metadata.get('path_to_aggregates'),
+						fingerprint,
+						directory_mtime_ns,
+					),
+				)
+				n_updated += 1
+
+		for path, in connection.execute('SELECT path FROM runs WHERE root_path = ?', (str(path_to_run),)).fetchall():
+			if path not in existing_runs:
+				connection.execute('DELETE FROM runs WHERE path = ?', (path,))
+				connection.execute('DELETE FROM tasks WHERE run_path = ?', (path,))
+		for key in set(fingerprints) - existing_tasks:
+			run_path, task_name = key.rsplit('/', 1)
+			connection.execute('DELETE FROM tasks WHERE run_path = ? AND task_name = ?', (run_path, task_name))
+	logging.info(f'Catalog updated, {len(existing_runs)} runs found, {n_updated} tasks had changed.')
+
+def find_tasks(path_to_catalog:Path, task_name:str=None, device:str=None, bias_voltage:float=None, voltage_tolerance:float=1, successful:bool=None, parent_task:str=None)->pandas.DataFrame:
+	"""Find tasks in the catalog, without touching the runs.
+
+	Arguments
+	---------
+	path_to_catalog: Path
+		Path to the `.sqlite` file with the catalog.
+	task_name: str, optional
+		E.g. `'TCT_1D_scan'` or `'TCT_2D_scan'`.
+	device: str, optional
+		Name of the device, as in the run names. `*` can be used as wildcard.
+	bias_voltage: float, optional
+		Bias voltage, in volts. Tasks with a bias voltage within `voltage_tolerance`
+		of this value are returned. Only the magnitude is compared, e.g.
+		`200` finds the tasks measured at -200 V, because the sign depends
+		on how the device was connected. `bias_voltage_V` is returned with
+		the sign it was measured with.
+	successful: bool, optional
+		If given, return only the tasks that were (or were not) run successfully.
+	parent_task: str, optional
+		Return only tasks of runs that are subruns of this task, e.g.
+		`'TCT_2D_scans_sweeping_bias_voltage'`.
+
+	Returns
+	-------
+	tasks: pandas.DataFrame
+		One row per task, with the information of the task and its run.
+	"""
+	conditions = []
+	parameters = []
+	if task_name is not None:
+		conditions.append('tasks.task_name = ?')
+		parameters.append(task_name)
+	if device is not None:
+		conditions.append('runs.device GLOB ?')
+		parameters.append(device)
+	if bias_voltage is not None:
+		conditions.append('ABS(tasks.bias_voltage_V) BETWEEN ? AND ?')
+		parameters += [abs(bias_voltage)-voltage_tolerance, abs(bias_voltage)+voltage_tolerance]
+	if successful is not None:
+		conditions.append('tasks.successful = ?')
+		parameters.append(int(successful))
+	if parent_task is not None:
+		conditions.append('runs.parent_task = ?')
+		parameters.append(parent_task)
+	with sqlite3.connect(path_to_catalog) as connection:
+		return pandas.read_sql(
+			sql = 'SELECT * FROM tasks JOIN runs ON tasks.run_path = runs.path' + (' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else '') + ' ORDER BY runs.timestamp, tasks.run_path',
+			con = connection,
+			params = parameters,
+		)
+
+if __name__ == '__main__':
+	import argparse
+	import sys
+
+	logging.basicConfig(
+		stream = sys.stderr,
+		level = logging.INFO,
+		format = '%(asctime)s|%(levelname)s|%(funcName)s|%(message)s',
+		datefmt = '%Y-%m-%d %H:%M:%S',
+	)
+
+	parser = argparse.ArgumentParser(description='Index runs into a catalog and query it.')
+	parser.add_argument('--catalog',
+		metavar = 'path',
+		help = 'Path to the catalog file.',
+		required = True,
+		dest = 'catalog',
+		type = str,
+	)
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to a base measurement directory to index or update in the catalog.',
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument('--task', help='Show only this task, e.g. TCT_2D_scan.', dest='task_name', type=str)
+	parser.add_argument('--device', help='Show only this device, * can be used as wildcard.', dest='device', type=str)
+	parser.add_argument('--voltage', help='Show only this bias voltage.', dest='bias_voltage', type=float)
+
+	args = parser.parse_args()
+	if args.directory is not None:
+		update_catalog(Path(args.catalog), Path(args.directory))
+	if any(_ is not None for _ in [args.task_name, args.device, args.bias_voltage]):
+		tasks = find_tasks(Path(args.catalog), task_name=args.task_name, device=args.device, bias_voltage=args.bias_voltage)
+		with pandas.option_context('display.max_rows', None, 'display.width', None, 'display.max_colwidth', None):
+			print(tasks[['path','task_name','device','bias_voltage_V','step_m','n_triggers','successful']])
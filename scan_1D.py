@@ -3,20 +3,62 @@ from pathlib import Path
 from time import sleep
 import pandas
 import datetime
-from huge_dataframe.SQLiteDataFrame import SQLiteDataFrameDumper, load_whole_dataframe, load_only_index_without_repeated_entries # https://github.com/SengerM/huge_dataframe
+from huge_dataframe.SQLiteDataFrame import SQLiteDataFrameDumper, load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 from contextlib import nullcontext
 from progressreporting.TelegramProgressReporter import SafeTelegramReporter4Loops # https://github.com/SengerM/progressreporting
 import threading
 from parse_waveforms import parse_waveform
 import plotly.express as px
 from utils import integrate_distance_given_path, kMAD, interlace, compress_waveforms_sqlite
+import utils
+from live_monitor import LiveStreamPublisher, LIVE_STREAM_FILE_NAME
+from disk_space_guard import DiskSpaceGuard
 from plotly_utils import line
 import numpy as np
 from signals.PeakSignal import PeakSignal, draw_in_plotly # https://github.com/SengerM/signals
 import sqlite3
 import logging
 
-def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:SafeTelegramReporter4Loops=None, save_waveforms:bool=True):
+DEFAULT_ZERO_SUPPRESSION_RULES = {
+	'N_NOISE': 5, # Waveforms with `Amplitude (V)` < N_NOISE*`Noise (V)` are not saved, only their parsed data.
+	'WINDOW_BEFORE_PEAK (s)': 2e-9, # Save this time before `Peak start time (s)`...
+	'WINDOW_AFTER_PEAK (s)': 8e-9, # ...and this time after it.
+	'BASELINE_SEGMENT (s)': 5e-9, # Always save this time at the beginning of the waveform, to keep the baseline.
+}
+
+def zero_suppress_waveform(waveform:pandas.DataFrame, time, parsed_from_waveform:dict, rules:dict):
+	"""Apply zero suppression to a waveform.
+	
+	Arguments
+	---------
+	waveform: pandas.DataFrame
+		The waveform as it would be stored in `waveforms.sqlite`, one row
+		per sample.
+	time: array like
+		The time of each sample in `waveform`, in seconds.
+	parsed_from_waveform: dict
+		The output of `parse_waveform` for this waveform.
+	rules: dict
+		The zero suppression rules, see `DEFAULT_ZERO_SUPPRESSION_RULES`.
+	
+	Returns
+	-------
+	waveform: pandas.DataFrame or None
+		`None` if the waveform is below threshold and must not be saved,
+		otherwise only the rows of `waveform` within the baseline segment
+		and the window around the peak.
+	"""
+	amplitude = parsed_from_waveform['Amplitude (V)']
+	noise = parsed_from_waveform['Noise (V)']
+	peak_start_time = parsed_from_waveform['Peak start time (s)']
+	if not amplitude > rules['N_NOISE']*noise or np.isnan(peak_start_time): # Written like this so that NaN is suppressed.
+		return None
+	time = np.asarray(time)
+	keep_these = time < time[0] + rules['BASELINE_SEGMENT (s)']
+	keep_these |= (time >= peak_start_time - rules['WINDOW_BEFORE_PEAK (s)']) & (time <= peak_start_time + rules['WINDOW_AFTER_PEAK (s)'])
+	return waveform.loc[keep_these]
+
+def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:SafeTelegramReporter4Loops=None, save_waveforms:bool=True, waveforms_in_ADCu:bool=False, zero_suppression:dict=None, export_to_parquet:bool=False, disk_space_guard:DiskSpaceGuard=None):
 	"""Perform a 1D scan with the TCT setup.
 	
 	Arguments
@@ -34,12 +76,47 @@ def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 		Number of triggers to record at each position.
 	reporter: SafeTelegramReporter4Loops
 		A reporter to report the progress of the script. Optional.
+	save_waveforms: bool, default True
+		If `True` the waveforms are stored in `waveforms.sqlite`, otherwise
+		only the parsed data is stored.
+	waveforms_in_ADCu: bool, default False
+		If `True` the waveforms are acquired and stored as raw ADC counts
+		(`int16`) with columns `n_channel`, `n_sample` and `Amplitude (ADCu)`
+		instead of `Time (s)` and `Amplitude (V)`. The calibration to
+		convert them into volts is stored once in `digitizer_calibration.pickle`,
+		see `utils.convert_waveforms_from_ADCu_to_volts`. Only for the
+		CAEN digitizer.
+	zero_suppression: dict, optional
+		If given, waveforms are zero suppressed before being saved according
+		to these rules, see `DEFAULT_ZERO_SUPPRESSION_RULES` and `zero_suppress_waveform`.
+		All waveforms are parsed anyway, and the column `Waveform saved`
+		in `parsed_from_waveforms.sqlite` tells which ones were saved.
+		The rules are stored in `zero_suppression_rules.pickle`. If `None`,
+		every sample of every waveform is saved.
+	
+	export_to_parquet: bool, default False
+		If `True`, the parsed and measured data are also exported into
+		Parquet at the end of the scan, see `columnar_export.export_TCT_1D_scan_to_parquet`.
+		This requires `pyarrow`.
+	disk_space_guard: DiskSpaceGuard, optional
+		Watches the free disk space before each position, see `DiskSpaceGuard`.
+		If the disk is getting full the waveforms stop being saved and,
+		if it is full, the scan pauses until there is space again. If
+		`None`, one with the default thresholds is used.
+	
+	Besides the parsed data, summary statistics for each `n_position`,
+	`n_channel` and `n_pulse` are stored in `aggregated_per_position.sqlite`
+	as each position is finished, see `utils.aggregate_parsed_data`.
+	Some of them are also published into `live_stream.jsonl`, which can
+	be followed while the scan is running with `live_monitor.py`.
 	"""
 	Raúl = bureaucrat
 	
 	Raúl.create_run(if_exists='skip')
 	
 	with Raúl.handle_task('TCT_1D_scan') as Raúls_employee:
+		if disk_space_guard is None:
+			disk_space_guard = DiskSpaceGuard(Raúls_employee.path_to_directory_of_my_task, reporter=reporter)
 		logging.info(f'Waiting to acquire exclusive control of the hardware...')
 		with the_setup.hold_control_of_bias(), the_setup.hold_signal_acquisition(), the_setup.hold_tct_control():
 			logging.info(f'Control of hardware acquired!')
@@ -47,14 +124,33 @@ def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 			the_setup.configure_oscilloscope_sequence_acquisition(n_sequences_per_trigger = int(n_triggers_per_position))
 			the_setup.set_laser_status(status='on') # Make sure the laser is on...
 			path_to_waveforms_file = Raúls_employee.path_to_directory_of_my_task/'waveforms.sqlite'
+			if zero_suppression is not None and save_waveforms:
+				zero_suppression = {**DEFAULT_ZERO_SUPPRESSION_RULES, **zero_suppression}
+				utils.save_dataframe(pandas.DataFrame(zero_suppression, index=[0]), 'zero_suppression_rules', Raúls_employee.path_to_directory_of_my_task)
+			utils.save_parser_version(Raúls_employee.path_to_directory_of_my_task)
+			if waveforms_in_ADCu:
+				digitizer_calibration = pandas.DataFrame.from_dict(the_setup.get_digitizer_calibration(), orient='index')
+				digitizer_calibration.index.name = 'n_channel'
+				the_setup.check_digitizer_calibration() # Only warns.
+				the_setup.wait_for_trigger() # To get the time axis of each channel, before any waveform is saved.
+				for n_channel in acquire_channels:
+					time_axis = the_setup.get_waveform(n_channel=n_channel, in_ADCu=True)[0]['Time (s)']
+					digitizer_calibration.loc[n_channel,'t_0 (s)'] = time_axis[0]
+					digitizer_calibration.loc[n_channel,'Sampling period (s)'] = np.median(np.diff(time_axis))
+				utils.save_dataframe(digitizer_calibration, 'digitizer_calibration', Raúls_employee.path_to_directory_of_my_task)
 			with \
 				reporter.report_loop(len(positions), Raúl.run_name) if reporter is not None else nullcontext() as reporter, \
 				SQLiteDataFrameDumper(Raúls_employee.path_to_directory_of_my_task/Path('parsed_from_waveforms.sqlite'), dump_after_n_appends = 7777, dump_after_seconds = 60) as parsed_data_dumper, \
 				SQLiteDataFrameDumper(Raúls_employee.path_to_directory_of_my_task/Path('measured_data.sqlite'), dump_after_n_appends = 1111, dump_after_seconds = 60) as measured_data_dumper, \
-				SQLiteDataFrameDumper(path_to_waveforms_file, dump_after_n_appends = 1111, dump_after_seconds = 60) if save_waveforms else nullcontext() as waveforms_dumper \
+				SQLiteDataFrameDumper(Raúls_employee.path_to_directory_of_my_task/Path('aggregated_per_position.sqlite'), dump_after_n_appends = 111, dump_after_seconds = 60) as aggregated_data_dumper, \
+				SQLiteDataFrameDumper(path_to_waveforms_file, dump_after_n_appends = 1111, dump_after_seconds = 60) if save_waveforms else nullcontext() as waveforms_dumper, \
+				LiveStreamPublisher(Raúls_employee.path_to_directory_of_my_task/LIVE_STREAM_FILE_NAME) as live_stream \
 			:
 				n_waveform = 0
 				for n_position, target_position in enumerate(positions):
+					if not disk_space_guard.protect() and save_waveforms:
+						save_waveforms = False # Only for the rest of this scan, the waveforms already saved are kept.
+					
 					the_setup.move_to(**{xyz: n for xyz,n in zip(['x','y','z'],target_position)})
 					sleep(0.5) # Wait for any transient after moving the motors.
 
@@ -79,23 +175,38 @@ def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 					extra_data.set_index('n_position', inplace=True)
 					measured_data_dumper.append(extra_data)
 					
+					parsed_data_this_position = []
 					for n_channel in acquire_channels:
-						data_from_oscilloscope = the_setup.get_waveform(n_channel=n_channel)
+						data_from_oscilloscope = the_setup.get_waveform(n_channel=n_channel, in_ADCu=waveforms_in_ADCu)
 						for n_trigger,raw_data in enumerate(data_from_oscilloscope):
+							if waveforms_in_ADCu:
+								raw_data = {
+									'Time (s)': raw_data['Time (s)'],
+									'Amplitude (V)': raw_data['Amplitude (ADCu)']*digitizer_calibration.loc[n_channel,'Gain (V/ADCu)'] + digitizer_calibration.loc[n_channel,'Offset (V)'],
+									'Amplitude (ADCu)': raw_data['Amplitude (ADCu)'],
+									'n_sample': np.arange(len(raw_data['Amplitude (ADCu)']), dtype=np.int16),
+								}
 							raw_data_each_pulse = {}
 							for n_pulse in [1,2]:
 								raw_data_each_pulse[n_pulse] = {}
-								for variable in ['Time (s)','Amplitude (V)']:
+								for variable in raw_data:
 									if n_pulse == 1:
 										raw_data_each_pulse[n_pulse][variable] = raw_data[variable][:int(len(raw_data[variable])/2)]
 									if n_pulse == 2:
 										raw_data_each_pulse[n_pulse][variable] = raw_data[variable][int(len(raw_data[variable])/2):]
 								
-								waveform = pandas.DataFrame(raw_data_each_pulse[n_pulse])
+								if waveforms_in_ADCu:
+									waveform = pandas.DataFrame(
+										{
+											'n_channel': np.int8(n_channel),
+											'n_sample': raw_data_each_pulse[n_pulse]['n_sample'],
+											'Amplitude (ADCu)': raw_data_each_pulse[n_pulse]['Amplitude (ADCu)'],
+										}
+									)
+								else:
+									waveform = pandas.DataFrame({variable: raw_data_each_pulse[n_pulse][variable] for variable in ['Time (s)','Amplitude (V)']})
 								waveform['n_waveform'] = n_waveform
 								waveform.set_index('n_waveform', inplace=True)
-								if save_waveforms:
-									waveforms_dumper.append(waveform)
 								
 								parsed_from_waveform = parse_waveform(
 									PeakSignal(
@@ -104,6 +215,17 @@ def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 										peak_polarity = 'guess',
 									)
 								)
+								
+								if save_waveforms and zero_suppression is not None:
+									waveform = zero_suppress_waveform(
+										waveform = waveform,
+										time = raw_data_each_pulse[n_pulse]['Time (s)'],
+										parsed_from_waveform = parsed_from_waveform,
+										rules = zero_suppression,
+									)
+								if save_waveforms and waveform is not None:
+									waveforms_dumper.append(waveform)
+								parsed_from_waveform['Waveform saved'] = save_waveforms and waveform is not None
 								parsed_from_waveform['n_waveform'] = n_waveform
 								parsed_from_waveform['n_position'] = n_position
 								parsed_from_waveform['n_trigger'] = n_trigger
@@ -118,36 +240,123 @@ def TCT_1D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 									inplace = True,
 								)
 								parsed_data_dumper.append(parsed_from_waveform)
+								parsed_data_this_position.append(parsed_from_waveform)
 								
 								n_waveform += 1
+					aggregated_data_this_position = utils.aggregate_parsed_data(pandas.concat(parsed_data_this_position))
+					aggregated_data_dumper.append(aggregated_data_this_position)
+					live_stream.publish(extra_data, aggregated_data_this_position)
 					reporter.update(1) if reporter is not None else None
 		logging.info(f'Finished measuring!')
 		
+		if export_to_parquet:
+			from columnar_export import export_TCT_1D_scan_to_parquet # Only needed here, so `pyarrow` is not required otherwise.
+			logging.info(f'Exporting data into Parquet...')
+			export_TCT_1D_scan_to_parquet(Raúl)
+		
 		logging.info(f'Producing some plots of some of the waveforms...')
-		if save_waveforms:
-			plot_some_random_waveforms(Raúls_employee, n_waveform, 20)
+		if path_to_waveforms_file.is_file(): # Not `save_waveforms`, it may have been switched off by `disk_space_guard` along the way.
+			plot_some_random_waveforms(Raúls_employee, 20)
 
-def plot_some_random_waveforms(bureaucrat:TaskBureaucrat, total_number_of_waveforms:int, number_of_triggers_to_plot:int=20):
+def evenly_spaced_positions(positions:list, n_positions:int=5)->list:
+	"""`n_positions` of `positions` evenly spaced along the list, to probe
+	a 1D scan with `find_active_channels`."""
+	return [positions[i] for i in sorted(set(np.linspace(0, len(positions)-1, n_positions).astype(int)))]
+
+def find_active_channels(the_setup, probe_positions:list, candidate_channels:list=None, n_triggers_per_position:int=5, SNR_threshold:float=5, save_probe_results_here:Path=None)->list:
+	"""Quickly probe a few positions and find which channels have real
+	signals, so the scan does not spend time reading, parsing and storing
+	channels that see only noise. The caller must already hold the control
+	of the signal acquisition and the TCT. Each channel only sees signal
+	where the laser hits its pad, so `probe_positions` must hit all the
+	pads, see e.g. `evenly_spaced_positions` or `scan_2D.probe_grid`.
+	
+	Arguments
+	---------
+	the_setup:
+		An object to control the hardware.
+	probe_positions: list of tuples
+		The positions to probe.
+	candidate_channels: list of int, optional
+		Channels to consider. Default is all the 16 channels of the digitizer.
+	n_triggers_per_position: int, default 5
+		Number of triggers to acquire at each probed position.
+	SNR_threshold: float, default 5
+		A channel is considered active if the median SNR of either of the
+		two pulses is above this value in at least one of the probed positions.
+	save_probe_results_here: Path, optional
+		If given, the data from the probe is stored in this directory as
+		`active_channels_probe.pickle` and `.csv`.
+	
+	Returns
+	-------
+	active_channels: list of int
+		The channels that have signal in any of the probed positions, sorted.
+	"""
+	if candidate_channels is None:
+		candidate_channels = list(range(16))
+	
+	the_setup.configure_oscilloscope_for_two_pulses()
+	the_setup.configure_oscilloscope_sequence_acquisition(n_sequences_per_trigger = int(n_triggers_per_position))
+	the_setup.set_laser_status(status='on')
+	probe_results = []
+	for n_probe, position in enumerate(probe_positions):
+		logging.info(f'Probing channels at position {n_probe}/{len(probe_positions)-1}...')
+		the_setup.move_to(**{xyz: n for xyz,n in zip(['x','y','z'],position)})
+		sleep(0.5) # Wait for any transient after moving the motors.
+		the_setup.wait_for_trigger()
+		for n_channel in candidate_channels:
+			for n_trigger,raw_data in enumerate(the_setup.get_waveform(n_channel=n_channel)):
+				for n_pulse in [1,2]: # Same split as in `TCT_1D_scan`.
+					half = slice(None, int(len(raw_data['Time (s)'])/2)) if n_pulse == 1 else slice(int(len(raw_data['Time (s)'])/2), None)
+					try:
+						SNR = PeakSignal(time=raw_data['Time (s)'][half], samples=raw_data['Amplitude (V)'][half], peak_polarity='guess').SNR
+					except Exception:
+						SNR = float('NaN')
+					probe_results.append({'n_probe': n_probe, 'n_channel': n_channel, 'n_trigger': n_trigger, 'n_pulse': n_pulse, 'SNR': SNR})
+	probe_results = pandas.DataFrame.from_records(probe_results).set_index(['n_probe','n_channel','n_trigger','n_pulse'])
+	
+	median_SNR = probe_results['SNR'].groupby(['n_probe','n_channel','n_pulse']).median()
+	active_channels = sorted(median_SNR[median_SNR > SNR_threshold].reset_index('n_channel')['n_channel'].drop_duplicates())
+	
+	if save_probe_results_here is not None:
+		utils.save_dataframe(probe_results, 'active_channels_probe', save_probe_results_here)
+	logging.info(f'Active channels found: {active_channels}')
+	if len(active_channels) == 0:
+		raise RuntimeError(f'No active channels were found among {candidate_channels} with SNR > {SNR_threshold}, is the laser on and pointing to the device?')
+	return [int(n_channel) for n_channel in active_channels]
+
+def plot_some_random_waveforms(bureaucrat:TaskBureaucrat, number_of_triggers_to_plot:int=20):
+	"""Plot all the waveforms from some randomly chosen triggers. The
+	waveforms are fetched all at once with `utils.load_waveforms`, so
+	this also works after the waveforms file was compressed."""
 	if not isinstance(bureaucrat, TaskBureaucrat):
 		raise TypeError(f'`bureaucrat` must be an instance of {repr(TaskBureaucrat)}, received object of type {type(bureaucrat)}. ')
-	random_n_waveforms = set(np.random.randint(0, total_number_of_waveforms, number_of_triggers_to_plot))
-	indices = load_only_index_without_repeated_entries(bureaucrat.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite')
-	_ = indices.query(f'n_waveform in {repr(list(random_n_waveforms))}')[['n_position','n_trigger']].sort_values(['n_position','n_trigger'])
-	for df in [_,indices]:
-		df.set_index(['n_position','n_trigger'], inplace=True)
-	waveforms_to_plot = indices.loc[_.index].set_index(['n_channel','n_pulse'], append=True)
+	with sqlite3.connect(bureaucrat.path_to_directory_of_my_task/'parsed_from_waveforms.sqlite') as connection:
+		if 'Waveform saved' in pandas.read_sql('SELECT * FROM dataframe_table LIMIT 1', connection).columns: # Zero suppression was used, so not all the waveforms are in the waveforms file.
+			where = 'WHERE `Waveform saved`'
+		else:
+			where = ''
+		random_triggers = pandas.read_sql(f'SELECT DISTINCT n_position, n_trigger FROM dataframe_table {where} ORDER BY RANDOM() LIMIT {int(number_of_triggers_to_plot)}', connection)
+		if len(random_triggers) == 0:
+			logging.info(f'No waveforms were saved in {bureaucrat.pseudopath}, nothing to plot.')
+			return
+		waveforms_to_plot = pandas.read_sql(
+			sql = f'SELECT DISTINCT n_waveform, n_position, n_trigger, n_channel, n_pulse FROM dataframe_table WHERE (n_position, n_trigger) IN (VALUES {",".join(["(?,?)"]*len(random_triggers))})' + (' AND `Waveform saved`' if where != '' else ''),
+			con = connection,
+			params = [int(_) for _ in random_triggers[['n_position','n_trigger']].to_numpy().ravel()],
+		)
+	waveforms_to_plot = waveforms_to_plot.sort_values(['n_position','n_trigger','n_channel','n_pulse']).set_index(['n_position','n_trigger','n_channel','n_pulse'])
 	
-	waveforms_sqlite_connection = sqlite3.connect(bureaucrat.path_to_directory_of_my_task/'waveforms.sqlite')
+	waveforms = utils.load_waveforms(bureaucrat.path_to_directory_of_my_task, waveforms_to_plot['n_waveform'])
 	
 	path_to_plots_dir = bureaucrat.path_to_directory_of_my_task/'plots_of_some_waveforms'
 	path_to_plots_dir.mkdir(exist_ok = True)
 	for idx, row in waveforms_to_plot.iterrows():
 		n_waveform = row['n_waveform']
-		waveform = pandas.read_sql(
-			sql = f"SELECT * from dataframe_table WHERE n_waveform IS {n_waveform}",
-			con = waveforms_sqlite_connection,
-			index_col = 'n_waveform',
-		)
+		if n_waveform not in waveforms.index:
+			continue
+		waveform = waveforms.loc[[n_waveform]]
 		fig = draw_in_plotly(PeakSignal(time=waveform['Time (s)'], samples=waveform['Amplitude (V)'], peak_polarity='guess'))
 		title_stuff = ", ".join([f"{var}={val}" for var,val in zip(waveforms_to_plot.index.names, idx)])
 		fig.update_layout(
@@ -185,25 +394,23 @@ def plot_parsed_data_from_TCT_1D_scan(bureaucrat:RunBureaucrat, draw_main_plots:
 		Néstor.check_these_tasks_were_run_successfully(['TCT_1D_scan'])
 	
 	with Néstor.handle_task('plot_parsed_data_from_TCT_1D_scan') as Néstors_employee:
-		parsed_data_df = load_whole_dataframe(Néstor.path_to_directory_of_task('TCT_1D_scan')/'parsed_from_waveforms.sqlite')
 		measured_data_df = load_whole_dataframe(Néstor.path_to_directory_of_task('TCT_1D_scan')/'measured_data.sqlite')
 		measured_data_df['When'] = pandas.to_datetime(measured_data_df['When'])
+		measured_data_df['Distance (m)'] = integrate_distance_given_path(list(measured_data_df[['x (m)', 'y (m)', 'z (m)']].to_numpy()))
 		
-		data_df = measured_data_df.merge(parsed_data_df, left_index=True, right_index=True)
-		data_df = data_df.fillna(value=np.nan)
-		
-		data_df.drop(columns=['When'], inplace=True)
-		
-		data_df['Distance (m)'] = integrate_distance_given_path(list(data_df[['x (m)', 'y (m)', 'z (m)']].to_numpy()))
-		
-		averaged_in_position_df = data_df.groupby(['n_position','n_channel','n_pulse']).agg([np.nanmedian, kMAD])
-		averaged_in_position_df.columns = [f'{col[0]} {col[1]}' for col in averaged_in_position_df.columns]
+		averaged_in_position_df = utils.load_aggregated_per_position(Néstor.path_to_directory_of_task('TCT_1D_scan'))
+		if averaged_in_position_df is None: # This scan was done before the aggregation during acquisition existed, do it now.
+			averaged_in_position_df = utils.aggregate_parsed_data_in_chunks(Néstor.path_to_directory_of_task('TCT_1D_scan')/'parsed_from_waveforms.sqlite')
+		averaged_in_position_df = averaged_in_position_df.reset_index(drop=False).merge(
+			measured_data_df[['Distance (m)']].reset_index(drop=False),
+			on = 'n_position',
+		).set_index(['n_position','n_channel','n_pulse'])
 
 		if draw_main_plots:
 			for var in {'Amplitude (V)','Collected charge (V s)','SNR'}:
 				fig = line(
 					data_frame = averaged_in_position_df.reset_index(drop=False),
-					x = 'Distance (m) nanmedian',
+					x = 'Distance (m)',
 					y = f'{var} nanmedian',
 					error_y = f'{var} kMAD',
 					error_y_mode = 'bands',
@@ -211,7 +418,6 @@ def plot_parsed_data_from_TCT_1D_scan(bureaucrat:RunBureaucrat, draw_main_plots:
 					line_dash = 'n_pulse',
 					title = f'{var} vs distance<br><sup>Run: {Néstor.run_name}</sup>',
 					labels = {
-						'Distance (m) nanmedian': 'Distance (m)',
 						f'{var} nanmedian': var,
 					},
 				)
@@ -225,7 +431,7 @@ def plot_parsed_data_from_TCT_1D_scan(bureaucrat:RunBureaucrat, draw_main_plots:
 			store_distributions_here.mkdir(exist_ok=True)
 			for var in {'Humidity (%RH)','Temperature (°C)',}:
 				fig = px.ecdf(
-					data_df.loc[data_df[var].notna()],
+					measured_data_df.loc[measured_data_df[var].notna()],
 					x = var,
 					title = f'{var} distribution<br><sup>Run: {Néstor.run_name}</sup>',
 				)
@@ -234,7 +440,7 @@ def plot_parsed_data_from_TCT_1D_scan(bureaucrat:RunBureaucrat, draw_main_plots:
 					include_plotlyjs = 'cdn',
 				)
 
-def TCT_1D_scan_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, voltages:list, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:SafeTelegramReporter4Loops=None, compress_waveforms_file:bool=True, save_waveforms:bool=True):
+def TCT_1D_scan_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, voltages:list, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:SafeTelegramReporter4Loops=None, compress_waveforms_file:bool=True, save_waveforms:bool=True, waveforms_in_ADCu:bool=False, zero_suppression:dict=None, disk_space_guard:DiskSpaceGuard=None):
 	"""Perform a several 1D scans with the TCT setup, one at each voltage.
 	
 	Arguments
@@ -254,6 +460,14 @@ def TCT_1D_scan_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, volta
 		Number of triggers to record at each position.
 	reporter: TelegramReporter
 		A reporter to report the progress of the script. Optional.
+	waveforms_in_ADCu: bool, default False
+		See `TCT_1D_scan`.
+	zero_suppression: dict, optional
+		See `TCT_1D_scan`.
+	disk_space_guard: DiskSpaceGuard, optional
+		See `TCT_1D_scan`. The same one is used for all the voltages, and
+		if the waveforms files are not compressed after each voltage they
+		are compressed when the disk is getting full.
 	"""
 	Lorenzo = bureaucrat
 	Lorenzo.create_run()
@@ -264,6 +478,8 @@ def TCT_1D_scan_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, volta
 			logging.info(f'Control of hardware acquired!')
 			report_progress = reporter is not None
 			with reporter.report_for_loop(len(voltages), f'{Lorenzo.run_name}') if report_progress else nullcontext() as reporter:
+				if disk_space_guard is None:
+					disk_space_guard = DiskSpaceGuard(Lorenzos_employee.path_to_directory_of_my_task, reporter=reporter)
 				for voltage in voltages:
 					logging.info('Setting bias voltage...')
 					the_setup.set_bias_voltage(volts=voltage)
@@ -275,22 +491,28 @@ def TCT_1D_scan_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, volta
 						n_triggers_per_position = n_triggers_per_position,
 						acquire_channels = acquire_channels,
 						save_waveforms = save_waveforms,
+						waveforms_in_ADCu = waveforms_in_ADCu,
+						zero_suppression = zero_suppression,
+						disk_space_guard = disk_space_guard,
 						reporter = TelegramReporter(
 							telegram_token = my_telegram_bots.robobot.token, 
 							telegram_chat_id = my_telegram_bots.chat_ids['Robobot TCT setup'],
 						) if report_progress else None,
 					)
-					if compress_waveforms_file and save_waveforms:
+					path_to_waveforms_file = Lorenzos_son.path_to_directory_of_task('TCT_1D_scan')/'waveforms.sqlite'
+					if compress_waveforms_file and path_to_waveforms_file.is_file(): # It may not exist even if `save_waveforms`, see `disk_space_guard`.
 						logging.info(f'Compressing waveforms file...')
-						path_to_waveforms_file = Lorenzos_son.path_to_directory_of_task('TCT_1D_scan')/'waveforms.sqlite'
 						compress_waveforms_sqlite(path_to_waveforms_file)
 						path_to_waveforms_file.unlink()
+					elif path_to_waveforms_file.is_file():
+						disk_space_guard.add_finished_waveforms_file(path_to_waveforms_file)
 					try:
 						plot_parsed_data_from_TCT_1D_scan(bureaucrat=Lorenzos_son)
 					except Exception:
 						pass
 					logging.info(f'Finished {Lorenzos_son.run_name}.')
 					reporter.update(1)
+				disk_space_guard.wait_for_compressions()
 
 if __name__ == '__main__':
 	import my_telegram_bots
@@ -304,7 +526,7 @@ if __name__ == '__main__':
 		task_name = 'TCT_1D_scan',
 		drop_old_data = False,
 	)
-	plot_some_random_waveforms(bureaucrat, 35*22*2*4)
+	plot_some_random_waveforms(bureaucrat)
 	
 	# ~ def create_list_of_positions(device_center_xyz:tuple, scan_length:float, scan_angle_deg:float, scan_step:float):
 		# ~ x = device_center_xyz[0] + np.arange(-scan_length/2,scan_length/2,scan_step)*np.cos(scan_angle_deg*np.pi/180)
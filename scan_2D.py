@@ -2,20 +2,33 @@ from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/Senger
 from pathlib import Path
 import pandas
 from contextlib import nullcontext
-from progressreporting.TelegramProgressReporter import SafeTelegramReporter4Loops # https://github.com/SengerM/progressreporting
-from scan_1D import TCT_1D_scan
+from typing import TYPE_CHECKING
 import numpy
 import utils
-from huge_dataframe.SQLiteDataFrame import load_whole_dataframe
-import sqlite3
-import plotly.express as px
-from multiprocessing import Process
-from plotly_utils import scatter_histogram
-import plotly.graph_objects as go
+from disk_space_guard import DiskSpaceGuard
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import logging
-import dominate # https://github.com/Knio/dominate
 
-def TCT_2D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:SafeTelegramReporter4Loops=None, save_waveforms:bool=True):
+# This module is imported by small entry points such as `compress_2D_scan.py`
+# or `plot_2D_scan.py`, so the heavy imports needed only for measuring or
+# only for plotting are done inside the functions that use them.
+if TYPE_CHECKING:
+	from progressreporting.TelegramProgressReporter import SafeTelegramReporter4Loops # https://github.com/SengerM/progressreporting
+
+N_WORKERS_FOR_BACKGROUND_PLOTS = 2 # Leave the rest of the cores for the measurement.
+
+def probe_grid(positions:list, n_per_axis:int=8)->list:
+	"""A coarse grid of `n_per_axis`×`n_per_axis` of the `positions` of
+	a 2D scan, see `TCT_2D_scan`, for `scan_1D.find_active_channels`. It
+	is evenly spaced in `n_x` and `n_y`, so with 8 per axis each pad of
+	a matrix of up to 4×4 pads covering the scan is probed at least once.
+	The positions to be skipped, i.e. `None`, are not probed."""
+	rows = sorted(set(numpy.linspace(0, len(positions)-1, n_per_axis).astype(int)))
+	columns = sorted(set(numpy.linspace(0, len(positions[0])-1, n_per_axis).astype(int)))
+	return [positions[n_y][n_x] for n_y in rows for n_x in columns if positions[n_y][n_x] is not None]
+
+def TCT_2D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:'SafeTelegramReporter4Loops'=None, save_waveforms:bool=True, waveforms_in_ADCu:bool=False, zero_suppression:dict=None, disk_space_guard:DiskSpaceGuard=None, export_to_parquet:bool=False):
 	"""Perform a 2D scan with the TCT setup.
 	
 	Arguments
@@ -30,13 +43,25 @@ def TCT_2D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 		or `None` if it is going to be skipped. This 2 dimensional list
 		must be of M×N, i.e. all rows and columns are complete and filled
 		with `None` in those places to be skipped.
-	acquire_channels: list of int
+	acquire_channels: list of int or 'auto'
 		A list with the number of the channels to acquire from the oscilloscope.
+		If `'auto'`, the active channels are found with `scan_1D.find_active_channels`
+		before starting, probing the positions from `probe_grid`.
 	n_triggers_per_position: int
 		Number of triggers to record at each position.
 	reporter: SafeTelegramReporter4Loops
 		A reporter to report the progress of the script. Optional.
+	waveforms_in_ADCu: bool, default False
+		See `scan_1D.TCT_1D_scan`.
+	zero_suppression: dict, optional
+		See `scan_1D.TCT_1D_scan`.
+	disk_space_guard: DiskSpaceGuard, optional
+		See `scan_1D.TCT_1D_scan`.
+	export_to_parquet: bool, default False
+		See `scan_1D.TCT_1D_scan`.
 	"""
+	from scan_1D import TCT_1D_scan, find_active_channels
+	
 	bureaucrat.create_run(if_exists='skip')
 	
 	if len(set([len(l) for l in positions])) != 1:
@@ -65,6 +90,15 @@ def TCT_2D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 		df = pandas.DataFrame.from_records(df).set_index(['n_position','n_x','n_y'])
 		utils.save_dataframe(df, 'positions', employee.path_to_directory_of_my_task)
 		
+		if acquire_channels == 'auto':
+			logging.info('Looking for active channels...')
+			with the_setup.hold_signal_acquisition(), the_setup.hold_tct_control():
+				acquire_channels = find_active_channels(
+					the_setup = the_setup,
+					probe_positions = probe_grid(positions),
+					save_probe_results_here = employee.path_to_directory_of_my_task,
+				)
+		
 		TCT_1D_scan(
 			bureaucrat = employee.create_subrun(bureaucrat.run_name + '_Flattened1DScan'), 
 			the_setup = the_setup, 
@@ -73,6 +107,10 @@ def TCT_2D_scan(bureaucrat:RunBureaucrat, the_setup, positions:list, acquire_cha
 			n_triggers_per_position = n_triggers_per_position, 
 			reporter = reporter, 
 			save_waveforms = save_waveforms,
+			waveforms_in_ADCu = waveforms_in_ADCu,
+			zero_suppression = zero_suppression,
+			disk_space_guard = disk_space_guard,
+			export_to_parquet = export_to_parquet,
 		)
 
 def compress_waveforms_file_in_2D_scan(bureaucrat:RunBureaucrat):
@@ -85,8 +123,60 @@ def compress_waveforms_file_in_2D_scan(bureaucrat:RunBureaucrat):
 	logging.info(f'Finished compressing waveforms file in "{path_to_waveforms_file}". ')
 	path_to_waveforms_file.unlink()
 
-def plot_everything_from_TCT_2D_scan(bureaucrat:RunBureaucrat, skip_check=False):
-	"""Produce a set of general plots to explore the results from a 2D scan."""
+def _write_figure(kind:str, data:pandas.DataFrame, col:str, title:str, path_to_file:Path, colorbar_title:str=None):
+	"""Produce a single figure for `plot_everything_from_TCT_2D_scan` and
+	save it. It lives at module level so it can be sent to a process pool.
+	
+	Arguments
+	---------
+	kind: str
+		Either `'nx_ny'`, in which case `data` is the image with `n_y`
+		as index and `n_x` as columns, or `'xy'`, in which case `data`
+		has the columns `x (m)`, `y (m)`, `col`, `n_position`, `n_x` and `n_y`.
+	"""
+	import plotly.express as px
+	
+	if kind == 'nx_ny':
+		fig = px.imshow(
+			title = title,
+			img = data,
+			aspect = 'equal',
+			origin = 'lower',
+		)
+	elif kind == 'xy':
+		fig = px.scatter(
+			data_frame = data,
+			title = title,
+			x = 'x (m)',
+			y = 'y (m)',
+			color = col,
+			hover_data = ['n_position','n_x','n_y'],
+		)
+		fig.update_yaxes(
+			scaleanchor = "x",
+			scaleratio = 1,
+		)
+	else:
+		raise ValueError(f'`kind` must be either "nx_ny" or "xy", received {repr(kind)}. ')
+	fig.update_coloraxes(colorbar_title_side='right')
+	if colorbar_title is not None:
+		fig.update_coloraxes(colorbar_title=colorbar_title)
+	fig.write_html(
+		path_to_file,
+		include_plotlyjs = 'cdn',
+	)
+
+def plot_everything_from_TCT_2D_scan(bureaucrat:RunBureaucrat, skip_check=False, n_workers:int=None):
+	"""Produce a set of general plots to explore the results from a 2D scan.
+	All of them can be explored in a single page in `dashboard.html`. The
+	individual figures are rendered in parallel by `n_workers` processes, default
+	is one per core, or in this process if `n_workers` is 1, and the `all_together.html` pages are assembled at
+	the end."""
+	import dominate # https://github.com/Knio/dominate
+	import aggregates_cache
+	import tile_pyramid
+	from dashboard_2D_scan import write_dashboard, ADDITIVE_COLUMNS
+	
 	if skip_check == False:
 		bureaucrat.check_these_tasks_were_run_successfully('TCT_2D_scan')
 	
@@ -99,136 +189,146 @@ def plot_everything_from_TCT_2D_scan(bureaucrat:RunBureaucrat, skip_check=False)
 		positions_data = pandas.read_pickle(bureaucrat.path_to_directory_of_task('TCT_2D_scan')/'positions.pickle')
 		positions_data.reset_index(['n_x','n_y'], drop=False, inplace=True)
 		
-		logging.info('Reading index data...')
-		data_index = pandas.read_sql(
-			f'SELECT n_position,n_channel,n_pulse FROM dataframe_table WHERE n_pulse==1',
-			con = sqlite3.connect(flattened_1D_scan_subrun_bureaucrat.path_to_directory_of_task('TCT_1D_scan')/'parsed_from_waveforms.sqlite'),
-		).set_index(['n_position','n_channel','n_pulse']).index
+		COLUMNS_TO_PLOT = ['Amplitude (V)','t_50 (s)','Collected charge (V s)']
+		
+		logging.info('Reading data...')
+		aggregated_data = aggregates_cache.load_aggregated_columns(
+			path_to_TCT_1D_scan = flattened_1D_scan_subrun_bureaucrat.path_to_directory_of_task('TCT_1D_scan'),
+			columns = COLUMNS_TO_PLOT,
+			filters = {'n_pulse': 1},
+		)
+		aggregated_data = aggregated_data.reset_index('n_pulse', drop=True)
+		aggregated_data = aggregated_data.merge(positions_data, left_index=True, right_index=True)
+		
+		logging.info('Writing dashboard...')
+		write_dashboard(
+			aggregated_data = aggregated_data,
+			columns = COLUMNS_TO_PLOT,
+			path_to_file = employee.path_to_directory_of_my_task/'dashboard.html',
+			title = str(employee.pseudopath),
+		)
+		
+		logging.info('Building tile pyramid...')
+		tile_pyramid.build_tile_pyramid(
+			aggregated_data = aggregated_data,
+			columns = COLUMNS_TO_PLOT,
+			path_to_pyramid = employee.path_to_directory_of_my_task/'tile_pyramid',
+		)
 		
-		for col in {'Amplitude (V)','t_50 (s)','Collected charge (V s)'}:
+		figures = [] # Each element is a dictionary with the arguments for `_write_figure`.
+		for col in COLUMNS_TO_PLOT:
 			path_for_nx_ny_plots = employee.path_to_directory_of_my_task/col/'plots_nx_ny'
 			path_for_nx_ny_plots.mkdir(parents=True)
 			
 			path_for_scatter_plots = employee.path_to_directory_of_my_task/col/'plots_xy'
 			path_for_scatter_plots.mkdir(parents=True)
 			
-			logging.info(f'Reading data for {repr(col)}...')
-			data = pandas.read_sql(
-				f'SELECT `{col}` FROM dataframe_table WHERE n_pulse==1',
-				con = sqlite3.connect(flattened_1D_scan_subrun_bureaucrat.path_to_directory_of_task('TCT_1D_scan')/'parsed_from_waveforms.sqlite'),
-			)
-			data.index = data_index
-			
-			averages = data.groupby(['n_position','n_channel']).agg(numpy.nanmedian)
-			averages = averages.merge(positions_data, left_index=True, right_index=True)
-			
-			# Do plots:
-			logging.info(f'Plotting {repr(col)}...')
-			
-			nxny_plots_doc = dominate.document(title=f'{col} vs n_x,n_y {employee.pseudopath}')
-			xy_plots_doc = dominate.document(title=f'{col} vs x,y {employee.pseudopath}')
-			
+			averages = aggregated_data[[f'{col} nanmedian'] + list(positions_data.columns)].rename(columns={f'{col} nanmedian': col})
 			averages.reset_index(inplace=True, drop=False)
 			averages.set_index(['n_y','n_x','n_channel'], inplace=True)
 			
-			if col in {'Amplitude (V)','Collected charge (V s)'}:
-				fig = px.imshow(
+			if col in ADDITIVE_COLUMNS:
+				figures.append(dict(
+					kind = 'nx_ny',
+					data = averages[col].groupby(['n_y','n_x']).sum(min_count=1).unstack('n_x'), # NaN where no channel has data.
+					col = col,
 					title = f'sum({col})<br><sup>{employee.pseudopath}</sup>',
-					img = averages[col].groupby(['n_y','n_x']).sum().to_xarray(),
-					aspect = 'equal',
-					origin = 'lower',
-				)
-				fig.update_coloraxes(colorbar_title_side='right')
-				fig.write_html(
-					path_for_nx_ny_plots/f'sum({col})_nx_ny.html',
-					include_plotlyjs = 'cdn',
-				)
-				with nxny_plots_doc:
-					dominate.tags.iframe(
-						src = f'sum({col})_nx_ny.html',
-						style = 'width: 100%; height: 88vh; border: 0;',
-					)
-				
-				fig = px.scatter(
-					data_frame = averages.groupby(['n_y','n_x','x (m)','y (m)','n_position']).sum().reset_index(),
+					path_to_file = path_for_nx_ny_plots/f'sum({col})_nx_ny.html',
+				))
+				figures.append(dict(
+					kind = 'xy',
+					data = averages.groupby(['n_y','n_x','x (m)','y (m)','n_position']).sum(min_count=1).reset_index(),
+					col = col,
 					title = f'sum({col}) vs x,y<br><sup>{employee.pseudopath}</sup>',
-					x = 'x (m)',
-					y = 'y (m)',
-					color = col,
-					hover_data = ['n_position','n_x','n_y'],
-				)
-				fig.update_coloraxes(colorbar_title_side='right')
-				fig.update_yaxes(
-					scaleanchor = "x",
-					scaleratio = 1,
-				)
-				fig.write_html(
-					path_for_scatter_plots/f'sum({col}).html',
-					include_plotlyjs = 'cdn',
-				)
-				with xy_plots_doc:
-					dominate.tags.iframe(
-						src = f'sum({col}).html',
-						style = 'width: 100%; height: 88vh; border: 0;',
-					)
+					path_to_file = path_for_scatter_plots/f'sum({col}).html',
+				))
 			
-			for n_channel in data.reset_index('n_channel')['n_channel'].drop_duplicates():
-				fig = px.imshow(
+			for n_channel in averages.reset_index('n_channel')['n_channel'].drop_duplicates():
+				this_channel = averages.query(f'n_channel=={n_channel}').reset_index(drop=False)
+				figures.append(dict(
+					kind = 'nx_ny',
+					data = tile_pyramid.load_region(employee.path_to_directory_of_my_task/'tile_pyramid', col, n_channel), # Downsampled if the map is too large.
+					col = col,
 					title = f'{col} vs n_x,n_y, n_channel={n_channel}<br><sup>{employee.pseudopath}</sup>',
-					img = averages.query(f'n_channel=={n_channel}').reset_index(drop=False).set_index(['n_x','n_y']).unstack('n_x')[col],
-					aspect = 'equal',
-					origin = 'lower',
-				)
-				fig.update_coloraxes(colorbar_title_side='right', colorbar_title=col)
-				fig.write_html(
-					path_for_nx_ny_plots/f'{col}_n_channel_{n_channel}.html',
-					include_plotlyjs = 'cdn',
-				)
-				with nxny_plots_doc:
-					dominate.tags.iframe(
-						src = f'{col}_n_channel_{n_channel}.html',
-						style = 'width: 100%; height: 88vh; border: 0;',
-					)
-				
-				fig = px.scatter(
-					data_frame = averages.query(f'n_channel=={n_channel}').reset_index(),
+					path_to_file = path_for_nx_ny_plots/f'{col}_n_channel_{n_channel}.html',
+					colorbar_title = col,
+				))
+				figures.append(dict(
+					kind = 'xy',
+					data = this_channel,
+					col = col,
 					title = f'{col} vs x,y, n_channel={n_channel}<br><sup>{employee.pseudopath}</sup>',
-					x = 'x (m)',
-					y = 'y (m)',
-					color = col,
-					hover_data = ['n_position','n_x','n_y'],
-				)
-				fig.update_coloraxes(colorbar_title_side='right')
-				fig.update_yaxes(
-					scaleanchor = "x",
-					scaleratio = 1,
-				)
-				fig.write_html(
-					path_for_scatter_plots/f'{col}_n_channel_{n_channel}.html',
-					include_plotlyjs = 'cdn',
-				)
-				with xy_plots_doc:
-					dominate.tags.iframe(
-						src = f'{col}_n_channel_{n_channel}.html',
-						style = 'width: 100%; height: 88vh; border: 0;',
-					)
-			
-			with open(path_for_nx_ny_plots/'all_together.html','w') as ofile:
-				print(nxny_plots_doc, file=ofile)
-			with open(path_for_scatter_plots/'all_together.html','w') as ofile:
-				print(xy_plots_doc, file=ofile)
+					path_to_file = path_for_scatter_plots/f'{col}_n_channel_{n_channel}.html',
+				))
+		
+		logging.info(f'Rendering {len(figures)} figures...')
+		if n_workers == 1: # E.g. when this is already running in a worker, no need for another one.
+			for figure in figures:
+				_write_figure(**figure)
+		else:
+			with ProcessPoolExecutor(max_workers=n_workers) as executor:
+				for future in [executor.submit(_write_figure, **figure) for figure in figures]:
+					future.result() # Raise any exception from the workers.
+		
+		for path_to_directory in sorted({figure['path_to_file'].parent for figure in figures}):
+			col = path_to_directory.parent.name
+			doc = dominate.document(title=f'{col} vs {"n_x,n_y" if path_to_directory.name=="plots_nx_ny" else "x,y"} {employee.pseudopath}')
+			with doc:
+				for figure in figures:
+					if figure['path_to_file'].parent == path_to_directory:
+						dominate.tags.iframe(
+							src = figure['path_to_file'].name,
+							style = 'width: 100%; height: 88vh; border: 0;',
+						)
+			with open(path_to_directory/'all_together.html','w') as ofile:
+				print(doc, file=ofile)
 			
 	logging.info('Finished plotting 2D scan!')
 
-def TCT_2D_scans_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, voltages:list, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:SafeTelegramReporter4Loops=None, compress_waveforms_files:bool=True, save_waveforms:bool=True):
+def _post_process_voltage(path_to_run:Path, step:str):
+	"""Do `step`, either `'plot'` or `'compress'`, on the run of one of
+	the voltages of `TCT_2D_scans_sweeping_bias_voltage`, in its background
+	worker."""
+	bureaucrat = RunBureaucrat(path_to_run)
+	if step == 'plot':
+		plot_everything_from_TCT_2D_scan(bureaucrat, skip_check=True, n_workers=N_WORKERS_FOR_BACKGROUND_PLOTS)
+	elif step == 'compress':
+		compress_waveforms_file_in_2D_scan(bureaucrat)
+	else:
+		raise ValueError(f'`step` must be either "plot" or "compress", received {repr(step)}. ')
+
+def TCT_2D_scans_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, voltages:list, positions:list, acquire_channels:list, n_triggers_per_position:int=1, reporter:'SafeTelegramReporter4Loops'=None, compress_waveforms_files:bool=True, save_waveforms:bool=True, waveforms_in_ADCu:bool=False, zero_suppression:dict=None, disk_space_guard:DiskSpaceGuard=None, export_to_parquet:bool=False):
+	"""Perform several 2D scans with the TCT setup, one at each voltage.
+	If `acquire_channels` is `'auto'` the active channels are found once,
+	at the first voltage, and then used for all the voltages. The same
+	`disk_space_guard` is used for all the voltages, and the waveforms
+	files that are not compressed after each voltage are compressed by
+	it when the disk is getting full, see `scan_1D.TCT_1D_scan`. The plots
+	and the compression of each voltage are done by a single background
+	process while measuring the next ones, and waited for at the end. For
+	the other arguments see `TCT_2D_scan`."""
+	from scan_1D import find_active_channels
+	
 	bureaucrat.create_run(if_exists='skip')
 	
-	with bureaucrat.handle_task('TCT_2D_scans_sweeping_bias_voltage') as employee:
+	background_tasks = {} # `{future: description}`
+	with bureaucrat.handle_task('TCT_2D_scans_sweeping_bias_voltage') as employee, ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as background: # Not forked, this process has threads, e.g. those of the connection with the setup.
 		with reporter.report_loop(len(voltages), bureaucrat.run_name) if reporter is not None else nullcontext() as reporter:
+			if disk_space_guard is None:
+				disk_space_guard = DiskSpaceGuard(employee.path_to_directory_of_my_task, reporter=reporter)
 			for voltage in voltages:
 				logging.info(f'Setting bias voltage to {voltage} V...')
 				the_setup.set_bias_voltage(volts=voltage)
 				
+				if acquire_channels == 'auto':
+					logging.info('Looking for active channels...')
+					with the_setup.hold_signal_acquisition(), the_setup.hold_tct_control():
+						acquire_channels = find_active_channels(
+							the_setup = the_setup,
+							probe_positions = probe_grid(positions),
+							save_probe_results_here = employee.path_to_directory_of_my_task,
+						)
+				
 				b = employee.create_subrun(f'{int(voltage)}V')
 				try:
 					TCT_2D_scan(
@@ -239,23 +339,72 @@ def TCT_2D_scans_sweeping_bias_voltage(bureaucrat:RunBureaucrat, the_setup, volt
 						n_triggers_per_position = n_triggers_per_position,
 						reporter = reporter.create_subloop_reporter() if reporter is not None else None,
 						save_waveforms = save_waveforms,
+						waveforms_in_ADCu = waveforms_in_ADCu,
+						zero_suppression = zero_suppression,
+						disk_space_guard = disk_space_guard,
+						export_to_parquet = export_to_parquet,
 					)
 				except Exception as e:
 					raise e
 				finally:
-					# Always plot whatever was measured, it should not take so long...
-					logging.info(f'Producing plots for {b.run_name}...')
-					plot_everything_from_TCT_2D_scan(b, skip_check=True)
+					# Always plot whatever was measured, in the background so the next voltage does not have to wait for it.
+					logging.info(f'Producing plots for {b.run_name} in the background...')
+					background_tasks[background.submit(_post_process_voltage, b.path_to_run_directory, 'plot')] = f'plots of {b.run_name}'
 				
-				if compress_waveforms_files and save_waveforms:
-					logging.info(f'Compressing waveforms file...')
-					p = Process(target=compress_waveforms_file_in_2D_scan, args=(b,))
-					p.start() # Let's hope this ends before the next 2D scan finishes, otherwise this becomes a snowball...
+				path_to_waveforms_file = b.list_subruns_of_task('TCT_2D_scan')[0].path_to_directory_of_task('TCT_1D_scan')/'waveforms.sqlite'
+				if compress_waveforms_files and path_to_waveforms_file.is_file(): # It may not exist even if `save_waveforms`, see `disk_space_guard`.
+					logging.info(f'Compressing waveforms file in the background...')
+					background_tasks[background.submit(_post_process_voltage, b.path_to_run_directory, 'compress')] = f'compression of {b.run_name}' # If it falls behind and the disk gets full, `disk_space_guard` stops saving the waveforms.
+				elif path_to_waveforms_file.is_file():
+					disk_space_guard.add_finished_waveforms_file(path_to_waveforms_file)
 				
 				reporter.update(1) if reporter is not None else None
+		logging.info('Waiting for the plots and compressions in the background...')
+		disk_space_guard.wait_for_compressions()
+		for future,description in background_tasks.items():
+			try:
+				future.result()
+			except Exception as e:
+				logging.error(f'The {description} failed: {repr(e)}')
+
+def create_list_of_positions(device_center_xyz:tuple, x_span:float, y_span:float, x_step:float, y_step:float, rotation_angle_deg:float, readout_pads_to_remove:dict=None)->list:
+	"""Produce the `positions` for `TCT_2D_scan`, a grid of `x_span`×`y_span`
+	with steps `x_step` and `y_step` centered in `device_center_xyz` and
+	rotated by `rotation_angle_deg`. The positions falling on the pads
+	described by `readout_pads_to_remove` are `None`."""
+	x = numpy.linspace(-x_span/2, x_span/2, int(x_span/x_step+1))
+	y = numpy.linspace(-y_span/2, y_span/2, int(y_span/y_step+1))
+	
+	xx, yy = numpy.meshgrid(x, y)
+	
+	# Apply rotation
+	phi = numpy.arctan2(yy,xx)
+	cos = numpy.cos(rotation_angle_deg*numpy.pi/180+phi)
+	sin = numpy.sin(rotation_angle_deg*numpy.pi/180+phi)
+	rr = (xx**2+yy**2)**.5
+	xx, yy = rr*cos, rr*sin
+	
+	xx += device_center_xyz[0]
+	yy += device_center_xyz[1]
+	zz = xx*0 + device_center_xyz[2]
+	
+	remove_these = numpy.full(xx.shape, False)
+	if isinstance(readout_pads_to_remove, dict):
+		pitch = readout_pads_to_remove['pitch']
+		size = readout_pads_to_remove['size']
+		if readout_pads_to_remove['shape'] != 'square':
+			raise ValueError('Only implemented for square pads. ')
+		for row in [-1,1]:
+			for col in [-1,1]:
+				remove_these |= (xx-device_center_xyz[0]>(col*pitch-size)/2) & (xx-device_center_xyz[0]<(col*pitch+size)/2) & (yy-device_center_xyz[1]>(row*pitch-size)/2) & (yy-device_center_xyz[1]<(row*pitch+size)/2)
+	
+	positions = [[(xx[nx,ny],yy[nx,ny],zz[nx,ny]) if remove_these[nx,ny]==False else None for ny in range(len(xx[nx]))] for nx in range(len(xx))]
+	
+	return positions
 
 if __name__ == '__main__':
 	import my_telegram_bots
+	from progressreporting.TelegramProgressReporter import SafeTelegramReporter4Loops # https://github.com/SengerM/progressreporting
 	from configuration_files.scans_configs import Alberto, CONFIG_2D_SCAN, CURRENT_COMPLIANCE_AMPERES
 	from utils import create_a_timestamp
 	from TheSetup import connect_me_with_the_setup
@@ -272,37 +421,6 @@ if __name__ == '__main__':
 	
 	set_my_template_as_default()
 	
-	def create_list_of_positions(device_center_xyz:tuple, x_span:float, y_span:float, x_step:float, y_step:float, rotation_angle_deg:float, readout_pads_to_remove:dict=None):
-		x = numpy.linspace(-x_span/2, x_span/2, int(x_span/x_step+1))
-		y = numpy.linspace(-y_span/2, y_span/2, int(y_span/y_step+1))
-		
-		xx, yy = numpy.meshgrid(x, y)
-		
-		# Apply rotation
-		phi = numpy.arctan2(yy,xx)
-		cos = numpy.cos(rotation_angle_deg*numpy.pi/180+phi)
-		sin = numpy.sin(rotation_angle_deg*numpy.pi/180+phi)
-		rr = (xx**2+yy**2)**.5
-		xx, yy = rr*cos, rr*sin
-		
-		xx += device_center_xyz[0]
-		yy += device_center_xyz[1]
-		zz = xx*0 + device_center_xyz[2]
-		
-		remove_these = numpy.full(xx.shape, False)
-		if isinstance(readout_pads_to_remove, dict):
-			pitch = readout_pads_to_remove['pitch']
-			size = readout_pads_to_remove['size']
-			if readout_pads_to_remove['shape'] != 'square':
-				raise ValueError('Only implemented for square pads. ')
-			for row in [-1,1]:
-				for col in [-1,1]:
-					remove_these |= (xx-device_center_xyz[0]>(col*pitch-size)/2) & (xx-device_center_xyz[0]<(col*pitch+size)/2) & (yy-device_center_xyz[1]>(row*pitch-size)/2) & (yy-device_center_xyz[1]<(row*pitch+size)/2)
-		
-		positions = [[(xx[nx,ny],yy[nx,ny],zz[nx,ny]) if remove_these[nx,ny]==False else None for ny in range(len(xx[nx]))] for nx in range(len(xx))]
-		
-		return positions
-	
 	is_preview = input("Preview? (yes/no) ")
 	if is_preview not in {'yes','no'}:
 		raise ValueError(f'Your answer has to be either yes or no, but you said {repr(is_preview)}.')
@@ -344,7 +462,7 @@ if __name__ == '__main__':
 						readout_pads_to_remove = CONFIG_2D_SCAN['REMOVE_PADS'],
 						rotation_angle_deg = CONFIG_2D_SCAN['ROTATION_ANGLE_DEG'],
 					),
-					acquire_channels = list(range(16)),
+					acquire_channels = CONFIG_2D_SCAN.get('ACQUIRE_CHANNELS', list(range(16))), # Use `'auto'` to find the active channels before starting.
 					n_triggers_per_position = CONFIG_2D_SCAN['N_TRIGGERS_PER_POSITION'],
 					reporter = SafeTelegramReporter4Loops(
 						bot_token = my_telegram_bots.robobot.token, 
@@ -352,6 +470,9 @@ if __name__ == '__main__':
 					),
 					compress_waveforms_files = CONFIG_2D_SCAN['COMPRESS_WAVEFORMS_FILE'],
 					save_waveforms = CONFIG_2D_SCAN['SAVE_WAVEFORMS'],
+					waveforms_in_ADCu = CONFIG_2D_SCAN.get('WAVEFORMS_IN_ADCu', False),
+					zero_suppression = CONFIG_2D_SCAN.get('ZERO_SUPPRESSION'),
+					export_to_parquet = CONFIG_2D_SCAN.get('EXPORT_TO_PARQUET', False), # Needs `pyarrow`.
 				)
 			finally:
 				logging.info('Finalizing scan...')
@@ -0,0 +1,346 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from pathlib import Path
+import pandas
+import numpy
+import sqlite3
+import shutil
+import zipfile
+import logging
+from runs_catalog import walk_runs, task_was_successful
+from scan_2D import create_list_of_positions
+from disk_space_guard import PARSED_ONLY_BELOW_BYTES
+
+SETTLE_SECONDS = .5 # The `sleep` after moving the stages in `scan_1D.TCT_1D_scan`.
+N_PULSES = 2 # Each trigger is split into two pulses, see `scan_1D.TCT_1D_scan`.
+DEFAULT_COMPRESSION_RATIO = 10 # See `utils.compress_waveforms_sqlite`, used only if the ratio was not measured in any previous run.
+DISK_SAFETY_MARGIN = .1 # Fraction of the usable disk space, see `plan_2D_scan`, that is not planned to be used.
+
+def _bytes_before_compression(path_to_zip_file:Path)->float:
+	"""Size of the `waveforms.sqlite` that was compressed into `path_to_zip_file`,
+	which `utils.compress_waveforms_sqlite` writes as the comment of the
+	zip. `NaN` for the files compressed before it did."""
+	try:
+		with zipfile.ZipFile(path_to_zip_file) as zip_file:
+			return float(zip_file.comment.decode())
+	except (ValueError, zipfile.BadZipFile):
+		return numpy.nan
+
+def measure_costs(path_to_TCT_1D_scan:Path)->dict:
+	"""Measure how long each position took and how many bytes each waveform
+	used in a `TCT_1D_scan` that was already done.
+
+	Returns
+	-------
+	costs: dict
+		A dictionary with the number of positions and waveforms per position,
+		the median seconds per position, the bytes per waveform of each
+		file and, if the waveforms were compressed, the compressed bytes
+		and the seconds the compression took per waveform. The size of
+		`waveforms.sqlite` after it was compressed and deleted is taken
+		from `waveforms.zip`, see `_bytes_before_compression`. Whatever
+		cannot be measured is `NaN`.
+	"""
+	path_to_TCT_1D_scan = Path(path_to_TCT_1D_scan)
+	with sqlite3.connect(path_to_TCT_1D_scan/'measured_data.sqlite') as connection:
+		when = pandas.to_datetime(pandas.read_sql('SELECT n_position, `When` FROM dataframe_table', connection).groupby('n_position')['When'].first(), format='ISO8601')
+	with sqlite3.connect(path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite') as connection:
+		columns = pandas.read_sql('SELECT * FROM dataframe_table LIMIT 1', connection).columns
+		n_waveforms, n_triggers, n_channels, n_saved = connection.execute(f'SELECT COUNT(*), MAX(n_trigger)+1, COUNT(DISTINCT n_channel), {"SUM(`Waveform saved`)" if "Waveform saved" in columns else "COUNT(*)"} FROM dataframe_table').fetchone()
+
+	files = {p.name: p for p in path_to_TCT_1D_scan.iterdir() if p.is_file()}
+	size = lambda name: files[name].stat().st_size if name in files else numpy.nan
+	other_bytes = sum(p.stat().st_size for name,p in files.items() if not name.startswith('waveforms.') and name != 'parsed_from_waveforms.sqlite')
+	n_saved = n_saved if n_saved is not None and n_saved > 0 else numpy.nan
+	waveforms_bytes = size('waveforms.sqlite')
+	if numpy.isnan(waveforms_bytes) and 'waveforms.zip' in files:
+		waveforms_bytes = _bytes_before_compression(files['waveforms.zip'])
+
+	costs = {
+		'n_positions': len(when),
+		'n_triggers': n_triggers,
+		'n_channels': n_channels,
+		'Waveforms per position': n_waveforms/len(when),
+		'Seconds per position': numpy.median(numpy.diff(when.to_numpy()).astype('timedelta64[ns]').astype(float))*1e-9 if len(when) > 1 else numpy.nan,
+		'Fraction of waveforms saved': n_saved/n_waveforms,
+		'Waveform bytes per waveform': waveforms_bytes/n_saved,
+		'Parsed bytes per waveform': size('parsed_from_waveforms.sqlite')/n_waveforms,
+		'Other bytes per position': other_bytes/len(when),
+		'Compressed bytes per waveform': size('waveforms.zip')/n_saved,
+		'Compression ratio': waveforms_bytes/size('waveforms.zip'),
+		'Compression seconds per waveform': (files['waveforms.zip'].stat().st_mtime - when.max().to_pydatetime().timestamp())/n_saved if 'waveforms.zip' in files else numpy.nan,
+		'Waveforms in ADCu': 'digitizer_calibration.pickle' in files,
+		'Zero suppression': 'zero_suppression_rules.pickle' in files,
+	}
+	if costs['Compression seconds per waveform'] <= 0: # The files were copied or touched afterwards.
+		costs['Compression seconds per waveform'] = numpy.nan
+	return costs
+
+def measure_costs_of_previous_scans(path_to_directory:Path, n_most_recent:int=20)->pandas.DataFrame:
+	"""Run `measure_costs` on the `n_most_recent` successful `TCT_1D_scan`
+	found within `path_to_directory`, which includes the ones inside 2D
+	scans and voltage sweeps. Returns one row per scan, indexed by its path."""
+	paths = []
+	for path_to_run, parent_path, parent_task in walk_runs(Path(path_to_directory)):
+		path_to_TCT_1D_scan = path_to_run/'TCT_1D_scan'
+		if (path_to_TCT_1D_scan/'measured_data.sqlite').is_file() and (path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite').is_file() and task_was_successful(RunBureaucrat(path_to_run), 'TCT_1D_scan'):
+			paths.append(path_to_TCT_1D_scan)
+	paths = sorted(paths, key=lambda p: (p/'measured_data.sqlite').stat().st_mtime)[-n_most_recent:]
+	costs = []
+	for path in paths:
+		try:
+			costs.append({'Path': str(path), **measure_costs(path)})
+		except Exception as e:
+			logging.warning(f'Cannot measure the costs of {path} because of {repr(e)}, skipping it.')
+	if len(costs) == 0:
+		raise RuntimeError(f'Cannot find any previous `TCT_1D_scan` within "{path_to_directory}" to estimate the costs of a new scan. ')
+	return pandas.DataFrame.from_records(costs).set_index('Path')
+
+def _seconds_per_position(costs:pandas.DataFrame, waveforms_per_position:float)->float:
+	"""Fit `seconds per position = overhead + seconds per waveform × waveforms per position`
+	to the previous scans. If all of them had the same number of waveforms
+	per position the overhead cannot be fitted and `SETTLE_SECONDS` is used."""
+	costs = costs.dropna(subset=['Seconds per position'])
+	if costs['Waveforms per position'].nunique() > 1:
+		slope, overhead = numpy.polyfit(costs['Waveforms per position'], costs['Seconds per position'], deg=1)
+		overhead = max(overhead, 0)
+		slope = max(slope, 0)
+	else:
+		overhead = min(SETTLE_SECONDS, costs['Seconds per position'].median())
+		slope = (costs['Seconds per position'].median() - overhead)/costs['Waveforms per position'].median()
+	return overhead + slope*waveforms_per_position
+
+def _median_of_similar_scans(costs:pandas.DataFrame, column:str, similar:pandas.Series):
+	"""Median of `column` among the scans in `similar`, or among all of
+	them if none of the similar ones has it."""
+	values = costs.loc[similar, column].dropna()
+	if len(values) == 0:
+		values = costs[column].dropna()
+	return values.median() if len(values) > 0 else numpy.nan
+
+def _disk_usage_timeline(n_voltages:int, scan_seconds:float, compression_seconds:float, waveform_bytes:float, compressed_bytes:float, other_bytes:float, compress:bool)->pandas.DataFrame:
+	"""Bytes used at each moment a file is finished or deleted along a sweep
+	as done by `scan_2D.TCT_2D_scans_sweeping_bias_voltage`. The compression
+	of each voltage runs in the background while the next one is measured,
+	and until it finishes both `waveforms.sqlite` and the temporary pickle
+	and zip files exist. Since files grow linearly the maximum is always
+	at one of these moments."""
+	events = sorted({i*scan_seconds for i in range(n_voltages+1)} | ({(i+1)*scan_seconds + compression_seconds for i in range(n_voltages)} if compress else set()))
+	timeline = []
+	for t in events:
+		used = 0
+		for i in range(n_voltages):
+			measured_fraction = numpy.clip((t - i*scan_seconds)/scan_seconds, 0, 1)
+			used += other_bytes*measured_fraction
+			end_of_compression = (i+1)*scan_seconds + compression_seconds
+			if not compress or t <= end_of_compression: # Right before the end the `.sqlite`, the pickle and the `.zip` all exist.
+				used += waveform_bytes*measured_fraction
+			if compress and t >= (i+1)*scan_seconds:
+				compressed_fraction = numpy.clip((t - (i+1)*scan_seconds)/compression_seconds, 0, 1) if compression_seconds > 0 else 1
+				used += compressed_bytes*compressed_fraction*(2 if t <= end_of_compression else 1)
+		timeline.append({'Time (s)': t, 'Bytes used': used})
+	return pandas.DataFrame.from_records(timeline)
+
+def plan_2D_scan(config:dict, costs:pandas.DataFrame, free_bytes:float, max_hours:float=None, keep_free_bytes:float=PARSED_ONLY_BELOW_BYTES)->dict:
+	"""Estimate how long a `TCT_2D_scans_sweeping_bias_voltage` with `config`
+	would take and how much disk it would need.
+
+	Arguments
+	---------
+	config: dict
+		A configuration as `CONFIG_2D_SCAN`, i.e. with the keys used in the
+		`__main__` of `scan_2D.py`.
+	costs: pandas.DataFrame
+		Costs measured in previous scans, see `measure_costs_of_previous_scans`.
+		The bytes per waveform are taken from the scans with the same
+		`WAVEFORMS_IN_ADCu` and `ZERO_SUPPRESSION` settings, if there are any.
+	free_bytes: float
+		Free space in the disk where the data will be written.
+	max_hours: float, optional
+		If given, the plan does not fit if it takes longer than this.
+	keep_free_bytes: float, default `disk_space_guard.PARSED_ONLY_BELOW_BYTES`
+		Free space that is not planned to be used, since below it the
+		`DiskSpaceGuard` of the scan stops saving the waveforms.
+
+	Returns
+	-------
+	plan: dict
+		A dictionary with the number of positions, the durations, the bytes
+		of each kind of file, the peak disk usage and whether it `'Fits'`.
+		Warnings about the estimation are in `'Warnings'`.
+	"""
+	warnings = []
+	positions = create_list_of_positions(
+		device_center_xyz = config['DEVICE_CENTER'],
+		x_span = config['X_SPAN'],
+		y_span = config['Y_SPAN'],
+		x_step = config['X_STEP'],
+		y_step = config['Y_STEP'],
+		readout_pads_to_remove = config.get('REMOVE_PADS'),
+		rotation_angle_deg = config['ROTATION_ANGLE_DEG'],
+	)
+	n_positions = sum(pos is not None for row in positions for pos in row)
+	n_voltages = len(config['VOLTAGES'])
+	if config.get('ACQUIRE_CHANNELS') is not None:
+		n_channels = len(config['ACQUIRE_CHANNELS'])
+	else:
+		n_channels = int(costs['n_channels'].median())
+		warnings.append(f'The channels are detected automatically, assuming {n_channels} as in previous scans.')
+	save_waveforms = config['SAVE_WAVEFORMS']
+	compress = save_waveforms and config['COMPRESS_WAVEFORMS_FILE']
+	waveforms_per_position = config['N_TRIGGERS_PER_POSITION']*n_channels*N_PULSES
+	n_waveforms = n_positions*waveforms_per_position
+
+	similar = costs['Waveforms in ADCu'] == bool(config.get('WAVEFORMS_IN_ADCu', False))
+	similar &= costs['Zero suppression'] == (config.get('ZERO_SUPPRESSION') is not None)
+	if not similar.any():
+		warnings.append('No previous scan was done with the same WAVEFORMS_IN_ADCu and ZERO_SUPPRESSION, the sizes of the waveforms may be off.')
+	fraction_saved = _median_of_similar_scans(costs, 'Fraction of waveforms saved', similar) if config.get('ZERO_SUPPRESSION') is not None else 1
+	compression_ratio = _median_of_similar_scans(costs, 'Compression ratio', similar)
+	if numpy.isnan(compression_ratio):
+		compression_ratio = DEFAULT_COMPRESSION_RATIO
+		if save_waveforms:
+			warnings.append(f'The compression ratio was not measured in any of the previous scans, assuming {DEFAULT_COMPRESSION_RATIO}.')
+	waveform_bytes_per_waveform = _median_of_similar_scans(costs, 'Waveform bytes per waveform', similar)
+	if numpy.isnan(waveform_bytes_per_waveform): # E.g. all of them were compressed before `utils.compress_waveforms_sqlite` recorded the original size.
+		waveform_bytes_per_waveform = _median_of_similar_scans(costs, 'Compressed bytes per waveform', similar)*compression_ratio
+	if numpy.isnan(waveform_bytes_per_waveform) and save_waveforms:
+		raise RuntimeError('None of the previous scans has either a `waveforms.sqlite` or a `waveforms.zip` file, cannot estimate their size. ')
+	waveform_bytes = waveform_bytes_per_waveform*n_waveforms*fraction_saved if save_waveforms else 0
+	compressed_bytes = _median_of_similar_scans(costs, 'Compressed bytes per waveform', similar)*n_waveforms*fraction_saved if compress else 0
+	if numpy.isnan(compressed_bytes):
+		compressed_bytes = waveform_bytes/compression_ratio
+	parsed_bytes = _median_of_similar_scans(costs, 'Parsed bytes per waveform', similar)*n_waveforms
+	other_bytes = costs['Other bytes per position'].median()*n_positions
+
+	scan_seconds = _seconds_per_position(costs, waveforms_per_position)*n_positions
+	compression_seconds = _median_of_similar_scans(costs, 'Compression seconds per waveform', similar)*n_waveforms*fraction_saved if compress else 0
+	if numpy.isnan(compression_seconds):
+		compression_seconds = scan_seconds
+		warnings.append('None of the previous scans was compressed, assuming the compression of each voltage takes as long as measuring it.')
+	if compress and n_voltages > 1 and compression_seconds > scan_seconds:
+		warnings.append(f'Compressing each voltage takes longer than measuring it ({compression_seconds/3600:.1f} h vs {scan_seconds/3600:.1f} h), so the compressions will pile up.')
+
+	timeline = _disk_usage_timeline(
+		n_voltages = n_voltages,
+		scan_seconds = scan_seconds,
+		compression_seconds = compression_seconds,
+		waveform_bytes = waveform_bytes,
+		compressed_bytes = compressed_bytes,
+		other_bytes = parsed_bytes + other_bytes,
+		compress = compress,
+	)
+	plan = {
+		'n_positions': n_positions,
+		'n_voltages': n_voltages,
+		'n_waveforms': n_waveforms*n_voltages,
+		'Measuring time (s)': scan_seconds*n_voltages,
+		'Total time (s)': timeline['Time (s)'].max(),
+		'Waveform bytes': waveform_bytes*n_voltages,
+		'Compressed bytes': compressed_bytes*n_voltages,
+		'Parsed bytes': (parsed_bytes+other_bytes)*n_voltages,
+		'Final bytes': (parsed_bytes + other_bytes + (compressed_bytes if compress else waveform_bytes))*n_voltages,
+		'Peak bytes': timeline['Bytes used'].max(),
+		'Free bytes': free_bytes,
+		'Usable bytes': max(free_bytes - keep_free_bytes, 0)*(1-DISK_SAFETY_MARGIN),
+		'Warnings': warnings,
+	}
+	plan['Fits'] = plan['Peak bytes'] <= plan['Usable bytes'] and (max_hours is None or plan['Total time (s)'] <= max_hours*3600)
+	return plan
+
+def suggest_changes(config:dict, costs:pandas.DataFrame, free_bytes:float, max_hours:float=None)->list:
+	"""Find the mildest change of each kind, i.e. larger steps, fewer triggers,
+	fewer channels, fewer voltages, compressing or not saving the waveforms,
+	with which `plan_2D_scan` fits. Returns a list of `(description, changes, plan)`
+	where `changes` is a dictionary to update `config` with."""
+	candidates = {
+		'step': [{'X_STEP': config['X_STEP']*f, 'Y_STEP': config['Y_STEP']*f} for f in [1.25,1.5,2,3,4]],
+		'triggers': [{'N_TRIGGERS_PER_POSITION': n} for n in sorted({max(1,int(config['N_TRIGGERS_PER_POSITION']*f)) for f in [.75,.5,.25,.1]}, reverse=True) if n < config['N_TRIGGERS_PER_POSITION']],
+		'voltages': [{'VOLTAGES': config['VOLTAGES'][::k]} for k in [2,3,4] if len(config['VOLTAGES'][::k]) < len(config['VOLTAGES'])],
+		'waveforms': ([{'COMPRESS_WAVEFORMS_FILE': True}] if config['SAVE_WAVEFORMS'] and not config['COMPRESS_WAVEFORMS_FILE'] else []) + ([{'SAVE_WAVEFORMS': False}] if config['SAVE_WAVEFORMS'] else []),
+	}
+	if config.get('ACQUIRE_CHANNELS') is not None:
+		candidates['channels'] = [{'ACQUIRE_CHANNELS': config['ACQUIRE_CHANNELS'][:n]} for n in range(len(config['ACQUIRE_CHANNELS'])-1, 0, -1)]
+	suggestions = []
+	for kind, changes_of_this_kind in candidates.items():
+		for changes in changes_of_this_kind:
+			plan = plan_2D_scan({**config, **changes}, costs, free_bytes, max_hours)
+			if plan['Fits']:
+				if kind == 'channels':
+					description = f'acquire {len(changes["ACQUIRE_CHANNELS"])} channels instead of {len(config["ACQUIRE_CHANNELS"])}'
+				elif kind == 'voltages':
+					description = f'measure {len(changes["VOLTAGES"])} voltages instead of {len(config["VOLTAGES"])}'
+				else:
+					description = ', '.join(f'{key}={value:.3g}' if isinstance(value, float) else f'{key}={repr(value)}' for key,value in changes.items())
+				suggestions.append((description, changes, plan))
+				break
+	return suggestions
+
+def _human_bytes(n_bytes:float)->str:
+	for unit in ['B','kB','MB','GB']:
+		if abs(n_bytes) < 1000:
+			return f'{n_bytes:.1f} {unit}'
+		n_bytes /= 1000
+	return f'{n_bytes:.1f} TB'
+
+def format_plan(plan:dict)->str:
+	"""A human readable summary of a plan from `plan_2D_scan`."""
+	lines = [
+		f'{plan["n_voltages"]} voltages × {plan["n_positions"]} positions, {plan["n_waveforms"]} waveforms',
+		f'Measuring time: {plan["Measuring time (s)"]/3600:.1f} h, until the last compression finishes: {plan["Total time (s)"]/3600:.1f} h',
+		f'Waveforms: {_human_bytes(plan["Waveform bytes"])}, compressed: {_human_bytes(plan["Compressed bytes"])}, parsed and others: {_human_bytes(plan["Parsed bytes"])}',
+		f'Disk: {_human_bytes(plan["Peak bytes"])} at peak, {_human_bytes(plan["Final bytes"])} at the end, {_human_bytes(plan["Free bytes"])} free of which {_human_bytes(plan["Usable bytes"])} usable',
+	]
+	lines += [f'Warning: {warning}' for warning in plan['Warnings']]
+	lines.append('It fits.' if plan['Fits'] else 'IT DOES NOT FIT.')
+	return '\n'.join(lines)
+
+if __name__ == '__main__':
+	import argparse
+	import sys
+
+	logging.basicConfig(
+		stream = sys.stderr,
+		level = logging.INFO,
+		format = '%(asctime)s|%(levelname)s|%(funcName)s|%(message)s',
+		datefmt = '%Y-%m-%d %H:%M:%S',
+	)
+
+	parser = argparse.ArgumentParser(description='Estimate the duration and disk usage of the 2D scan in `CONFIG_2D_SCAN` before starting it.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory, where the previous scans are and where the new one will be written.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument('--max-hours',
+		metavar = 'hours',
+		help = 'Maximum duration of the scan, if any.',
+		default = None,
+		dest = 'max_hours',
+		type = float,
+	)
+	parser.add_argument('--n-scans',
+		metavar = 'N',
+		help = 'Number of the most recent scans used to estimate the costs.',
+		default = 20,
+		dest = 'n_scans',
+		type = int,
+	)
+
+	args = parser.parse_args()
+
+	from configuration_files.scans_configs import CONFIG_2D_SCAN
+
+	costs = measure_costs_of_previous_scans(Path(args.directory), n_most_recent=args.n_scans)
+	logging.info(f'Costs estimated from {len(costs)} previous scans.')
+	free_bytes = shutil.disk_usage(args.directory).free
+	plan = plan_2D_scan(CONFIG_2D_SCAN, costs, free_bytes, args.max_hours)
+	print(format_plan(plan))
+	if not plan['Fits']:
+		suggestions = suggest_changes(CONFIG_2D_SCAN, costs, free_bytes, args.max_hours)
+		if len(suggestions) == 0:
+			print('No single change makes it fit.')
+		for description, changes, suggested_plan in suggestions:
+			print(f'It would fit with {description}: {suggested_plan["Total time (s)"]/3600:.1f} h, {_human_bytes(suggested_plan["Peak bytes"])} at peak.')
+		sys.exit(1)
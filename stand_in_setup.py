@@ -0,0 +1,189 @@
+"""A stand-in for `TheTCTSetupWithNamedLocks` without any hardware, to
+use `TheSetupServer` and its clients without the setup, e.g. in
+`benchmark_setup_client.py --fake`. Executing this file starts and
+restarts servers with the stand-in to check that the clients reconnect,
+that the calls in flight are sent again or fail as they should, that
+the named locks are kept across a restart of the server and, without
+restarting it, after their lease expires unless someone else wants them,
+and that the server stops. The exit code is 1 if any check fails."""
+
+from TheSetup import TheSetupServer, SetupClient, SetupProxy, NamedLockLostError
+from named_locks import FairNamedLock
+import threading
+import socket
+import time
+
+class StandInSetup:
+	"""Some of the methods of `TheTCTSetupWithNamedLocks`, with the same
+	arguments and named locks, where each command takes `seconds_per_command`."""
+	def __init__(self, seconds_per_command:float=0):
+		self.seconds_per_command = seconds_per_command
+		self._position = (0,0,0)
+		self._laser_DAC = 0
+		self._tct_holding_Lock = FairNamedLock('tct')
+		self._named_locks = {lock.name: lock for lock in [FairNamedLock('bias'), FairNamedLock('signal_acquisition'), self._tct_holding_Lock, FairNamedLock('temperature')]}
+
+	def get_stages_position(self)->tuple:
+		time.sleep(self.seconds_per_command)
+		return self._position
+
+	def move_to(self, who:str, x:float=None, y:float=None, z:float=None)->None:
+		with self._tct_holding_Lock(who):
+			time.sleep(self.seconds_per_command)
+			self._position = tuple(new if new is not None else old for old,new in zip(self._position, (x,y,z)))
+
+	def get_laser_DAC(self)->int:
+		time.sleep(self.seconds_per_command)
+		return self._laser_DAC
+
+	def set_laser_DAC(self, DAC:int, who:str)->None:
+		with self._tct_holding_Lock(who):
+			time.sleep(self.seconds_per_command)
+			self._laser_DAC = DAC
+
+	def measure_temperature(self)->float:
+		time.sleep(self.seconds_per_command)
+		return 20.
+
+	def measure_humidity(self)->float:
+		time.sleep(self.seconds_per_command)
+		return 40.
+
+	def get_named_locks_status(self)->dict:
+		return {name: lock.status() for name,lock in self._named_locks.items()}
+
+	def get_named_locks_contention(self)->dict:
+		return {name: lock.contention() for name,lock in self._named_locks.items()}
+
+class _StandInServer:
+	"""A `TheSetupServer` with a new `StandInSetup` in a thread, as if
+	the server of the setup had just been started."""
+	def __init__(self, address:tuple, seconds_per_command:float):
+		self.the_setup = StandInSetup(seconds_per_command=seconds_per_command)
+		self.server = TheSetupServer(self.the_setup, address=address, telemetry_periods_seconds={'measure_temperature': .1}, named_lock_lease_seconds=2)
+		self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+		self.thread.start()
+		time.sleep(.5) # Let it start.
+
+	def stop(self, timeout:float=5)->bool:
+		"""Stop it and return whether it did within `timeout`."""
+		self.server.stop()
+		self.thread.join(timeout=timeout)
+		return not self.thread.is_alive()
+
+def _is_listening(address:tuple)->bool:
+	try:
+		socket.create_connection(address, timeout=1).close()
+	except OSError:
+		return False
+	return True
+
+def _call_in_a_thread(function)->dict:
+	"""Call `function()` in a thread, the returned dict gets either the
+	`'result'` or the `'exception'` when it finishes."""
+	outcome = {}
+	def call():
+		try:
+			outcome['result'] = function()
+		except Exception as e:
+			outcome['exception'] = e
+	outcome['thread'] = threading.Thread(target=call, daemon=True)
+	outcome['thread'].start()
+	return outcome
+
+def check_restarts(address:tuple, seconds_per_command:float=1)->dict:
+	"""Restart a server with the stand-in while a client is using it and
+	return `{check: passed}`."""
+	checks = {}
+	server = _StandInServer(address, seconds_per_command=seconds_per_command)
+	client = SetupClient(address=address, heartbeat_seconds=.5)
+	scan = SetupProxy(client, who='stand_in_setup.py scan')
+	other = SetupProxy(client, who='stand_in_setup.py other')
+
+	checks['calls the methods of the stand-in'] = scan.move_to(x=1) is None and scan.get_stages_position() == (1,0,0)
+
+	reading = _call_in_a_thread(lambda: scan.get_stages_position())
+	moving = _call_in_a_thread(lambda: scan.set_laser_DAC(DAC=600))
+	time.sleep(seconds_per_command/2) # Now both are being executed.
+	checks['stops with calls in flight'] = server.stop()
+	checks['stops listening when stopped'] = not _is_listening(address)
+	server = _StandInServer(address, seconds_per_command=seconds_per_command)
+	reading['thread'].join(timeout=10+seconds_per_command)
+	moving['thread'].join(timeout=10+seconds_per_command)
+	checks['sends again the idempotent calls'] = reading.get('result') == (0,0,0) # A new stand-in.
+	checks['fails the non idempotent calls'] = isinstance(moving.get('exception'), ConnectionError)
+	checks['reconnects'] = scan.get_laser_DAC() == 0 and client.get_telemetry('measure_temperature', max_age_seconds=1) == 20.
+
+	with scan.hold_tct_control():
+		server.stop()
+		server = _StandInServer(address, seconds_per_command=seconds_per_command)
+		time.sleep(2) # A few heartbeats.
+		checks['keeps the named locks across a restart'] = server.the_setup.get_named_locks_status()['tct']['holder'] == 'stand_in_setup.py scan'
+		try:
+			other.move_to(x=2, timeout=seconds_per_command)
+		except TimeoutError:
+			checks['nobody else gets them meanwhile'] = True
+		else:
+			checks['nobody else gets them meanwhile'] = False
+		scan.move_to(x=3)
+	checks['releases them afterwards'] = server.the_setup.get_named_locks_status()['tct']['holder'] is None and other.move_to(x=2) is None
+
+	client.close()
+	checks['stops'] = server.stop()
+	return checks
+
+def check_expired_leases(address:tuple)->dict:
+	"""Hold a named lock with a client whose heartbeats come later than
+	the lease, as if it was cut off for a while, and return `{check: passed}`."""
+	checks = {}
+	server = _StandInServer(address, seconds_per_command=0)
+	late_client = SetupClient(address=address, heartbeat_seconds=3*server.server.named_lock_lease_seconds)
+	client = SetupClient(address=address, heartbeat_seconds=.5)
+	scan = SetupProxy(late_client, who='stand_in_setup.py scan')
+	other = SetupProxy(client, who='stand_in_setup.py other')
+
+	try:
+		with scan.hold_tct_control():
+			for _ in range(int(server.server.named_lock_lease_seconds*4)):
+				time.sleep(1) # Long after the lease expired, waiting also for a heartbeat of `late_client`.
+				other.get_named_locks_status() # Like the telemetry does.
+			checks['keeps it after the lease expires if nobody waits'] = scan.move_to(x=1) is None and server.the_setup.get_named_locks_status()['tct']['holder'] == 'stand_in_setup.py scan'
+	except NamedLockLostError:
+		checks['keeps it after the lease expires if nobody waits'] = False
+	checks['releases it afterwards'] = server.the_setup.get_named_locks_status()['tct']['holder'] is None
+
+	lost = None
+	try:
+		with scan.hold_tct_control():
+			checks['someone waiting gets it when the lease expires'] = other.move_to(x=2, timeout=3*server.server.named_lock_lease_seconds) is None
+			time.sleep(3*server.server.named_lock_lease_seconds) # For a heartbeat of `late_client`.
+	except NamedLockLostError as e:
+		lost = e
+	checks['the holder knows it lost it'] = lost is not None
+
+	late_client.close()
+	client.close()
+	checks['stops'] = server.stop()
+	return checks
+
+if __name__ == '__main__':
+	import argparse
+	import logging
+	import sys
+
+	parser = argparse.ArgumentParser(description='Check that the clients of the setup server survive its restarts, using a stand-in without hardware.')
+	parser.add_argument('--port',
+		help = 'Port for the servers with the stand-in, it must be free.',
+		default = 50129,
+		dest = 'port',
+		type = int,
+	)
+	args = parser.parse_args()
+	logging.basicConfig(level=logging.ERROR)
+
+	everything_fine = True
+	for checks in [check_restarts, check_expired_leases]:
+		for check,passed in checks(('localhost', args.port)).items():
+			print(f'{"OK" if passed else "FAILED":<8}{check}')
+			everything_fine &= passed
+	sys.exit(0 if everything_fine else 1)
@@ -23,7 +23,7 @@ def temperature_controller(set_point_celsius:float, the_setup, temperature_toler
 			the_setup.set_peltier_status('on')
 			start_time = time.time()
 			while True:
-				T = the_setup.measure_temperature()
+				T = the_setup.get_telemetry('measure_temperature', max_age_seconds=5*PID_SAMPLE_TIME) # Sampled by the setup server, see `TELEMETRY_PERIODS_SECONDS`.
 				new_current = temperature_pid(T)
 				the_setup.set_peltier_current(new_current)
 				time.sleep(PID_SAMPLE_TIME)
@@ -42,10 +42,10 @@ def temperature_controller(set_point_celsius:float, the_setup, temperature_toler
 			the_setup.set_peltier_status('off')
 
 def monitor_temperature_control(the_setup):
-	s = the_setup
+	s = the_setup.get_telemetry
 
 	while True:
-		print(f'{s.measure_temperature():.2f} °C, {s.measure_humidity():.2f} %RH | {s.measure_peltier_current():.2f} A, {s.measure_peltier_voltage():.2f} V, {s.measure_peltier_current()*s.measure_peltier_voltage():.2f} W, {s.get_peltier_status()}')
+		print(f'{s("measure_temperature"):.2f} °C, {s("measure_humidity"):.2f} %RH | {s("measure_peltier_current"):.2f} A, {s("measure_peltier_voltage"):.2f} V, {s("measure_peltier_current")*s("measure_peltier_voltage"):.2f} W, {s("get_peltier_status")}')
 		time.sleep(1)
 
 if __name__=='__main__':
@@ -0,0 +1,169 @@
+from pathlib import Path
+import pandas
+import numpy
+import json
+import shutil
+import warnings
+
+PYRAMID_VERSION = 1 # Increase this whenever the format of the files changes.
+
+def _downsample_nanmedian(image:numpy.ndarray, factor:int)->numpy.ndarray:
+	"""Each pixel of the result is the median of a block of `factor`×`factor`
+	pixels of `image`, ignoring NaN."""
+	n_y, n_x = image.shape
+	padded = numpy.full((-(-n_y//factor)*factor, -(-n_x//factor)*factor), float('NaN'), dtype=image.dtype)
+	padded[:n_y,:n_x] = image
+	blocks = padded.reshape(padded.shape[0]//factor, factor, padded.shape[1]//factor, factor).transpose(0,2,1,3)
+	blocks = blocks.reshape(blocks.shape[0], blocks.shape[1], factor**2)
+	with warnings.catch_warnings():
+		warnings.simplefilter('ignore', RuntimeWarning) # Blocks with only NaN, i.e. not measured.
+		return numpy.nanmedian(blocks, axis=2).astype(image.dtype)
+
+def _path_to_tiles(path_to_pyramid:Path, column:str, n_channel:int, level:int)->Path:
+	return path_to_pyramid/column.replace('/','÷')/f'n_channel_{n_channel}'/f'level_{level}'
+
+def build_tile_pyramid(aggregated_data:pandas.DataFrame, columns:list, path_to_pyramid:Path, statistic:str='nanmedian', tile_size:int=256):
+	"""Build a multi resolution pyramid of tiles with the maps of a 2D scan,
+	so that very large maps can be displayed by loading only the tiles
+	visible at the current zoom, see `load_region`.
+
+	Level 0 has one pixel per position. In level `L` each pixel is the
+	median of a block of `2**L`×`2**L` pixels of level 0. The top level
+	fits in a single tile. Each tile is stored as a float32 `.npy` file,
+	tiles with no data at all are not stored.
+
+	Arguments
+	---------
+	aggregated_data: pandas.DataFrame
+		Indexed by `n_position` and `n_channel`, with the columns `n_x`,
+		`n_y` and `'{column} {statistic}'` for each of the `columns`.
+	columns: list of str
+		The variables to include, e.g. `['Amplitude (V)','t_50 (s)']`.
+	path_to_pyramid: Path
+		Path to the directory where to store the pyramid. If it already
+		exists it is replaced.
+	statistic: str, default `'nanmedian'`
+		The statistic to use, see `utils.aggregate_parsed_data`.
+	tile_size: int, default 256
+		Number of pixels along each side of the tiles.
+	"""
+	path_to_pyramid = Path(path_to_pyramid)
+	if path_to_pyramid.exists():
+		shutil.rmtree(path_to_pyramid)
+	path_to_pyramid.mkdir(parents=True)
+
+	shape = (int(aggregated_data['n_y'].max())+1, int(aggregated_data['n_x'].max())+1)
+	n_levels = 1 + max(0, int(numpy.ceil(numpy.log2(max(shape)/tile_size))))
+	channels = sorted(int(_) for _ in aggregated_data.index.get_level_values('n_channel').unique())
+
+	for col in columns:
+		for n_channel in channels:
+			this_channel = aggregated_data.xs(n_channel, level='n_channel')
+			image = numpy.full(shape, float('NaN'), dtype=numpy.float32)
+			image[this_channel['n_y'].astype(int), this_channel['n_x'].astype(int)] = this_channel[f'{col} {statistic}']
+			for level in range(n_levels):
+				downsampled = image if level == 0 else _downsample_nanmedian(image, 2**level)
+				path_to_tiles = _path_to_tiles(path_to_pyramid, col, n_channel, level)
+				path_to_tiles.mkdir(parents=True)
+				for n_tile_y in range(int(numpy.ceil(downsampled.shape[0]/tile_size))):
+					for n_tile_x in range(int(numpy.ceil(downsampled.shape[1]/tile_size))):
+						tile = downsampled[n_tile_y*tile_size:(n_tile_y+1)*tile_size, n_tile_x*tile_size:(n_tile_x+1)*tile_size]
+						if numpy.isnan(tile).all():
+							continue
+						numpy.save(path_to_tiles/f'{n_tile_y}_{n_tile_x}.npy', tile)
+
+	with open(path_to_pyramid/'pyramid.json', 'w') as ofile:
+		json.dump(
+			{
+				'PYRAMID_VERSION': PYRAMID_VERSION,
+				'statistic': statistic,
+				'tile_size': tile_size,
+				'shape': shape,
+				'n_levels': n_levels,
+				'columns': columns,
+				'channels': channels,
+			},
+			ofile,
+			indent = '\t',
+		)
+
+def load_region(path_to_pyramid:Path, column:str, n_channel:int, n_x_range:tuple=None, n_y_range:tuple=None, max_pixels_per_axis:int=1000)->pandas.DataFrame:
+	"""Load a region of a map from a pyramid produced by `build_tile_pyramid`,
+	at the finest level that has at most `max_pixels_per_axis` pixels
+	along each axis (or the coarsest level, if none has), reading only
+	the tiles that overlap the region.
+
+	Arguments
+	---------
+	path_to_pyramid: Path
+		Path to the directory with the pyramid.
+	column: str
+		The variable, e.g. `'Amplitude (V)'`.
+	n_channel: int
+		The channel.
+	n_x_range, n_y_range: tuple of int, optional
+		The region to load as `(start, stop)`, with `stop` excluded, in
+		units of `n_x` and `n_y`. Default is the whole map.
+	max_pixels_per_axis: int, default 1000
+		Maximum number of pixels along each axis of the result.
+
+	Returns
+	-------
+	image: pandas.DataFrame
+		The map, with `n_y` as index and `n_x` as columns, where each
+		pixel is labeled with the `n_x` and `n_y` of the first position
+		of the block it represents. Can be directly given to `px.imshow`.
+	"""
+	path_to_pyramid = Path(path_to_pyramid)
+	with open(path_to_pyramid/'pyramid.json', 'r') as ifile:
+		metadata = json.load(ifile)
+	if metadata['PYRAMID_VERSION'] != PYRAMID_VERSION:
+		raise RuntimeError(f'The pyramid in {path_to_pyramid} was produced with `PYRAMID_VERSION={metadata["PYRAMID_VERSION"]}` but current version is {PYRAMID_VERSION}, please build it again.')
+	tile_size = metadata['tile_size']
+	n_x_range = n_x_range if n_x_range is not None else (0, metadata['shape'][1])
+	n_y_range = n_y_range if n_y_range is not None else (0, metadata['shape'][0])
+
+	level = 0
+	while level < metadata['n_levels']-1 and max(n_x_range[1]-n_x_range[0], n_y_range[1]-n_y_range[0]) > max_pixels_per_axis*2**level:
+		level += 1
+	factor = 2**level
+	x_start, x_stop = n_x_range[0]//factor, -(-n_x_range[1]//factor)
+	y_start, y_stop = n_y_range[0]//factor, -(-n_y_range[1]//factor)
+
+	image = numpy.full((y_stop-y_start, x_stop-x_start), float('NaN'), dtype=numpy.float32)
+	path_to_tiles = _path_to_tiles(path_to_pyramid, column, n_channel, level)
+	for n_tile_y in range(y_start//tile_size, -(-y_stop//tile_size)):
+		for n_tile_x in range(x_start//tile_size, -(-x_stop//tile_size)):
+			path_to_tile = path_to_tiles/f'{n_tile_y}_{n_tile_x}.npy'
+			if not path_to_tile.is_file():
+				continue
+			tile = numpy.load(path_to_tile)
+			# Intersection of the tile with the region, in pixels of this level:
+			y0, y1 = max(y_start, n_tile_y*tile_size), min(y_stop, n_tile_y*tile_size+tile.shape[0])
+			x0, x1 = max(x_start, n_tile_x*tile_size), min(x_stop, n_tile_x*tile_size+tile.shape[1])
+			if y1 <= y0 or x1 <= x0:
+				continue
+			image[y0-y_start:y1-y_start, x0-x_start:x1-x_start] = tile[y0-n_tile_y*tile_size:y1-n_tile_y*tile_size, x0-n_tile_x*tile_size:x1-n_tile_x*tile_size]
+
+	return pandas.DataFrame(
+		image,
+		index = pandas.Index(numpy.arange(y_start, y_stop)*factor, name='n_y'),
+		columns = pandas.Index(numpy.arange(x_start, x_stop)*factor, name='n_x'),
+	)
+
+def plot_region(path_to_pyramid:Path, column:str, n_channel:int, n_x_range:tuple=None, n_y_range:tuple=None, max_pixels_per_axis:int=1000, title:str=None):
+	"""Plot a region of a map from a pyramid produced by `build_tile_pyramid`
+	using `load_region`, so the figure never has more than `max_pixels_per_axis`
+	pixels along each side no matter how large the map is. For the arguments
+	see `load_region`. Returns a plotly figure."""
+	import plotly.express as px # Only here, so building and loading tiles does not need to import `plotly`.
+	
+	image = load_region(path_to_pyramid, column, n_channel, n_x_range, n_y_range, max_pixels_per_axis)
+	fig = px.imshow(
+		title = title if title is not None else f'{column} vs n_x,n_y, n_channel={n_channel}',
+		img = image,
+		aspect = 'equal',
+		origin = 'lower',
+	)
+	fig.update_coloraxes(colorbar_title_side='right', colorbar_title=column)
+	return fig
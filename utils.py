@@ -1,15 +1,14 @@
 import datetime
 import time
-from scipy.stats import median_abs_deviation
 import sqlite3
 import pandas
 from pathlib import Path
-from huge_dataframe.SQLiteDataFrame import load_only_index_without_repeated_entries, SQLiteDataFrameDumper # https://github.com/SengerM/huge_dataframe
-from signals.PeakSignal import PeakSignal, compress_PeakSignal_V230507, decompress_PeakSignal_V230507 # https://github.com/SengerM/signals
+from huge_dataframe.SQLiteDataFrame import load_only_index_without_repeated_entries, SQLiteDataFrameDumper, load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 import pickle
 import zipfile
 import logging
 import numpy
+from quantile_sketches import grouped_kMAD
 
 def create_a_timestamp():
 	logging.info('Creating a timestamp, sleeping 1 second to ensure no two timestamps are identical...')
@@ -34,9 +33,215 @@ def kMAD(x,nan_policy='omit'):
 	"""Calculates the median absolute deviation multiplied by 1.4826... 
 	which should converge to the standard deviation for Gaussian distributions,
 	but is much more robust to outliers than the std."""
+	from scipy.stats import median_abs_deviation # Imported here because `scipy` takes long to import and this module is imported everywhere.
 	k_MAD_TO_STD = 1.4826 # https://en.wikipedia.org/wiki/Median_absolute_deviation#Relation_to_standard_deviation
 	return k_MAD_TO_STD*median_abs_deviation(x,nan_policy=nan_policy)
 
+AGGREGATION_QUANTILES = [.1,.25,.75,.9]
+
+def grouped_kMAD_dataframe(data:pandas.DataFrame, grouped)->pandas.DataFrame:
+	"""Same as `grouped.agg(kMAD)` where `grouped = data.groupby(...)`, 
+	but vectorized for all the groups at once, which is much faster when
+	there are many small groups."""
+	group_codes = grouped.ngroup().to_numpy()
+	n_groups = grouped.ngroups
+	result = pandas.DataFrame(
+		{col: grouped_kMAD(data[col].to_numpy(), group_codes, n_groups) for col in data.columns},
+		index = grouped.size().index,
+	)
+	return result
+
+def aggregate_parsed_data(parsed_data:pandas.DataFrame, by:list=['n_position','n_channel','n_pulse'])->pandas.DataFrame:
+	"""Compute summary statistics of the parsed data, for each of its
+	numeric columns, grouping by `by`. The resulting columns are named
+	`'{column} {statistic}'` with statistic one of `count`, `nanmedian`,
+	`kMAD`, `mean`, `std` and `q10`, `q25`, ... for the quantiles in
+	`AGGREGATION_QUANTILES`."""
+	parsed_data = parsed_data.select_dtypes(include='number')
+	grouped = parsed_data.groupby(by, observed=True)
+	aggregated = {
+		'count': grouped.count(),
+		'nanmedian': grouped.median(),
+		'kMAD': grouped_kMAD_dataframe(parsed_data, grouped),
+		'mean': grouped.mean(),
+		'std': grouped.std(),
+	}
+	for q in AGGREGATION_QUANTILES:
+		aggregated[f'q{q*100:.0f}'] = grouped.quantile(q)
+	aggregated = pandas.concat(aggregated, axis=1)
+	aggregated.columns = [f'{col} {statistic}' for statistic,col in aggregated.columns]
+	return aggregated
+
+def load_aggregated_per_position(location:Path):
+	"""Load the data aggregated per position by `TCT_1D_scan` while it
+	was acquiring, see `aggregate_parsed_data`. Returns `None` if there
+	is no such data in `location`, e.g. for scans older than this feature."""
+	path_to_file = Path(location)/'aggregated_per_position.sqlite'
+	if not path_to_file.is_file():
+		return None
+	return load_whole_dataframe(path_to_file)
+
+PARSED_DATA_INDEX_COLUMNS = ['n_waveform','n_position','n_trigger','n_channel','n_pulse']
+
+PARSER_VERSION = 1 # Increase this whenever `parse_waveforms.parse_waveform` changes, so the waveforms are parsed again and cached results derived from parsed data are recomputed.
+
+def save_parser_version(location:Path):
+	"""Record in `location` that the parsed data in it was produced with
+	the current `PARSER_VERSION`, see `load_parser_version`."""
+	with open(Path(location)/'parser_version.txt', 'w') as ofile:
+		print(PARSER_VERSION, file=ofile)
+
+def load_parser_version(location:Path)->int:
+	"""The `PARSER_VERSION` the parsed data in `location` was produced
+	with. Parsed data from before this was recorded is version 1."""
+	path_to_file = Path(location)/'parser_version.txt'
+	if not path_to_file.is_file():
+		return 1
+	with open(path_to_file, 'r') as ifile:
+		return int(ifile.read())
+
+def aggregate_parsed_data_in_chunks(path_to_parsed_data:Path, path_to_measured_data:Path=None, chunksize:int=100000, columns:list=None)->pandas.DataFrame:
+	"""Same as `aggregate_parsed_data(load_whole_dataframe(path_to_parsed_data))`
+	but reading the data in chunks of `chunksize` rows in `n_position`
+	order, so the memory needed is bounded by `chunksize` and not by the
+	size of the scan.
+	
+	Arguments
+	---------
+	path_to_parsed_data: Path
+		Path to a `parsed_from_waveforms.sqlite` file.
+	path_to_measured_data: Path, optional
+		Path to a `measured_data.sqlite` file. If given, its numeric 
+		columns are joined to the aggregated data, one chunk of positions
+		at a time.
+	chunksize: int, default 100000
+		Number of rows to read each time.
+	columns: list of str, optional
+		Aggregate only these columns. Default is all of them.
+	
+	Returns
+	-------
+	aggregated: pandas.DataFrame
+		The aggregated data, indexed by `n_position`, `n_channel` and `n_pulse`.
+	"""
+	parsed_data_connection = sqlite3.connect(path_to_parsed_data)
+	measured_data_connection = sqlite3.connect(path_to_measured_data) if path_to_measured_data is not None else None
+	
+	def aggregate_and_join(parsed_data):
+		aggregated = aggregate_parsed_data(parsed_data)
+		if measured_data_connection is None:
+			return aggregated
+		n_positions = aggregated.index.get_level_values('n_position')
+		measured_data = pandas.read_sql(
+			f'SELECT * FROM dataframe_table WHERE n_position BETWEEN {n_positions.min()} AND {n_positions.max()}',
+			con = measured_data_connection,
+		).set_index('n_position').select_dtypes(include='number')
+		return aggregated.reset_index(drop=False).merge(measured_data.reset_index(drop=False), on='n_position', how='left').set_index(['n_position','n_channel','n_pulse'])
+	
+	aggregated = []
+	rows_from_unfinished_position = None
+	if columns is None:
+		select_these = '*'
+	else:
+		index_columns = [col for col in PARSED_DATA_INDEX_COLUMNS if col in pandas.read_sql('SELECT * FROM dataframe_table LIMIT 1', parsed_data_connection).columns]
+		select_these = ','.join([f'`{col}`' for col in index_columns + [col for col in columns if col not in index_columns]])
+	for chunk in pandas.read_sql(f'SELECT {select_these} FROM dataframe_table ORDER BY n_position', con=parsed_data_connection, chunksize=chunksize):
+		chunk = chunk.set_index([col for col in PARSED_DATA_INDEX_COLUMNS if col in chunk.columns])
+		if rows_from_unfinished_position is not None:
+			chunk = pandas.concat([rows_from_unfinished_position, chunk])
+		last_n_position = chunk.index.get_level_values('n_position').max()
+		is_last_position = chunk.index.get_level_values('n_position') == last_n_position
+		rows_from_unfinished_position = chunk.loc[is_last_position] # This position may continue in the next chunk.
+		if (~is_last_position).any():
+			aggregated.append(aggregate_and_join(chunk.loc[~is_last_position]))
+	if rows_from_unfinished_position is not None and len(rows_from_unfinished_position) > 0:
+		aggregated.append(aggregate_and_join(rows_from_unfinished_position))
+	parsed_data_connection.close()
+	if measured_data_connection is not None:
+		measured_data_connection.close()
+	return pandas.concat(aggregated)
+
+COMPACT_INDEX_DTYPES = {
+	'n_waveform': 'uint32',
+	'n_position': 'uint32',
+	'n_trigger': 'uint32',
+	'n_channel': 'category',
+	'n_pulse': 'category',
+}
+
+def compact_parsed_data(parsed_data:pandas.DataFrame)->pandas.DataFrame:
+	"""Convert parsed data into a compact schema: small integer types for
+	the index, `category` for `n_channel` and `n_pulse` and `float32` for
+	the features. This is about half the memory. `float32` has a relative
+	precision of 6e-8, which for the timing columns means an error below
+	10 fs for times up to 140 ns, see `float32_precision_loss_report`."""
+	index_names = [name for name in parsed_data.index.names if name is not None]
+	parsed_data = parsed_data.reset_index(drop=len(index_names)==0)
+	for col in parsed_data.columns:
+		if col in COMPACT_INDEX_DTYPES:
+			parsed_data[col] = parsed_data[col].astype(COMPACT_INDEX_DTYPES[col])
+		elif parsed_data[col].dtype == 'float64':
+			parsed_data[col] = parsed_data[col].astype('float32')
+	if len(index_names) > 0:
+		parsed_data = parsed_data.set_index(index_names)
+	return parsed_data
+
+def load_parsed_data(path_to_file:Path, columns:list=None, compact:bool=True, chunksize:int=100000)->pandas.DataFrame:
+	"""Load a `parsed_from_waveforms.sqlite` file.
+	
+	Arguments
+	---------
+	path_to_file: Path
+		Path to the file.
+	columns: list of str, optional
+		Load only these columns, besides the index. Default is all the columns.
+	compact: bool, default True
+		If `True` the data is converted with `compact_parsed_data` one
+		chunk at a time, so the full size frame is never in memory.
+	chunksize: int, default 100000
+		Number of rows to read each time.
+	"""
+	with sqlite3.connect(path_to_file) as connection:
+		all_columns = pandas.read_sql('SELECT * FROM dataframe_table LIMIT 1', connection).columns
+		index_columns = [col for col in PARSED_DATA_INDEX_COLUMNS if col in all_columns]
+		if columns is not None:
+			columns = [col for col in columns if col not in index_columns]
+		select_these = '*' if columns is None else ','.join([f'`{col}`' for col in index_columns + columns])
+		data = []
+		for chunk in pandas.read_sql(f'SELECT {select_these} FROM dataframe_table', con=connection, chunksize=chunksize):
+			chunk = chunk.set_index(index_columns)
+			data.append(compact_parsed_data(chunk) if compact else chunk)
+	if len(data) == 0:
+		return pandas.DataFrame()
+	data = pandas.concat(data)
+	if compact: # `concat` drops the categories if they differ between chunks.
+		data = compact_parsed_data(data)
+	return data
+
+def float32_precision_loss_report(parsed_data:pandas.DataFrame, columns:list=None)->pandas.DataFrame:
+	"""Measure the precision lost by storing each column as `float32`
+	instead of `float64`. Returns a data frame with one row per column
+	with the maximum and median absolute error and the maximum relative
+	error. By default the timing columns, i.e. those in seconds, are used."""
+	if columns is None:
+		columns = [col for col in parsed_data.columns if col.endswith('(s)')]
+	report = []
+	for col in columns:
+		values = parsed_data[col].to_numpy(dtype=float)
+		values = values[~numpy.isnan(values)]
+		absolute_error = numpy.abs(values.astype('float32').astype(float) - values)
+		with numpy.errstate(divide='ignore', invalid='ignore'):
+			relative_error = absolute_error/numpy.abs(values)
+		report.append(
+			{
+				'Column': col,
+				'Max absolute error': absolute_error.max() if len(values) > 0 else float('NaN'),
+				'Median absolute error': numpy.median(absolute_error) if len(values) > 0 else float('NaN'),
+				'Max relative error': numpy.nanmax(relative_error[numpy.isfinite(relative_error)]) if numpy.isfinite(relative_error).any() else float('NaN'),
+			}
+		)
+	return pandas.DataFrame.from_records(report).set_index('Column')
+
 def interlace(lst):
 	# https://en.wikipedia.org/wiki/Interlacing_(bitmaps)
 	lst = sorted(lst)[::-1]
@@ -51,41 +256,96 @@ def interlace(lst):
 			ranges += (start, middle), (middle + 1, stop)
 	return result
 
+def load_digitizer_calibration(location:Path):
+	"""Load the calibration stored by `TCT_1D_scan` when the waveforms
+	were saved in ADC units. Returns a data frame indexed by `n_channel`
+	or `None` if there is no calibration file in `location`, which means
+	that the waveforms were stored in volts."""
+	path_to_file = Path(location)/'digitizer_calibration.pickle'
+	if not path_to_file.is_file():
+		return None
+	return pandas.read_pickle(path_to_file)
+
+def convert_waveforms_from_ADCu_to_volts(waveforms:pandas.DataFrame, calibration:pandas.DataFrame)->pandas.DataFrame:
+	"""Convert waveforms stored in ADC units, i.e. with columns `n_channel`,
+	`n_sample` and `Amplitude (ADCu)`, into a data frame with columns
+	`Time (s)` and `Amplitude (V)` using the calibration stored in the
+	run. If `waveforms` is already in volts it is returned unchanged."""
+	if 'Amplitude (ADCu)' not in waveforms.columns:
+		return waveforms
+	if calibration is None:
+		raise RuntimeError('Waveforms are in ADC units but no calibration was provided to convert them into volts.')
+	this_calibration = calibration.loc[waveforms['n_channel']]
+	converted = pandas.DataFrame(
+		{
+			'Time (s)': this_calibration['t_0 (s)'].to_numpy() + waveforms['n_sample'].to_numpy()*this_calibration['Sampling period (s)'].to_numpy(),
+			'Amplitude (V)': waveforms['Amplitude (ADCu)'].to_numpy()*this_calibration['Gain (V/ADCu)'].to_numpy() + this_calibration['Offset (V)'].to_numpy(),
+		},
+		index = waveforms.index,
+	)
+	return converted
+
+SECONDS_WITHOUT_PROGRESS_OF_A_COMPRESSION = 600
+
+def is_being_compressed(path_to_file:Path)->bool:
+	"""`True` if `compress_waveforms_sqlite` is compressing `path_to_file`
+	right now, i.e. its temporary files exist and were written within the
+	last `SECONDS_WITHOUT_PROGRESS_OF_A_COMPRESSION`. Temporary files
+	older than that were left behind by a compression that crashed."""
+	path_to_file = Path(path_to_file)
+	for p in [path_to_file.parent/'compressed_waveforms.pickle', path_to_file.parent/(path_to_file.stem + '.zip.tmp')]:
+		if p.is_file() and time.time() - p.stat().st_mtime < SECONDS_WITHOUT_PROGRESS_OF_A_COMPRESSION:
+			return True
+	return False
+
 def compress_waveforms_sqlite(path_to_file:Path):
 	"""Compress a `waveforms.sqlite` file which contains signals from
 	LGADs, PMTs, etc. The compression is almost lossless and compression 
-	rates range between 10 and 40 times smaller after compression."""
+	rates range between 10 and 40 times smaller after compression. The
+	`.zip` file appears only once it is complete, so if it exists the
+	compression finished, and whatever a compression that crashed left
+	behind is overwritten by the next one."""
+	from signals.PeakSignal import PeakSignal, compress_PeakSignal_V230507 # https://github.com/SengerM/signals
+	
+	path_to_file = Path(path_to_file)
 	waveforms_connection = sqlite3.connect(path_to_file)
-	waveforms_index = load_only_index_without_repeated_entries(Path(path_to_file))
+	waveforms_index = load_only_index_without_repeated_entries(path_to_file)
+	calibration = load_digitizer_calibration(path_to_file.parent)
 	
 	path_to_temporary_pickle_file = path_to_file.parent/'compressed_waveforms.pickle'
-	with zipfile.ZipFile(path_to_file.with_suffix('.zip'), 'w', zipfile.ZIP_DEFLATED) as myzip:
-		with open(path_to_temporary_pickle_file, 'a+b') as pickle_file:
-			n_waveforms_processed = 0
-			for idx, row in waveforms_index.iterrows():
-				waveform = pandas.read_sql(
-					sql = f"SELECT * from dataframe_table WHERE " + " AND ".join([f"{name} is {val}" for name,val in zip(waveforms_index.columns, row)]),
-					con = waveforms_connection,
-				)
-				signal = PeakSignal(
-					time = waveform['Time (s)'],
-					samples = waveform['Amplitude (V)'],
-				)
-				compressed_waveform = compress_PeakSignal_V230507(signal)
-				pickle.dump(
-					obj = compressed_waveform, 
-					file = pickle_file
-				)
-				n_waveforms_processed += 1
-				if n_waveforms_processed%999 == 0:
-					logging.info(f'{n_waveforms_processed} already processed.')
-		logging.info('Compressing further into a .zip file...')
-		myzip.write(path_to_temporary_pickle_file)
+	path_to_temporary_zip_file = path_to_file.parent/(path_to_file.stem + '.zip.tmp')
+	with open(path_to_temporary_pickle_file, 'wb') as pickle_file:
+		n_waveforms_processed = 0
+		for idx, row in waveforms_index.iterrows():
+			waveform = pandas.read_sql(
+				sql = f"SELECT * from dataframe_table WHERE " + " AND ".join([f"{name} is {val}" for name,val in zip(waveforms_index.columns, row)]),
+				con = waveforms_connection,
+			)
+			waveform = convert_waveforms_from_ADCu_to_volts(waveform, calibration)
+			signal = PeakSignal(
+				time = waveform['Time (s)'],
+				samples = waveform['Amplitude (V)'],
+			)
+			compressed_waveform = compress_PeakSignal_V230507(signal)
+			pickle.dump(
+				obj = compressed_waveform, 
+				file = pickle_file
+			)
+			n_waveforms_processed += 1
+			if n_waveforms_processed%999 == 0:
+				logging.info(f'{n_waveforms_processed} already processed.')
+	logging.info('Compressing further into a .zip file...')
+	with zipfile.ZipFile(path_to_temporary_zip_file, 'w', zipfile.ZIP_DEFLATED) as myzip:
+		myzip.write(path_to_temporary_pickle_file, path_to_temporary_pickle_file.name) # The name `decompress_waveforms_into_sqlite` looks for.
 		myzip.write(Path(__file__).resolve(), Path(__file__).parts[-1])
+		myzip.comment = str(path_to_file.stat().st_size).encode() # The bytes before compressing, see `scan_planner.measure_costs`.
+	path_to_temporary_zip_file.replace(path_to_file.with_suffix('.zip'))
 	path_to_temporary_pickle_file.unlink()
 
 def decompress_waveforms_into_sqlite(path_to_file:Path):
 	"""Decompress a file that was compressed with `compress_waveforms_sqlite`."""
+	from signals.PeakSignal import decompress_PeakSignal_V230507 # https://github.com/SengerM/signals
+	
 	path_to_temporary_pickle_file = path_to_file.with_suffix('.pickle')
 	with zipfile.ZipFile(path_to_file, 'r') as zip_file:
 		with open(path_to_temporary_pickle_file, 'wb') as pickle_file:
@@ -115,6 +375,78 @@ def decompress_waveforms_into_sqlite(path_to_file:Path):
 					break
 	path_to_temporary_pickle_file.unlink()
 
+def _n_waveforms_with_saved_waveform(path_to_parsed_data:Path)->numpy.ndarray:
+	"""Sorted `n_waveform` of all the waveforms that were saved in the
+	waveforms file, i.e. all of them unless zero suppression was used."""
+	with sqlite3.connect(path_to_parsed_data) as connection:
+		columns = pandas.read_sql('SELECT * FROM dataframe_table LIMIT 1', connection).columns
+		where = 'WHERE `Waveform saved`' if 'Waveform saved' in columns else ''
+		return pandas.read_sql(f'SELECT DISTINCT n_waveform FROM dataframe_table {where} ORDER BY n_waveform', connection)['n_waveform'].to_numpy()
+
+def load_waveforms(location:Path, n_waveforms:list)->pandas.DataFrame:
+	"""Load several waveforms at once from the waveforms file in `location`,
+	either `waveforms.sqlite` or, if it was already compressed with
+	`compress_waveforms_sqlite`, `waveforms.zip`.
+	
+	The `.sqlite` file is opened read only, the `n_waveform` requested
+	are put in a temporary table and all the waveforms are fetched in a
+	single query, which reads the file once. The `.zip` file is a sequential stream of compressed waveforms, so it is
+	read only up to the last one requested and only those are decompressed.
+	
+	Arguments
+	---------
+	location: Path
+		Path to the directory with the waveforms file, e.g. that of a
+		`TCT_1D_scan` task.
+	n_waveforms: list of int
+		The `n_waveform` of the waveforms to load.
+	
+	Returns
+	-------
+	waveforms: pandas.DataFrame
+		A data frame indexed by `n_waveform` with the columns `Time (s)`
+		and `Amplitude (V)`.
+	"""
+	location = Path(location)
+	n_waveforms = sorted({int(n) for n in n_waveforms})
+	if len(n_waveforms) == 0:
+		return pandas.DataFrame(columns=['Time (s)','Amplitude (V)'], index=pandas.Index([], name='n_waveform'))
+	if (location/'waveforms.sqlite').is_file():
+		with sqlite3.connect(f'{(location/"waveforms.sqlite").resolve().as_uri()}?mode=ro', uri=True) as connection: # Read only, it may be being written or in a read only place.
+			connection.execute('CREATE TEMP TABLE n_waveforms_to_load (n_waveform INTEGER PRIMARY KEY)')
+			connection.executemany('INSERT INTO n_waveforms_to_load VALUES (?)', [(n,) for n in n_waveforms])
+			waveforms = pandas.read_sql(
+				sql = 'SELECT dataframe_table.* FROM dataframe_table JOIN n_waveforms_to_load USING (n_waveform)',
+				con = connection,
+				index_col = 'n_waveform',
+			)
+		return convert_waveforms_from_ADCu_to_volts(waveforms, load_digitizer_calibration(location))
+	if (location/'waveforms.zip').is_file():
+		from signals.PeakSignal import decompress_PeakSignal_V230507 # https://github.com/SengerM/signals
+		
+		# The waveforms were compressed one after the other in order of `n_waveform`:
+		n_waveforms_in_file = _n_waveforms_with_saved_waveform(location/'parsed_from_waveforms.sqlite')
+		positions_in_file = {}
+		for n_waveform in n_waveforms:
+			position = int(numpy.searchsorted(n_waveforms_in_file, n_waveform))
+			if position < len(n_waveforms_in_file) and n_waveforms_in_file[position] == n_waveform:
+				positions_in_file[position] = n_waveform
+		waveforms = []
+		with zipfile.ZipFile(location/'waveforms.zip', 'r') as zip_file:
+			name = [_ for _ in zip_file.namelist() if _.endswith('compressed_waveforms.pickle')][0]
+			with zip_file.open(name, 'r') as pickle_file:
+				for position in range(max(positions_in_file, default=-1)+1):
+					compressed_waveform = pickle.load(pickle_file)
+					if position in positions_in_file:
+						signal = decompress_PeakSignal_V230507(compressed_waveform)
+						waveform = pandas.DataFrame({'Time (s)': signal.time, 'Amplitude (V)': signal.samples})
+						waveform['n_waveform'] = positions_in_file[position]
+						waveforms.append(waveform.set_index('n_waveform'))
+		if len(waveforms) == 0:
+			return pandas.DataFrame(columns=['Time (s)','Amplitude (V)'], index=pandas.Index([], name='n_waveform'))
+		return pandas.concat(waveforms)
+	raise FileNotFoundError(f'Cannot find neither `waveforms.sqlite` nor `waveforms.zip` in {location}. ')
+
 def save_dataframe(df, name:str, location:Path):
 	for extension,method in {'pickle':df.to_pickle,'csv':df.to_csv}.items():
 		method(location/f'{name}.{extension}')
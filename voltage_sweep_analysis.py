@@ -0,0 +1,193 @@
+from the_bureaucrat.bureaucrats import RunBureaucrat # https://github.com/SengerM/the_bureaucrat
+from pathlib import Path
+import pandas
+import sqlite3
+import logging
+import time
+import aggregates_cache
+from utils import integrate_distance_given_path
+
+SWEEP_TASKS = ['TCT_1D_scan_sweeping_bias_voltage','TCT_2D_scans_sweeping_bias_voltage']
+COLUMNS_TO_ANALYZE = ['Amplitude (V)','Collected charge (V s)','t_50 (s)']
+
+def _find_sweep_task(bureaucrat:RunBureaucrat)->str:
+	for task_name in SWEEP_TASKS:
+		if bureaucrat.path_to_directory_of_task(task_name).is_dir():
+			return task_name
+	raise RuntimeError(f'Run {repr(bureaucrat.run_name)} located in "{bureaucrat.path_to_run_directory}" has none of the tasks {SWEEP_TASKS}, it does not seem to be a voltage sweep.')
+
+def paths_to_TCT_1D_scans(bureaucrat:RunBureaucrat)->dict:
+	"""Find the `TCT_1D_scan` of each voltage of a sweep, for both kinds of
+	sweeps. Returns a dictionary of the form `{subrun_name: path}`, where
+	`path` is the directory of the `TCT_1D_scan` task. Voltages that are
+	still being set up, i.e. without `measured_data.sqlite` yet, are not included."""
+	sweep_task = _find_sweep_task(bureaucrat)
+	paths = {}
+	for subrun in bureaucrat.list_subruns_of_task(sweep_task):
+		if sweep_task == 'TCT_2D_scans_sweeping_bias_voltage':
+			if not subrun.path_to_directory_of_task('TCT_2D_scan').is_dir() or len(subrun.list_subruns_of_task('TCT_2D_scan')) != 1:
+				continue
+			path = subrun.list_subruns_of_task('TCT_2D_scan')[0].path_to_directory_of_task('TCT_1D_scan')
+		else:
+			path = subrun.path_to_directory_of_task('TCT_1D_scan')
+		if (path/'measured_data.sqlite').is_file():
+			paths[subrun.run_name] = path
+	return paths
+
+_measured_data_cache = {} # `{path_to_TCT_1D_scan: (key, measured_data)}`, see `_load_measured_data`.
+
+def _load_measured_data(path_to_TCT_1D_scan:Path)->pandas.DataFrame:
+	"""Load the positions and bias voltage from `measured_data.sqlite`. It
+	is read again only if the size or modification time of the file changed,
+	so the finished voltages are read only once by `follow_voltage_sweep`."""
+	path_to_file = path_to_TCT_1D_scan/'measured_data.sqlite'
+	key = (path_to_file.stat().st_size, path_to_file.stat().st_mtime_ns)
+	if path_to_TCT_1D_scan in _measured_data_cache and _measured_data_cache[path_to_TCT_1D_scan][0] == key:
+		return _measured_data_cache[path_to_TCT_1D_scan][1].copy()
+	with sqlite3.connect(path_to_file) as connection:
+		measured_data = pandas.read_sql('SELECT n_position, `x (m)`, `y (m)`, `z (m)`, `Bias voltage (V)` FROM dataframe_table', connection)
+	measured_data = measured_data.set_index('n_position')
+	_measured_data_cache[path_to_TCT_1D_scan] = (key, measured_data)
+	return measured_data.copy()
+
+def load_voltage_sweep_aggregates(bureaucrat:RunBureaucrat, columns:list=COLUMNS_TO_ANALYZE)->pandas.DataFrame:
+	"""Combine the per position aggregates of all the voltages of a
+	`TCT_1D_scan_sweeping_bias_voltage` or a `TCT_2D_scans_sweeping_bias_voltage`.
+	The aggregates of each voltage are computed only once and cached, see
+	`aggregates_cache.load_aggregated_columns`, so calling this while the
+	sweep is still running only reads again the voltage being measured.
+
+	Arguments
+	---------
+	bureaucrat: RunBureaucrat
+		The bureaucrat of the run with the sweep.
+	columns: list of str
+		Columns of the parsed data to include.
+
+	Returns
+	-------
+	aggregated: pandas.DataFrame
+		Indexed by `Bias voltage (V)`, `n_position`, `n_channel` and
+		`n_pulse`, with the columns `'{column} {statistic}'` (see
+		`utils.aggregate_parsed_data`) and the measured `x (m)`, `y (m)`,
+		`z (m)`, `Distance (m)` and `Bias voltage (V) measured` of each
+		position. `Bias voltage (V)` is the median of each voltage, rounded
+		to 1 V.
+	"""
+	aggregated = []
+	for subrun_name, path_to_TCT_1D_scan in paths_to_TCT_1D_scans(bureaucrat).items():
+		try:
+			this_voltage = aggregates_cache.load_aggregated_columns(path_to_TCT_1D_scan, columns)
+			measured_data = _load_measured_data(path_to_TCT_1D_scan)
+		except Exception as e: # Most likely nothing was written yet for this voltage.
+			logging.info(f'Skipping {subrun_name} because of {repr(e)}.')
+			continue
+		measured_data['Distance (m)'] = integrate_distance_given_path(list(measured_data[['x (m)','y (m)','z (m)']].to_numpy()))
+		measured_data.rename(columns={'Bias voltage (V)': 'Bias voltage (V) measured'}, inplace=True)
+		this_voltage = this_voltage.join(measured_data)
+		this_voltage['Bias voltage (V)'] = round(measured_data['Bias voltage (V) measured'].median())
+		aggregated.append(this_voltage.set_index('Bias voltage (V)', append=True).reorder_levels(['Bias voltage (V)','n_position','n_channel','n_pulse']))
+	if len(aggregated) == 0:
+		return None
+	return pandas.concat(aggregated).sort_index()
+
+def plot_voltage_sweep(bureaucrat:RunBureaucrat, columns:list=COLUMNS_TO_ANALYZE, drop_old_data:bool=True):
+	"""Produce plots of `columns` vs bias voltage, using `load_voltage_sweep_aggregates`.
+	For each voltage and channel the positions are summarized by the 90 %
+	quantile of the median of each position, which for a scan crossing the
+	device is a robust estimate of the value in the active area. For 1D
+	sweeps also each column vs distance is plotted, one line per voltage.
+	It can be used while the sweep is still running, see `follow_voltage_sweep`.
+	If not `drop_old_data` the plots are overwritten without deleting the
+	directory of the task first, so they are never missing while updating."""
+	import plotly.express as px
+	
+	with bureaucrat.handle_task('voltage_sweep_analysis', drop_old_data=drop_old_data) as employee:
+		aggregated = load_voltage_sweep_aggregates(bureaucrat, columns)
+		if aggregated is None:
+			logging.info(f'No data to plot in {bureaucrat.pseudopath} yet.')
+			return
+		aggregated.to_pickle(employee.path_to_directory_of_my_task/'aggregated.pickle')
+		voltages = aggregated.index.get_level_values('Bias voltage (V)').unique()
+		is_1D_sweep = _find_sweep_task(bureaucrat) == 'TCT_1D_scan_sweeping_bias_voltage'
+		for col in columns:
+			summary = aggregated[f'{col} nanmedian'].groupby(['Bias voltage (V)','n_channel','n_pulse']).quantile(.9).reset_index()
+			summary['n_channel'] = summary['n_channel'].astype(str)
+			fig = px.line(
+				data_frame = summary,
+				title = f'{col} vs bias voltage<br><sup>{bureaucrat.pseudopath}, {len(voltages)} voltages</sup>',
+				x = 'Bias voltage (V)',
+				y = f'{col} nanmedian',
+				color = 'n_channel',
+				line_dash = 'n_pulse',
+				markers = True,
+				labels = {f'{col} nanmedian': f'{col} (90 % quantile over positions)'},
+			)
+			fig.write_html(
+				employee.path_to_directory_of_my_task/f'{col} vs bias voltage.html',
+				include_plotlyjs = 'cdn',
+			)
+			if is_1D_sweep:
+				data = aggregated.reset_index().sort_values(['Bias voltage (V)','n_channel','n_pulse','Distance (m)'])
+				data['n_channel'] = data['n_channel'].astype(str)
+				fig = px.line(
+					data_frame = data,
+					title = f'{col} vs distance<br><sup>{bureaucrat.pseudopath}</sup>',
+					x = 'Distance (m)',
+					y = f'{col} nanmedian',
+					color = 'Bias voltage (V)',
+					line_dash = 'n_channel',
+					facet_row = 'n_pulse',
+					markers = True,
+					labels = {f'{col} nanmedian': col},
+				)
+				fig.write_html(
+					employee.path_to_directory_of_my_task/f'{col} vs distance.html',
+					include_plotlyjs = 'cdn',
+				)
+
+def follow_voltage_sweep(bureaucrat:RunBureaucrat, refresh_seconds:float=60, columns:list=COLUMNS_TO_ANALYZE):
+	"""Call `plot_voltage_sweep` every `refresh_seconds` while the sweep
+	is running, so the plots include each new voltage as soon as it has
+	data. Since the finished voltages are cached, each update only reads
+	the voltage being measured. Runs until interrupted with Ctrl+C."""
+	drop_old_data = True # Only the first time.
+	while True:
+		plot_voltage_sweep(bureaucrat, columns, drop_old_data=drop_old_data)
+		drop_old_data = False
+		time.sleep(refresh_seconds)
+
+if __name__ == '__main__':
+	import argparse
+	from plotly_utils import set_my_template_as_default
+	import sys
+
+	logging.basicConfig(
+		stream = sys.stderr,
+		level = logging.INFO,
+		format = '%(asctime)s|%(levelname)s|%(funcName)s|%(message)s',
+		datefmt = '%Y-%m-%d %H:%M:%S',
+	)
+
+	set_my_template_as_default()
+
+	parser = argparse.ArgumentParser(description='Analyze a sweep of bias voltage.')
+	parser.add_argument('--dir',
+		metavar = 'path',
+		help = 'Path to the base measurement directory.',
+		required = True,
+		dest = 'directory',
+		type = str,
+	)
+	parser.add_argument('--follow',
+		help = 'Keep updating the plots while the sweep is running.',
+		action = 'store_true',
+		dest = 'follow',
+	)
+
+	args = parser.parse_args()
+	bureaucrat = RunBureaucrat(Path(args.directory))
+	if args.follow:
+		follow_voltage_sweep(bureaucrat)
+	else:
+		plot_voltage_sweep(bureaucrat)
@@ -2,11 +2,12 @@ from the_bureaucrat.bureaucrats import RunBureaucrat, TaskBureaucrat # https://g
 from pathlib import Path
 import datetime
 import plotly.express as px
-from scan_1D import TCT_1D_scan, plot_parsed_data_from_TCT_1D_scan
+from scan_1D import TCT_1D_scan, plot_parsed_data_from_TCT_1D_scan, find_active_channels, evenly_spaced_positions
 import numpy
 from huge_dataframe.SQLiteDataFrame import load_whole_dataframe # https://github.com/SengerM/huge_dataframe
 import plotly_utils
 import logging
+from utils import load_aggregated_per_position, aggregate_parsed_data_in_chunks
 
 def create_list_of_positions_for_z_scan(scan_center:tuple, z_length:float, z_step:float):
 		z = scan_center[2] + numpy.linspace(-z_length/2, z_length/2, int(z_length/z_step))
@@ -14,20 +15,35 @@ def create_list_of_positions_for_z_scan(scan_center:tuple, z_length:float, z_ste
 		y = scan_center[1] + z*0
 		return [(xx,yy,zz) for xx,yy,zz in zip(x,y,z)]
 
-def z_scan_to_find_focus(bureaucrat:RunBureaucrat, scan_center:tuple, z_length:float, z_step:float, the_setup):
+def z_scan_to_find_focus(bureaucrat:RunBureaucrat, scan_center:tuple, z_length:float, z_step:float, the_setup, acquire_channels:list=None):
+	"""Perform a scan in z to find the focus of the laser. If `acquire_channels`
+	is `None` all the 16 channels are acquired, if `'auto'` the channels
+	with signal are found with `scan_1D.find_active_channels`, otherwise
+	only the given channels are acquired."""
 	bureaucrat.create_run(if_exists='skip')
 	
 	with bureaucrat.handle_task('z_scan_to_find_focus') as employee:
+		positions = create_list_of_positions_for_z_scan(
+			scan_center = scan_center,
+			z_length = z_length,
+			z_step = z_step,
+		)
+		if acquire_channels is None:
+			acquire_channels = list(range(16))
+		elif acquire_channels == 'auto':
+			logging.info('Looking for active channels...')
+			with the_setup.hold_signal_acquisition(), the_setup.hold_tct_control():
+				acquire_channels = find_active_channels(
+					the_setup = the_setup,
+					probe_positions = evenly_spaced_positions(positions),
+					save_probe_results_here = employee.path_to_directory_of_my_task,
+				)
 		subrun = employee.create_subrun(bureaucrat.run_name + '_TCT_1D_scan')
 		TCT_1D_scan(
 			bureaucrat = subrun,
 			the_setup = the_setup,
-			positions = create_list_of_positions_for_z_scan(
-				scan_center = scan_center,
-				z_length = z_length,
-				z_step = z_step,
-			),
-			acquire_channels = list(range(16)),
+			positions = positions,
+			acquire_channels = acquire_channels,
 			n_triggers_per_position = 11,
 			save_waveforms = False,
 		)
@@ -38,13 +54,19 @@ def plot_z_scan_to_find_focus(bureaucrat:RunBureaucrat):
 	bureaucrat.check_these_tasks_were_run_successfully('z_scan_to_find_focus')
 	
 	with bureaucrat.handle_task('plot_z_scan_to_find_focus') as employee:
-		data = load_whole_dataframe(bureaucrat.list_subruns_of_task('z_scan_to_find_focus')[0].path_to_directory_of_task('TCT_1D_scan')/'parsed_from_waveforms.sqlite')
-		position_data = load_whole_dataframe(bureaucrat.list_subruns_of_task('z_scan_to_find_focus')[0].path_to_directory_of_task('TCT_1D_scan')/'measured_data.sqlite')
+		path_to_TCT_1D_scan = bureaucrat.list_subruns_of_task('z_scan_to_find_focus')[0].path_to_directory_of_task('TCT_1D_scan')
+		position_data = load_whole_dataframe(path_to_TCT_1D_scan/'measured_data.sqlite')
 		position_data = position_data[[f'{_} (m)' for _ in ['x','y','z']]]
 		
-		data = data.groupby(['n_position','n_pulse','n_channel']).agg([('average',numpy.nanmedian),('fluctuations',numpy.nanstd)])
-		
-		data.columns = [' '.join(col) for col in data.columns]
+		data = load_aggregated_per_position(path_to_TCT_1D_scan)
+		if data is None: # This scan was done before the aggregation during acquisition existed.
+			data = aggregate_parsed_data_in_chunks(path_to_TCT_1D_scan/'parsed_from_waveforms.sqlite')
+		columns = [col[:-len(' nanmedian')] for col in data.columns if col.endswith(' nanmedian')]
+		for col in columns: # `std` is with `ddof=1`, the fluctuations are `nanstd`, i.e. with `ddof=0`.
+			count = data[f'{col} count']
+			data[f'{col} fluctuations'] = (data[f'{col} std']*((count-1)/count)**.5).mask(count==1, 0)
+		data = data[[f'{col} nanmedian' for col in columns] + [f'{col} fluctuations' for col in columns]]
+		data.columns = [col.replace(' nanmedian',' average') for col in data.columns]
 		
 		data = data.merge(position_data, left_index=True, right_index=True)
 		
@@ -106,6 +128,7 @@ if __name__ == '__main__':
 					scan_center = CONFIG_Z_SCAN_TO_FIND_FOCUS['SCAN_CENTER'],
 					z_length = CONFIG_Z_SCAN_TO_FIND_FOCUS['Z_LENGTH'],
 					z_step = CONFIG_Z_SCAN_TO_FIND_FOCUS['Z_STEP'],
+					acquire_channels = CONFIG_Z_SCAN_TO_FIND_FOCUS.get('ACQUIRE_CHANNELS'), # All the channels if not specified, use `'auto'` to find the active ones.
 				)
 				plot_z_scan_to_find_focus(Mariano)
 			finally:	